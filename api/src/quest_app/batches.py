@@ -0,0 +1,225 @@
+"""
+Пакетная генерация квестов
+
+Пакет (GenerationBatch) - набор задач GenerationJob, по одной на элемент
+входного списка. Задачи пакета лежат в общей очереди, поэтому их могут
+выполнять и обычные обработчики (run_quest_workers). Команда
+`python manage.py generate_quests` выполняет пакет сама: пул потоков с общим
+генератором (один клиент LLM), готовые квесты записываются пачками через
+bulk_create. Состояние хранится в БД, поэтому прерванный пакет продолжается
+повторным запуском команды с тем же файлом.
+"""
+
+import hashlib
+import json
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .jobs import (
+    build_job, claim_next_job, default_worker_name, generate_job_quest, requeue_orphaned_jobs,
+)
+from .llm_generator import get_quest_generator
+from .models import GenerationBatch, GenerationJob
+from .storage import store_quests_bulk
+
+REQUIRED_FIELDS = ('genre', 'hero', 'goal')
+
+
+def get_batch_config():
+    """Настройки пакетной генерации с значениями по умолчанию"""
+    config = {
+        'MAX_ITEMS': 1000,
+        'CONCURRENCY': 4,
+        'FLUSH_SIZE': 20,
+        'FLUSH_INTERVAL': 30.0,
+    }
+    config.update(getattr(settings, 'QUEST_BATCH', {}))
+    return config
+
+
+def validate_items(items):
+    """Проверяет элементы пакета; ValueError с номером первого ошибочного элемента"""
+    if not isinstance(items, list) or not items:
+        raise ValueError("items должен быть непустым списком")
+    max_items = get_batch_config()['MAX_ITEMS']
+    if max_items and len(items) > max_items:
+        raise ValueError(f"Слишком много элементов: {len(items)}, максимум {max_items}")
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            raise ValueError(f"Элемент {number}: ожидается объект")
+        missing = [field for field in REQUIRED_FIELDS if not item.get(field)]
+        if missing:
+            raise ValueError(f"Элемент {number}: необходимо указать {', '.join(missing)}")
+
+
+def item_key(item):
+    """Ключ элемента - хэш его параметров: повторы во входном файле не дублируются"""
+    canonical = json.dumps(item, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def create_batch(items, name='', source_hash=''):
+    """Создает пакет или дополняет существующий с тем же source_hash
+
+    Задачи создаются одним bulk_create только для элементов, которых в пакете
+    еще нет. Возвращает пару (batch, created_jobs).
+    """
+    validate_items(items)
+    with transaction.atomic():
+        batch = None
+        if source_hash:
+            batch = GenerationBatch.objects.filter(source_hash=source_hash).order_by('-id').first()
+        if batch is None:
+            batch = GenerationBatch.objects.create(name=name, source_hash=source_hash)
+
+        existing = set(batch.jobs.values_list('item_key', flat=True))
+        jobs = []
+        for item in items:
+            key = item_key(item)
+            if key not in existing:
+                existing.add(key)
+                jobs.append(build_job(item, batch=batch, item_key=key))
+        GenerationJob.objects.bulk_create(jobs, batch_size=500)
+    return batch, len(jobs)
+
+
+def read_items_file(path):
+    """Элементы пакета из JSONL-файла и хэш его содержимого"""
+    with open(path, 'rb') as f:
+        content = f.read()
+    items = []
+    for number, line in enumerate(content.decode('utf-8').splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Строка {number}: некорректный JSON ({e})")
+    return items, hashlib.sha256(content).hexdigest()
+
+
+def _generate_item(job, generator):
+    """Генерация одного элемента в потоке пула: (job, quest_data, error)"""
+    try:
+        quest_data = generate_job_quest(job, generator)
+        if 'error' in quest_data:
+            return job, None, quest_data['error']
+        return job, quest_data, None
+    except Exception as e:
+        traceback.print_exc()
+        return job, None, f"Внутренняя ошибка сервера: {str(e)}"
+    finally:
+        # У каждого потока свое соединение с БД
+        connections.close_all()
+
+
+def _fail_job(job, error):
+    print(f"❌ Задача {job.id}: {error}")
+    GenerationJob.objects.filter(id=job.id).update(
+        status=GenerationJob.STATUS_FAILED, error=error, finished_at=timezone.now())
+
+
+def _flush(buffer):
+    """Сохраняет накопленные квесты одной транзакцией и завершает их задачи"""
+    if not buffer:
+        return 0
+    try:
+        stored = store_quests_bulk([
+            {"quest_data": quest_data, "run": getattr(job, 'generation_run', None),
+             **{field: job.params[field] for field in REQUIRED_FIELDS}}
+            for job, quest_data in buffer
+        ])
+    except Exception as e:
+        traceback.print_exc()
+        for job, _ in buffer:
+            _fail_job(job, f"Ошибка сохранения квеста: {str(e)}")
+        return 0
+
+    now = timezone.now()
+    jobs = []
+    for (job, _), (quest, saved_file) in zip(buffer, stored):
+        job.status = GenerationJob.STATUS_DONE
+        job.quest = quest
+        job.saved_file = saved_file or ''
+        job.finished_at = now
+        jobs.append(job)
+    GenerationJob.objects.bulk_update(jobs, ['status', 'quest', 'saved_file', 'finished_at'])
+    return len(jobs)
+
+
+def run_batch(batch, concurrency=None, flush_size=None, flush_interval=None,
+              generator=None, worker_name=None, stop_event=None):
+    """Выполняет задачи пакета пулом из concurrency потоков
+
+    Задачи, брошенные предыдущим (завершившимся) запуском на этой машине,
+    возвращаются в очередь. Готовые квесты копятся в буфере и сохраняются,
+    когда их набирается flush_size или прошло flush_interval секунд.
+    Возвращает словарь {'done': ..., 'failed': ...} за этот запуск.
+    """
+    config = get_batch_config()
+    concurrency = concurrency or config['CONCURRENCY']
+    flush_size = flush_size or config['FLUSH_SIZE']
+    flush_interval = flush_interval if flush_interval is not None else config['FLUSH_INTERVAL']
+    generator = generator or get_quest_generator()
+    worker_name = worker_name or default_worker_name()
+
+    requeued = requeue_orphaned_jobs(batch)
+    if requeued:
+        print(f"🔁 Пакет {batch.id}: возвращено в очередь прерванных задач: {requeued}")
+
+    counts = {'done': 0, 'failed': 0}
+    buffer = []
+    buffer_started = None
+    in_flight = set()
+
+    print(f"📦 Пакет {batch.id}: генерация в {concurrency} потоков")
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='quest-batch') as executor:
+            while True:
+                while len(in_flight) < concurrency and (stop_event is None or not stop_event.is_set()):
+                    job = claim_next_job(worker_name, batch=batch)
+                    if job is None:
+                        break
+                    in_flight.add(executor.submit(_generate_item, job, generator))
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, timeout=flush_interval or None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, quest_data, error = future.result()
+                    if error:
+                        _fail_job(job, error)
+                        counts['failed'] += 1
+                    else:
+                        buffer.append((job, quest_data))
+                        buffer_started = buffer_started or time.monotonic()
+
+                if buffer and (len(buffer) >= flush_size or time.monotonic() - buffer_started >= flush_interval):
+                    # Буфер очищается до записи: прерывание во время записи не сохранит его дважды
+                    flushing, buffer, buffer_started = buffer, [], None
+                    _count_flush(counts, flushing)
+    finally:
+        # И при Ctrl+C или ошибке: готовые квесты уже оплачены, их задачи не должны
+        # остаться running и генерироваться заново при следующем запуске. Выход из
+        # with дождался задач в работе - их результаты тоже сохраняются
+        for future in in_flight:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                job, quest_data, error = future.result()
+                if error:
+                    _fail_job(job, error)
+                    counts['failed'] += 1
+                else:
+                    buffer.append((job, quest_data))
+        _count_flush(counts, buffer)
+    return counts
+
+
+def _count_flush(counts, buffer):
+    saved = _flush(buffer)
+    counts['done'] += saved
+    counts['failed'] += len(buffer) - saved
@@ -0,0 +1,15 @@
+"""
+Бенчмарки приложения: python manage.py benchmark <имя> [параметры]
+
+Каждый модуль бенчмарка определяет:
+  - DESCRIPTION: краткое описание;
+  - add_arguments(parser): собственные параметры командной строки;
+  - run(stdout, **options): выполняет замеры, печатает отчет и возвращает словарь результатов.
+"""
+
+BENCHMARKS = {
+    'generator_setup': 'quest_app.benchmarks.generator_setup',
+    'json_codec': 'quest_app.benchmarks.json_codec',
+    'pipeline': 'quest_app.benchmarks.pipeline',
+    'txt_parser': 'quest_app.benchmarks.txt_parser',
+}
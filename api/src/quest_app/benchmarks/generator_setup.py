@@ -0,0 +1,64 @@
+"""
+Накладные расходы на подготовку генератора в каждом запросе
+
+Сравнивает прежнее поведение (новый QuestGenerator на каждый запрос: чтение
+окружения, создание клиента модели и компиляция четырех цепочек) с общим
+генератором get_quest_generator().
+"""
+
+import contextlib
+import os
+import time
+
+from .. import llm_generator
+
+DESCRIPTION = "Стоимость подготовки генератора на запрос: до и после общего экземпляра"
+
+
+def add_arguments(parser):
+    parser.add_argument('--iterations', type=int, default=200, help="Количество имитируемых запросов")
+    parser.add_argument('--backend', default=None,
+                        help="QUEST_LLM_BACKEND на время замера (по умолчанию fake, если нет MISTRAL_API_KEY)")
+
+
+def _measure(factory, iterations):
+    # Диагностические print() генератора не засоряют отчет, но их стоимость учитывается
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            factory()
+        return (time.perf_counter() - started) / iterations
+
+
+def run(stdout, iterations=200, backend=None, **options):
+    backend = backend or ('mistral' if os.getenv('MISTRAL_API_KEY') else 'fake')
+    previous_backend = os.environ.get('QUEST_LLM_BACKEND')
+    os.environ['QUEST_LLM_BACKEND'] = backend
+
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            llm_generator.reload_quest_generator()
+
+        per_request = _measure(llm_generator.QuestGenerator, iterations)
+        shared = _measure(llm_generator.get_quest_generator, iterations)
+    finally:
+        if previous_backend is None:
+            os.environ.pop('QUEST_LLM_BACKEND', None)
+        else:
+            os.environ['QUEST_LLM_BACKEND'] = previous_backend
+        llm_generator.reload_quest_generator()
+
+    results = {
+        'backend': backend,
+        'iterations': iterations,
+        'per_request_us': per_request * 1e6,
+        'shared_us': shared * 1e6,
+        'speedup': per_request / shared if shared else None,
+    }
+
+    stdout.write(f"Бэкенд модели: {backend}, запросов: {iterations}")
+    stdout.write(f"  Новый QuestGenerator на запрос: {results['per_request_us']:10.1f} мкс")
+    stdout.write(f"  Общий get_quest_generator():    {results['shared_us']:10.3f} мкс")
+    if results['speedup']:
+        stdout.write(f"  Ускорение: x{results['speedup']:.0f}")
+    return results
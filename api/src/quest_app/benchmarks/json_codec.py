@@ -0,0 +1,85 @@
+"""
+Стоимость кодирования и разбора quest_data
+
+Сравнивает прежний путь UnicodeJSONField (json.dumps в get_prep_value и
+повторный json.dumps в JSONField.get_db_prep_value, при чтении - разбор
+дважды) с однократным кодированием через кодеки json и orjson на
+квестах из 10-100 сцен с русским текстом.
+"""
+
+import json
+import time
+
+from ..fake_llm import FILLER_TEXT, build_flow, build_scene_ids
+from ..json_codec import ORJSON_AVAILABLE, get_codec
+
+DESCRIPTION = "Кодирование/разбор quest_data: прежний UnicodeJSONField, json и orjson"
+
+
+def add_arguments(parser):
+    parser.add_argument('--iterations', type=int, default=200, help="Повторов для каждого размера квеста")
+    parser.add_argument('--sizes', default='10,25,50,100', help="Количество сцен в квестах через запятую")
+
+
+def build_quest(scene_count):
+    """Квест заданного размера: тексты сцен - несколько абзацев по-русски"""
+    scene_ids = build_scene_ids(scene_count)
+    flow = build_flow(scene_ids)
+    return {
+        "scenes": [
+            {
+                "scene_id": scene_id,
+                "text": " ".join([FILLER_TEXT] * 3),
+                "choices": [
+                    {"text": f"Отправиться дальше: {target}", "next_scene": target}
+                    for target in flow[scene_id]
+                ],
+            }
+            for scene_id in scene_ids
+        ]
+    }
+
+
+class LegacyCodec:
+    """Прежнее поведение поля: двойное кодирование и двойной разбор"""
+    name = 'legacy'
+
+    def dumps(self, value):
+        return json.dumps(json.dumps(value, ensure_ascii=False))
+
+    def loads(self, data):
+        return json.loads(json.loads(data))
+
+
+def _measure(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations
+
+
+def run(stdout, iterations=200, sizes='10,25,50,100', **options):
+    codecs = [LegacyCodec(), get_codec('json')]
+    if ORJSON_AVAILABLE:
+        codecs.append(get_codec('orjson'))
+    else:
+        stdout.write("orjson не установлен - сравниваются только legacy и json")
+
+    results = {'iterations': iterations, 'sizes': {}}
+    for size in [int(value) for value in sizes.split(',') if value.strip()]:
+        quest = build_quest(size)
+        size_results = {}
+        for codec in codecs:
+            encoded = codec.dumps(quest)
+            size_results[codec.name] = {
+                'bytes': len(encoded.encode('utf-8')),
+                'dumps_us': _measure(lambda: codec.dumps(quest), iterations) * 1e6,
+                'loads_us': _measure(lambda: codec.loads(encoded), iterations) * 1e6,
+            }
+        results['sizes'][size] = size_results
+
+        stdout.write(f"Сцен: {size}")
+        for name, entry in size_results.items():
+            stdout.write(f"  {name:7} {entry['bytes']:8} байт  запись {entry['dumps_us']:9.1f} мкс"
+                         f"  чтение {entry['loads_us']:9.1f} мкс")
+    return results
@@ -0,0 +1,234 @@
+"""
+Производительность конвейера генерации без обращения к Mistral AI
+
+Конвейер из четырех этапов работает на FakeQuestChatModel с заданной
+задержкой и объемом ответа. Для квестов из 5-100 сцен замеряются:
+  - генерация целиком (квестов в минуту, сцен в секунду);
+  - время каждого этапа (при --latency 0 - только накладные расходы
+    конвейера: промпты, разбор ответа, сборка квеста);
+  - разбор ответа модели JsonOutputParser (и json.loads для сравнения);
+  - сохранение квеста: store_quest (БД и файл) и отдельно save_quest_to_file
+    (в фоновом режиме выгрузки - постановка в очередь; запись очереди - flush_ms).
+Записи в БД откатываются, файлы пишутся во временную папку.
+
+Результат можно сохранить (--json) и сравнить с сохраненным ранее (--baseline):
+метрики времени, выросшие больше чем на --tolerance, считаются регрессией.
+"""
+
+import contextlib
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from ..fake_llm import FakeQuestChatModel
+from ..file_export import get_export_config, get_file_exporter
+from ..instrumentation import RunRecorder
+from ..langchain_generator import JsonOutputParser, LangChainQuestGenerator
+from ..rate_limit import reset_governor
+from ..storage import save_quest_to_file, store_quest
+
+DESCRIPTION = "Конвейер генерации на модели-заглушке: этапы, разбор JSON, сохранение"
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baselines', 'pipeline.json')
+# Разница меньше этой не считается регрессией: шум таймера на быстрых операциях
+MIN_REGRESSION_MS = 1.0
+
+PARAMS = {"genre": "benchmark", "hero": "тестовый герой", "goal": "пройти замер"}
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', default='5,10,25,50,100', help="Количество сцен в квестах через запятую")
+    parser.add_argument('--repeat', type=int, default=10, help="Генераций каждого размера")
+    parser.add_argument('--latency', type=float, default=0.0, help="Задержка ответа модели, сек")
+    parser.add_argument('--seconds-per-token', type=float, default=0.0,
+                        help="Дополнительная задержка на токен ответа, сек")
+    parser.add_argument('--text-paragraphs', type=int, default=1, help="Абзацев текста в каждой сцене")
+    parser.add_argument('--content-mode', default=None, help="Режим этапа 3: single или parallel")
+    parser.add_argument('--baseline', nargs='?', const=BASELINE_PATH, default=None,
+                        help="Сравнить с сохраненными результатами (по умолчанию baselines/pipeline.json)")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help="Допустимый рост времени относительно базовой линии (0.5 = 50%%)")
+
+
+def _median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def _generate(generator, scene_count):
+    """Одна генерация с записью измерений этапов (без сохранения в БД)"""
+    recorder = RunRecorder({"genre": PARAMS['genre'], "scene_count": scene_count})
+    with recorder.activate():
+        result = generator.generate_quest(scene_count=scene_count, **PARAMS)
+    recorder.finish(result)
+    if 'error' in result:
+        raise CommandError(f"Генерация не удалась: {result['error']}")
+    return result, recorder
+
+
+def _measure_generation(generator, scene_count, repeat):
+    _generate(generator, scene_count)  # прогрев: первые вызовы цепочек дороже
+    totals, stages, quest = [], {}, None
+    for _ in range(repeat):
+        quest, recorder = _generate(generator, scene_count)
+        totals.append(recorder.wall_seconds * 1000)
+        for name, stats in recorder.stages.items():
+            entry = stages.setdefault(name, {'wall': [], 'llm_calls': stats.llm_calls,
+                                             'tokens': stats.prompt_tokens + stats.completion_tokens})
+            entry['wall'].append(stats.wall_seconds * 1000)
+
+    e2e_ms = statistics.median(totals)
+    scenes = len(quest.get('scenes', []))
+    return quest, {
+        'scenes': scenes,
+        'e2e_ms': e2e_ms,
+        'quests_per_minute': 60000 / e2e_ms if e2e_ms else None,
+        'scenes_per_second': scenes * 1000 / e2e_ms if e2e_ms else None,
+        'stages': {
+            name: {'wall_ms': statistics.median(entry['wall']),
+                   'llm_calls': entry['llm_calls'], 'tokens': entry['tokens']}
+            for name, entry in stages.items()
+        },
+    }
+
+
+def _measure_parse(quest, repeat):
+    """Разбор ответа размером с квест (ответ этапа 4 содержит квест целиком)"""
+    text = json.dumps({"validation_result": "passed", "final_quest": quest}, ensure_ascii=False)
+    parser = JsonOutputParser()
+    iterations = max(repeat, 20)
+    return {
+        'bytes': len(text.encode('utf-8')),
+        'parser_us': _median_ms(lambda: parser.parse(text), iterations) * 1000,
+        'json_us': _median_ms(lambda: json.loads(text), iterations) * 1000,
+    }
+
+
+def _measure_persistence(quest, repeat):
+    """store_quest и отдельно save_quest_to_file; записи БД откатываются
+
+    Файлы пишутся во временную папку. При MODE=background save_quest_to_file
+    только ставит квест в очередь, время записи очереди на диск - flush_ms.
+    """
+    with tempfile.TemporaryDirectory() as location, \
+            override_settings(QUEST_FILE_EXPORT={**get_export_config(), 'LOCATION': location}):
+        exporter = get_file_exporter()
+        with transaction.atomic():
+            store_ms = _median_ms(lambda: store_quest(quest, **PARAMS), repeat)
+            transaction.set_rollback(True)
+        exporter.flush()
+        file_ms = _median_ms(lambda: save_quest_to_file(quest, **PARAMS), repeat)
+        started = time.perf_counter()
+        exporter.flush()
+        flush_ms = (time.perf_counter() - started) * 1000
+    return {'store_ms': store_ms, 'file_ms': file_ms, 'db_ms': max(store_ms - file_ms, 0.0),
+            'flush_ms': flush_ms, 'export_mode': exporter.mode}
+
+
+def _timing_metrics(size_results):
+    """Метрики времени одного размера: путь -> значение в мс"""
+    metrics = {
+        'e2e_ms': size_results['e2e_ms'],
+        'parse.parser_ms': size_results['parse']['parser_us'] / 1000,
+        'persist.store_ms': size_results['persist']['store_ms'],
+        'persist.file_ms': size_results['persist']['file_ms'],
+    }
+    for name, entry in size_results['stages'].items():
+        metrics[f'stages.{name}.wall_ms'] = entry['wall_ms']
+    return metrics
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Список регрессий: (размер, метрика, было, стало)"""
+    regressions = []
+    for size, size_results in results['sizes'].items():
+        baseline_size = baseline.get('sizes', {}).get(size)
+        if not baseline_size:
+            continue
+        previous = _timing_metrics(baseline_size)
+        for metric, value in _timing_metrics(size_results).items():
+            before = previous.get(metric)
+            if before is None:
+                continue
+            if value > before * (1 + tolerance) and value - before > MIN_REGRESSION_MS:
+                regressions.append((size, metric, before, value))
+    return regressions
+
+
+def run(stdout, sizes='5,10,25,50,100', repeat=10, latency=0.0, seconds_per_token=0.0,
+        text_paragraphs=1, content_mode=None, baseline=None, tolerance=0.5, **options):
+    config = {
+        'latency': latency,
+        'seconds_per_token': seconds_per_token,
+        'text_paragraphs': text_paragraphs,
+        'content_mode': content_mode or os.getenv('QUEST_CONTENT_MODE', 'single'),
+        'repeat': repeat,
+    }
+    model = FakeQuestChatModel(latency=latency, seconds_per_token=seconds_per_token,
+                               text_paragraphs=text_paragraphs)
+    results = {'config': config, 'sizes': {}}
+
+    # Ограничитель запросов выключен: замеряется сам конвейер
+    with override_settings(QUEST_LLM_RATE_LIMIT={}):
+        reset_governor()
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                generator = LangChainQuestGenerator(llm=model, content_mode=config['content_mode'])
+            for size in [int(value) for value in sizes.split(',') if value.strip()]:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    quest, size_results = _measure_generation(generator, size, repeat)
+                    size_results['parse'] = _measure_parse(quest, repeat)
+                    size_results['persist'] = _measure_persistence(quest, repeat)
+                results['sizes'][str(size)] = size_results
+                _write_size(stdout, size, size_results)
+        finally:
+            reset_governor()
+
+    if baseline:
+        _check_baseline(stdout, results, baseline, tolerance)
+    return results
+
+
+def _write_size(stdout, size, entry):
+    stdout.write(f"Сцен: {size} (в квесте {entry['scenes']})")
+    stdout.write(f"  Генерация:  {entry['e2e_ms']:9.1f} мс  {entry['quests_per_minute']:8.1f} квестов/мин"
+                 f"  {entry['scenes_per_second']:8.1f} сцен/с")
+    for name, stage in entry['stages'].items():
+        stdout.write(f"    {name:10} {stage['wall_ms']:9.2f} мс  вызовов {stage['llm_calls']:3}"
+                     f"  токенов {stage['tokens']:7}")
+    parse = entry['parse']
+    stdout.write(f"  Разбор:     {parse['bytes']:9} байт  JsonOutputParser {parse['parser_us']:9.1f} мкс"
+                 f"  json.loads {parse['json_us']:9.1f} мкс")
+    persist = entry['persist']
+    stdout.write(f"  Сохранение: {persist['store_ms']:9.2f} мс  (файл {persist['file_ms']:.2f} мс,"
+                 f" БД {persist['db_ms']:.2f} мс; выгрузка {persist['export_mode']},"
+                 f" запись очереди {persist['flush_ms']:.2f} мс)")
+
+
+def _check_baseline(stdout, results, path, tolerance):
+    try:
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError) as e:
+        raise CommandError(f"Не удалось прочитать базовую линию {path}: {e}")
+
+    if baseline.get('config') != results['config']:
+        stdout.write(f"⚠️ Параметры замера отличаются от базовой линии: {baseline.get('config')}")
+
+    regressions = compare_with_baseline(results, baseline, tolerance)
+    if not regressions:
+        stdout.write(f"✅ Регрессий относительно {path} нет (допуск {tolerance:.0%})")
+        return
+    for size, metric, before, after in regressions:
+        stdout.write(f"❌ Сцен {size}: {metric} {before:.2f} -> {after:.2f} мс")
+    raise CommandError(f"Регрессий производительности: {len(regressions)}")
@@ -0,0 +1,172 @@
+"""
+Скорость разбора txt файлов с параметрами квеста
+
+Сравнивает прежний parse_txt_file (до 13 поисков по шаблонам на каждую
+строку, нижний регистр каждой строки, второй проход при неудаче) с
+txt_parser: поиск ключевых слов по целым кускам текста (str.find) и один проход, в том
+числе по потоку кусков байт. Входы - файлы в несколько МБ, где поля в конце (худший
+случай для досрочной остановки) или отсутствуют. Перед замером результаты
+обоих разборов сверяются на наборе случайных файлов.
+"""
+
+import io
+import random
+import re
+import time
+
+from ..txt_parser import CHUNK_SIZE, FIELD_PATTERNS, iter_text_chunks, parse_text_chunks, parse_txt_file
+
+DESCRIPTION = "Разбор txt файлов: прежний parse_txt_file и однопроходный txt_parser"
+
+FILLER_LINES = [
+    "Над старым городом медленно поднимался туман, скрывая крыши домов.",
+    "Torches flickered along the walls of the abandoned fortress.",
+    "Путник остановился у колодца и долго смотрел на темную воду.",
+    "Вдали слышался звон колоколов и крики торговцев на площади.",
+    "",
+]
+FIELD_LINES = ["Жанр: фэнтези", "Главный герой: молодой маг", "Цель: найти древний артефакт"]
+
+
+def legacy_parse_txt_file(file_content):
+    """Прежняя реализация views.parse_txt_file (для сравнения)"""
+    lines = file_content.split('\n')
+    parsed_data = {'genre': '', 'hero': '', 'goal': ''}
+    genre_patterns = [
+        r'жанр\s*[:\s]\s*([^:\n]+?)(?:\s*главный|\s*герой|\s*персонаж|\s*цель|\s*задача|\s*миссия|$)',
+        r'genre\s*[:\s]\s*([^:\n]+?)(?:\s*hero|\s*protagonist|\s*goal|\s*objective|$)',
+        r'стиль\s*[:\s]\s*([^:\n]+?)(?:\s*главный|\s*герой|\s*персонаж|\s*цель|\s*задача|$)',
+    ]
+    hero_patterns = [
+        r'главный\s+герой\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
+        r'герой\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
+        r'персонаж\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
+        r'protagonist\s*[:\s]\s*([^:\n]+?)(?:\s*goal|\s*objective|$)',
+        r'hero\s*[:\s]\s*([^:\n]+?)(?:\s*goal|\s*objective|$)',
+    ]
+    goal_patterns = [
+        r'цель\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'задача\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'миссия\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'goal\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'objective\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+    ]
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        line_lower = line.lower()
+        for field, patterns in (('genre', genre_patterns), ('hero', hero_patterns), ('goal', goal_patterns)):
+            if not parsed_data[field]:
+                for pattern in patterns:
+                    match = re.search(pattern, line_lower, re.IGNORECASE)
+                    if match:
+                        parsed_data[field] = match.group(1).strip(' .,()«»"')
+                        break
+    if not all(parsed_data.values()):
+        non_empty_lines = [line.strip() for line in lines if line.strip()]
+        if len(non_empty_lines) >= 3:
+            for field, line in zip(('genre', 'hero', 'goal'), non_empty_lines):
+                if not parsed_data[field]:
+                    parsed_data[field] = line if ':' not in line else line.split(':', 1)[1].strip()
+    return parsed_data
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', default='1,4,16', help="Размеры файлов в МБ через запятую")
+    parser.add_argument('--repeat', type=int, default=3, help="Повторов каждого замера")
+    parser.add_argument('--samples', type=int, default=5000, help="Случайных файлов для сверки результатов")
+
+
+def _random_file(rng):
+    """Небольшой файл из случайных фрагментов с ключевыми словами всех шаблонов"""
+    keywords = [re.match(r'[^\\]+', pattern).group(0) for patterns in FIELD_PATTERNS.values()
+                for pattern in patterns] + ["Главный герой", "главный"]
+    values = ["фэнтези", "Молодой маг", "спасти город.", "«Киберпанк»", "(детектив)", "", "x"]
+    separators = [":", ": ", " ", " - ", "  :  ", ""]
+    lines = []
+    for _ in range(rng.randint(1, 5)):
+        parts = []
+        for _ in range(rng.randint(1, 3)):
+            keyword = rng.choice(keywords)
+            keyword = keyword.upper() if rng.random() < 0.2 else keyword.capitalize()
+            parts.append(f"{keyword}{rng.choice(separators)}{rng.choice(values)}")
+        if rng.random() < 0.2:
+            parts = [rng.choice(FILLER_LINES)]
+        lines.append(" ".join(parts))
+    return "\n".join(lines)
+
+
+def check_equivalence(samples, seed=42):
+    """Файлы, на которых прежний и новый разбор дают разный результат"""
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(samples):
+        content = _random_file(rng)
+        if legacy_parse_txt_file(content) != parse_txt_file(content):
+            mismatches.append(content)
+    return mismatches
+
+
+def build_input(size_mb, fields=True):
+    """Текст около size_mb МБ; поля (если нужны) - в последних строках"""
+    lines = []
+    size = 0
+    target = size_mb * 1024 * 1024
+    index = 0
+    while size < target:
+        line = FILLER_LINES[index % len(FILLER_LINES)]
+        lines.append(line)
+        size += len(line.encode('utf-8')) + 1
+        index += 1
+    if fields:
+        lines.extend(FIELD_LINES)
+    return "\n".join(lines)
+
+
+def _measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def _stream(data):
+    def parse():
+        buffer = io.BytesIO(data)
+        chunks = iter(lambda: buffer.read(CHUNK_SIZE), b'')
+        return parse_text_chunks(iter_text_chunks(chunks))
+    return parse
+
+
+def run(stdout, sizes='1,4,16', repeat=3, samples=5000, **options):
+    mismatches = check_equivalence(samples)
+    stdout.write(f"Сверка на {samples} случайных файлах: расхождений {len(mismatches)}")
+    for content in mismatches[:3]:
+        stdout.write(f"  {content!r}")
+
+    results = {'samples': samples, 'mismatches': len(mismatches), 'inputs': {}}
+    for size_mb in [int(value) for value in sizes.split(',') if value.strip()]:
+        for variant, fields in (('tail', True), ('missing', False)):
+            text = build_input(size_mb, fields)
+            data = text.encode('utf-8')
+            megabytes = len(data) / (1024 * 1024)
+            legacy_seconds, legacy = _measure(lambda: legacy_parse_txt_file(text), repeat)
+            text_seconds, parsed = _measure(lambda: parse_txt_file(text), repeat)
+            stream_seconds, streamed = _measure(_stream(data), repeat)
+            entry = {
+                'bytes': len(data),
+                'legacy_mb_s': megabytes / legacy_seconds,
+                'text_mb_s': megabytes / text_seconds,
+                'stream_mb_s': megabytes / stream_seconds,
+                'speedup': legacy_seconds / text_seconds,
+                'same_result': legacy == parsed == streamed,
+            }
+            results['inputs'][f"{size_mb}mb_{variant}"] = entry
+            stdout.write(f"{size_mb} МБ, поля {'в конце' if fields else 'отсутствуют'}: "
+                         f"прежний {entry['legacy_mb_s']:7.1f} МБ/с  новый {entry['text_mb_s']:7.1f} МБ/с  "
+                         f"поток {entry['stream_mb_s']:7.1f} МБ/с  ускорение x{entry['speedup']:.1f}"
+                         f"{'' if entry['same_result'] else '  РЕЗУЛЬТАТ ОТЛИЧАЕТСЯ'}")
+    return results
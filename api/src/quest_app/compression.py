@@ -0,0 +1,234 @@
+"""
+Сжатое хранение quest_data
+
+Включается настройкой QUEST_DATA_COMPRESSION (ALGORITHM: none, zlib или zstd).
+Сжатое значение хранится в том же JSON-столбце как JSON-строка вида
+"qz1:<алгоритм>:<id словаря>:<данные в base85>", поэтому столбец остается
+валидным JSON, а сжатые и несжатые строки могут храниться вместе.
+UnicodeJSONField(compress=True) сжимает и распаковывает значения прозрачно.
+
+Словарь сжатия обучается на уже сохраненных квестах (python manage.py
+compress_quest_data --train) и хранится в таблице CompressionDictionary -
+он общий для всех процессов. Запросы к ключам JSON (quest_data__scenes)
+для сжатых строк не работают: сводка квеста хранится в отдельных столбцах.
+"""
+
+import base64
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.conf import settings
+from django.db import models
+from django.db.models.functions import Cast
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+ENVELOPE_PREFIX = "qz1:"
+ALGORITHMS = ('zlib', 'zstd')
+DEFAULT_LEVELS = {'zlib': 9, 'zstd': 12}
+DICTIONARY_SIZE = 32 * 1024          # окно zlib - 32 КБ, больше словарь не используется
+ACTIVE_DICTIONARY_TTL = 60           # сек, через сколько процесс заметит новый словарь
+
+
+def get_compression_config():
+    """Настройки сжатия с значениями по умолчанию"""
+    config = {
+        'ALGORITHM': 'none',
+        'LEVEL': None,
+        'DICTIONARY': True,
+        'MIN_SIZE': 1024,
+    }
+    config.update(getattr(settings, 'QUEST_DATA_COMPRESSION', {}))
+    config['ALGORITHM'] = (config['ALGORITHM'] or 'none').lower()
+    return config
+
+
+def is_envelope(value):
+    return isinstance(value, str) and value.startswith(ENVELOPE_PREFIX)
+
+
+def _check_algorithm(algorithm):
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Неизвестный алгоритм сжатия: {algorithm}")
+    if algorithm == 'zstd' and not ZSTD_AVAILABLE:
+        raise ValueError("Сжатие zstd недоступно: установите пакет zstandard")
+
+
+def _compress(algorithm, raw, dictionary, level):
+    if algorithm == 'zstd':
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compress(raw)
+    compressor = zlib.compressobj(level, zdict=dictionary) if dictionary else zlib.compressobj(level)
+    return compressor.compress(raw) + compressor.flush()
+
+
+def _decompress(algorithm, packed, dictionary):
+    if algorithm == 'zstd':
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(packed)
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(packed) + decompressor.flush()
+
+
+# Словари неизменяемы, поэтому кэшируются по id без ограничения времени
+_dictionaries = {}
+_active_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def _get_dictionary(dictionary_id):
+    data = _dictionaries.get(dictionary_id)
+    if data is None:
+        from .models import CompressionDictionary
+        data = bytes(CompressionDictionary.objects.values_list('data', flat=True).get(id=dictionary_id))
+        with _dictionaries_lock:
+            _dictionaries[dictionary_id] = data
+    return data
+
+
+def _get_active_dictionary_id(algorithm):
+    """Последний обученный словарь для алгоритма (0 - словаря нет)"""
+    cached = _active_dictionaries.get(algorithm)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    from .models import CompressionDictionary
+    dictionary_id = (CompressionDictionary.objects.filter(algorithm=algorithm)
+                     .order_by('-id').values_list('id', flat=True).first()) or 0
+    with _dictionaries_lock:
+        _active_dictionaries[algorithm] = (time.monotonic() + ACTIVE_DICTIONARY_TTL, dictionary_id)
+    return dictionary_id
+
+
+def reset_dictionary_cache():
+    with _dictionaries_lock:
+        _dictionaries.clear()
+        _active_dictionaries.clear()
+
+
+def compress_text(text):
+    """Сжимает JSON-текст в конверт или возвращает None (сжатие выключено или не выгодно)"""
+    config = get_compression_config()
+    algorithm = config['ALGORITHM']
+    if algorithm == 'none':
+        return None
+    _check_algorithm(algorithm)
+
+    raw = text.encode('utf-8')
+    if len(raw) < config['MIN_SIZE']:
+        return None
+
+    dictionary_id = _get_active_dictionary_id(algorithm) if config['DICTIONARY'] else 0
+    dictionary = _get_dictionary(dictionary_id) if dictionary_id else None
+    level = config['LEVEL'] or DEFAULT_LEVELS[algorithm]
+    packed = _compress(algorithm, raw, dictionary, level)
+
+    envelope = f"{ENVELOPE_PREFIX}{algorithm}:{dictionary_id}:{base64.b85encode(packed).decode('ascii')}"
+    return envelope if len(envelope) < len(raw) else None
+
+
+def decompress_text(envelope):
+    """JSON-текст из конверта compress_text"""
+    algorithm, dictionary_id, payload = envelope[len(ENVELOPE_PREFIX):].split(':', 2)
+    _check_algorithm(algorithm)
+    dictionary_id = int(dictionary_id)
+    dictionary = _get_dictionary(dictionary_id) if dictionary_id else None
+    return _decompress(algorithm, base64.b85decode(payload), dictionary).decode('utf-8')
+
+
+def build_zlib_dictionary(samples, size=DICTIONARY_SIZE):
+    """Словарь zlib: частые слова и фрагменты JSON из образцов
+
+    zlib ищет совпадения в конце словаря дешевле, поэтому самые ценные
+    фрагменты (по частоте и длине) располагаются последними.
+    """
+    document_frequency = Counter()
+    frequency = Counter()
+    for sample in samples:
+        tokens = re.findall(r'"[a-z_]+":\[?\{?"?|\w+|[^\w\s]+', sample)
+        frequency.update(tokens)
+        document_frequency.update(set(tokens))
+
+    min_documents = 2 if len(samples) > 1 else 1
+    candidates = [token for token, count in document_frequency.items() if count >= min_documents]
+    candidates.sort(key=lambda token: frequency[token] * len(token.encode('utf-8')), reverse=True)
+
+    chosen = []
+    used = 0
+    for token in candidates:
+        token_size = len(token.encode('utf-8')) + 1
+        if used + token_size > size:
+            break
+        chosen.append(token)
+        used += token_size
+    return " ".join(reversed(chosen)).encode('utf-8')
+
+
+def train_dictionary(samples, algorithm, size=DICTIONARY_SIZE):
+    """Обучает словарь на JSON-текстах квестов и возвращает его байты"""
+    _check_algorithm(algorithm)
+    if not samples:
+        raise ValueError("Нет квестов для обучения словаря")
+    if algorithm == 'zstd':
+        return zstandard.train_dictionary(size, [sample.encode('utf-8') for sample in samples]).as_bytes()
+    return build_zlib_dictionary(samples, size)
+
+
+class StoredSize(models.Func):
+    """Размер значения столбца в байтах, как оно хранится в БД"""
+    output_field = models.BigIntegerField()
+    template = "LENGTH(CAST(%(expressions)s AS BLOB))"
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="OCTET_LENGTH((%(expressions)s)::text)",
+                           **extra_context)
+
+
+def storage_report(quest_model):
+    """Количество квестов, из них сжатых, и суммарный объем quest_data в байтах"""
+    totals = quest_model.objects.aggregate(
+        rows=models.Count('id'),
+        stored_bytes=models.Sum(StoredSize('quest_data')),
+    )
+    totals['stored_bytes'] = totals['stored_bytes'] or 0
+    totals['compressed_rows'] = (quest_model.objects
+                                 .annotate(stored_text=Cast('quest_data', models.TextField()))
+                                 .filter(stored_text__startswith=f'"{ENVELOPE_PREFIX}').count())
+    return totals
+
+
+def recompress_quests(quest_model, batch_size=500):
+    """Перезаписывает quest_data всех квестов по текущим настройкам сжатия
+
+    Значение читается и записывается через UnicodeJSONField, поэтому строки
+    сжимаются (или распаковываются при ALGORITHM=none) самим полем.
+    """
+    batch = []
+    rewritten = 0
+    quests = quest_model.objects.only('id', 'quest_data').order_by('id')
+    for quest in quests.iterator(chunk_size=batch_size):
+        batch.append(quest)
+        if len(batch) >= batch_size:
+            rewritten += quest_model.objects.bulk_update(batch, ['quest_data'])
+            batch = []
+    if batch:
+        rewritten += quest_model.objects.bulk_update(batch, ['quest_data'])
+    return rewritten
+
+
+def format_report(before, after):
+    """Строки отчета об изменении объема quest_data"""
+    saved = before['stored_bytes'] - after['stored_bytes']
+    percent = 100 * saved / before['stored_bytes'] if before['stored_bytes'] else 0
+    return [
+        f"Квестов: {after['rows']}, сжато: {after['compressed_rows']}",
+        f"Объем quest_data: {before['stored_bytes']} -> {after['stored_bytes']} байт",
+        f"Сэкономлено: {saved} байт ({percent:.1f}%)",
+    ]
@@ -0,0 +1,212 @@
+"""
+Детерминированная замена ChatMistralAI для офлайн-запуска и нагрузочных тестов
+
+Модель определяет этап по системному промпту и строит корректный JSON-ответ
+из данных, переданных в промпт (JSON или сжатая запись prompt_compaction),
+поэтому весь конвейер `prompt | llm | JsonOutputParser` работает без ключа
+Mistral AI.
+Включается переменной окружения QUEST_LLM_BACKEND=fake.
+"""
+
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FILLER_TEXT = (
+    "Вокруг царит напряженная тишина, и каждый шаг отзывается гулким эхом. "
+    "Герой внимательно осматривается, прислушиваясь к далеким звукам и пытаясь "
+    "понять, какая опасность скрывается впереди. Воздух пропитан запахом пыли и "
+    "старого камня, а слабый свет едва освещает путь. Решение нужно принять "
+    "быстро, ведь от него зависит исход всего путешествия."
+)
+
+
+def _extract_json(text: str, marker: str) -> Dict[str, Any]:
+    """Находит JSON-объект, следующий в промпте за маркером"""
+    position = text.find(marker)
+    if position < 0:
+        return {}
+    start = text.find('{', position)
+    if start < 0:
+        return {}
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+    except ValueError:
+        return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _section(text: str, marker: str) -> List[str]:
+    """Строки блока промпта после маркера (до пустой строки)"""
+    position = text.find(marker)
+    if position < 0:
+        return []
+    block = text[position + len(marker):].strip().split("\n\n", 1)[0]
+    return block.splitlines()
+
+
+def _parse_compact_structure(text: str) -> Dict[str, Any]:
+    """Структурная карта из сжатой записи prompt_compaction.encode_structure"""
+    scenes, flow = [], {}
+    for line in _section(text, "Основа:"):
+        match = re.match(r"^(\S+) \[([^\]]*)\]: (.*) -> (.*)$", line)
+        if match:
+            scene_id, scene_type, concept, targets = match.groups()
+            scenes.append({"scene_id": scene_id, "type": scene_type, "concept": concept})
+            flow[scene_id] = [target.strip() for target in targets.split(",") if target.strip()]
+    return {"scenes": scenes, "flow": flow}
+
+
+def _parse_compact_plan(text: str) -> List[Dict[str, Any]]:
+    """План из сжатой записи prompt_compaction.encode_plan"""
+    plan = []
+    for line in _section(text, "План:"):
+        choice = re.match(r"^\s+- (.*) -> (\S+)$", line)
+        if choice and plan:
+            plan[-1]["planned_choices"].append({"choice_text": choice.group(1), "next_scene": choice.group(2)})
+            continue
+        scene = re.match(r"^([A-Za-z0-9_-]+): (.*)$", line)
+        if scene:
+            plan.append({"scene_id": scene.group(1), "situation": scene.group(2), "planned_choices": []})
+    return plan
+
+
+def build_scene_ids(scene_count: int) -> List[str]:
+    """Идентификаторы сцен: start, scene_1 ... scene_N, quest_end"""
+    scene_count = max(int(scene_count), 3)
+    middle = [f"scene_{index}" for index in range(1, scene_count - 1)]
+    return ["start"] + middle + ["quest_end"]
+
+
+def build_flow(scene_ids: List[str]) -> Dict[str, List[str]]:
+    """Ациклический граф: каждая сцена ведет на две следующие"""
+    flow = {}
+    last = len(scene_ids) - 1
+    for index, scene_id in enumerate(scene_ids):
+        if index == last:
+            flow[scene_id] = [scene_id]
+            continue
+        targets = [scene_ids[min(index + 1, last)], scene_ids[min(index + 2, last)]]
+        flow[scene_id] = targets
+    return flow
+
+
+class FakeQuestChatModel(BaseChatModel):
+    """Чат-модель, отвечающая заранее известными квестами"""
+
+    latency: float = 0.0
+    """Искусственная задержка ответа в секундах"""
+
+    seconds_per_token: float = 0.0
+    """Дополнительная задержка на каждый токен ответа (имитация скорости вывода)"""
+
+    text_paragraphs: int = 1
+    """Сколько абзацев текста в каждой сцене этапа 3 (объем ответа)"""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-quest"
+
+    def _respond(self, messages: List[BaseMessage]) -> Dict[str, Any]:
+        prompt = "\n".join(str(message.content) for message in messages)
+
+        if "ЭТАП 1" in prompt:
+            match = re.search(r"Придумай\s+(\d+)", prompt)
+            scene_ids = build_scene_ids(int(match.group(1)) if match else 10)
+            return {
+                "quest_structure": {
+                    "theme": "Тестовый квест",
+                    "scenes": [
+                        {"scene_id": scene_id, "type": "decision", "concept": f"Ситуация {scene_id}"}
+                        for scene_id in scene_ids
+                    ],
+                    "flow": build_flow(scene_ids),
+                }
+            }
+
+        if "ЭТАП 2" in prompt:
+            structure = (_extract_json(prompt, "Основа:").get("quest_structure")
+                         or _parse_compact_structure(prompt))
+            scene_ids = [scene["scene_id"] for scene in structure.get("scenes", [])]
+            flow = structure.get("flow") or build_flow(scene_ids)
+            return {
+                "detailed_plan": [
+                    {
+                        "scene_id": scene_id,
+                        "situation": f"Ситуация {scene_id}",
+                        "choice_strategy": "развилка",
+                        "planned_choices": [
+                            {
+                                "choice_text": f"Отправиться в {target}",
+                                "choice_type": "action",
+                                "next_scene": target,
+                                "reasoning": "Логичное продолжение пути",
+                            }
+                            for target in flow.get(scene_id, ["quest_end"])
+                        ],
+                    }
+                    for scene_id in scene_ids
+                ]
+            }
+
+        if "ЭТАП 3" in prompt:
+            plan = _extract_json(prompt, "План:").get("detailed_plan") or _parse_compact_plan(prompt)
+            return {
+                "scenes": [
+                    {
+                        "scene_id": entry["scene_id"],
+                        "text": " ".join([FILLER_TEXT] * max(1, self.text_paragraphs)),
+                        "choices": [
+                            {"text": choice.get("choice_text", ""), "next_scene": choice.get("next_scene")}
+                            for choice in entry.get("planned_choices", [])
+                        ],
+                    }
+                    for entry in plan
+                ]
+            }
+
+        quest = _extract_json(prompt, "Квест:")
+        return {
+            "validation_result": "passed",
+            "issues_found": [],
+            "corrections_made": [],
+            "final_quest": quest,
+        }
+
+    def _make_result(self, messages: List[BaseMessage]) -> ChatResult:
+        content = json.dumps(self._respond(messages), ensure_ascii=False)
+        # Расход токенов оценивается по длине текста (~3 символа на токен)
+        input_tokens = sum(len(str(message.content)) for message in messages) // 3 + 1
+        output_tokens = len(content) // 3 + 1
+        message = AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay(self, result: ChatResult) -> float:
+        output_tokens = result.generations[0].message.usage_metadata["output_tokens"]
+        return self.latency + self.seconds_per_token * output_tokens
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        result = self._make_result(messages)
+        delay = self._delay(result)
+        if delay:
+            time.sleep(delay)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        result = self._make_result(messages)
+        delay = self._delay(result)
+        if delay:
+            await asyncio.sleep(delay)
+        return result
@@ -1,27 +1,64 @@
 from django.db import models
-import json
+from django.db.models import expressions
+from django.db.models.fields.json import KeyTransform
+
+from . import compression
+from .json_codec import get_codec
+
 
 class UnicodeJSONField(models.JSONField):
-    """Кастомное JSON поле с поддержкой Unicode"""
-    
-    def get_prep_value(self, value):
+    """JSON поле с поддержкой Unicode и настраиваемым кодеком (QUEST_JSON_CODEC)
+
+    Значение кодируется и разбирается ровно один раз. Строки, сохраненные
+    прежней версией поля (JSON-объект, закодированный повторно как JSON-строка),
+    при чтении распаковываются. При compress=True значение сжимается по
+    настройке QUEST_DATA_COMPRESSION (см. compression.py).
+    """
+
+    def __init__(self, *args, compress=False, **kwargs):
+        self.compress = compress
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.compress:
+            kwargs['compress'] = True
+        return name, path, args, kwargs
+
+    def get_db_prep_value(self, value, connection, prepared=False):
         """Подготовка значения для сохранения в БД"""
+        if not prepared:
+            value = self.get_prep_value(value)
+        if isinstance(value, expressions.Value) and isinstance(value.output_field, models.JSONField):
+            value = value.value
+        elif hasattr(value, 'as_sql'):
+            return value
         if value is None:
             return value
-        return json.dumps(value, ensure_ascii=False)
-    
+        codec = get_codec()
+        if self.compress:
+            envelope = compression.compress_text(codec.dumps(value))
+            if envelope is not None:
+                value = envelope
+        if connection.vendor == 'postgresql':
+            # Для jsonb используется собственный адаптер драйвера
+            return connection.ops.adapt_json_value(value, self.encoder)
+        return codec.dumps(value)
+
     def from_db_value(self, value, expression, connection):
         """Извлечение значения из БД"""
         if value is None:
             return value
-        if isinstance(value, str):
-            return json.loads(value)
-        return value
-    
-    def to_python(self, value):
-        """Преобразование в Python объект"""
-        if value is None:
+        # Значение ключа (KeyTransform) некоторые БД уже возвращают разобранным
+        if isinstance(expression, KeyTransform) and not isinstance(value, str):
+            return value
+        codec = get_codec()
+        try:
+            data = codec.loads(value)
+            if compression.is_envelope(data):
+                data = codec.loads(compression.decompress_text(data))
+            elif isinstance(data, str) and data[:1] in ('{', '['):
+                data = codec.loads(data)
+        except ValueError:
             return value
-        if isinstance(value, str):
-            return json.loads(value)
-        return value 
\ No newline at end of file
+        return data
@@ -0,0 +1,308 @@
+"""
+Выгрузка квестов в файлы в фоновом потоке
+
+save_quest_to_file только ставит квест в очередь и сразу возвращает имя
+файла: запись на диск выполняет поток-писатель процесса, поэтому ответ на
+запрос не ждет диска. Настройка - QUEST_FILE_EXPORT:
+  - MODE: background (очередь и поток-писатель) или sync (запись сразу, как раньше);
+  - FORMAT: json - файл на квест, LOCATION/<дата>/<2 hex>/quest_....json,
+    запись во временный файл и переименование (файл не бывает недописан);
+    jsonl - строки в файлах-сегментах LOCATION/segments/<дата>/quests-<час>-<pid>.jsonl,
+    имя квеста - "<сегмент>#<id записи>";
+  - COMPRESSION: none или gzip (сегменты jsonl; каждая пачка - отдельный
+    gzip-блок, файл читается gzip.open целиком);
+  - QUEUE_SIZE и PUT_TIMEOUT: если очередь заполнена дольше PUT_TIMEOUT,
+    квест записывается в вызывающем потоке (замедление вместо потери данных);
+  - BATCH_SIZE: сколько квестов писатель забирает из очереди за раз;
+  - CLOSE_TIMEOUT: сколько ждать записи очереди при завершении процесса.
+"""
+
+import atexit
+import gzip
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+FORMATS = ('json', 'jsonl')
+COMPRESSIONS = ('none', 'gzip')
+# Длина частей имени файла из жанра и героя
+NAME_PART_LENGTH = 40
+
+
+def get_export_config():
+    """Настройки выгрузки с значениями по умолчанию"""
+    config = {
+        'MODE': 'background',
+        'FORMAT': 'json',
+        'COMPRESSION': 'none',
+        'QUEUE_SIZE': 1000,
+        'PUT_TIMEOUT': 5.0,
+        'BATCH_SIZE': 50,
+        'CLOSE_TIMEOUT': 30.0,
+        'LOCATION': None,
+    }
+    config.update(getattr(settings, 'QUEST_FILE_EXPORT', {}))
+    config['MODE'] = (config['MODE'] or 'background').lower()
+    config['FORMAT'] = (config['FORMAT'] or 'json').lower()
+    config['COMPRESSION'] = (config['COMPRESSION'] or 'none').lower()
+    return config
+
+
+def _name_part(value):
+    """Часть имени файла: буквы, цифры, _ и -"""
+    return re.sub(r'[^\w-]+', '_', str(value)).strip('_')[:NAME_PART_LENGTH] or 'quest'
+
+
+def _write_atomic(path, document):
+    """JSON файл через временный файл в том же каталоге и переименование"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class QuestFileExporter:
+    """Очередь квестов и поток-писатель одного процесса"""
+
+    def __init__(self, location, mode='background', file_format='json', compression='none',
+                 queue_size=1000, put_timeout=5.0, batch_size=50, close_timeout=30.0):
+        if file_format not in FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {file_format}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Неизвестное сжатие выгрузки: {compression}")
+        self.location = str(location)
+        self.mode = mode
+        self.file_format = file_format
+        self.compression = compression
+        self.put_timeout = put_timeout
+        self.batch_size = max(1, int(batch_size))
+        self.close_timeout = close_timeout
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        # Запись из потока-писателя и из вызывающих потоков (очередь заполнена)
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._metrics = {'queued': 0, 'written': 0, 'failed': 0, 'sync_writes': 0, 'bytes': 0}
+
+    @classmethod
+    def from_settings(cls):
+        from .storage import get_output_dir
+
+        config = get_export_config()
+        return cls(
+            location=config['LOCATION'] or get_output_dir(),
+            mode=config['MODE'],
+            file_format=config['FORMAT'],
+            compression=config['COMPRESSION'],
+            queue_size=config['QUEUE_SIZE'],
+            put_timeout=config['PUT_TIMEOUT'],
+            batch_size=config['BATCH_SIZE'],
+            close_timeout=config['CLOSE_TIMEOUT'],
+        )
+
+    def make_name(self, genre, hero, now):
+        """Имя файла квеста относительно LOCATION (через /)"""
+        record_id = uuid.uuid4().hex
+        if self.file_format == 'jsonl':
+            suffix = '.jsonl.gz' if self.compression == 'gzip' else '.jsonl'
+            segment = f"segments/{now:%Y-%m-%d}/quests-{now:%H}-{os.getpid()}{suffix}"
+            return f"{segment}#{record_id}", record_id
+        filename = f"quest_{_name_part(genre)}_{_name_part(hero)}_{now:%Y%m%d_%H%M%S}_{record_id[:8]}.json"
+        return f"{now:%Y-%m-%d}/{record_id[:2]}/{filename}", record_id
+
+    def submit(self, quest_data, genre, hero, goal):
+        """Ставит квест в очередь (или пишет сразу) и возвращает имя файла
+
+        quest_data не копируется: после вызова его нельзя изменять.
+        """
+        now = datetime.now()
+        name, record_id = self.make_name(genre, hero, now)
+        document = {
+            "metadata": {
+                "id": record_id,
+                "genre": genre,
+                "hero": hero,
+                "goal": goal,
+                "generated_at": now.isoformat(),
+                "model": "mistral-large-latest"
+            },
+            "quest_data": quest_data
+        }
+        item = (name, document)
+        if self.mode != 'background':
+            return name if self._write_batch([item], sync=True) else None
+
+        self._ensure_thread()
+        with self._pending_changed:
+            self._pending += 1
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            print(f"⚠️ Очередь выгрузки квестов заполнена, запись в файл в текущем потоке: {name}")
+            written = self._write_batch([item], sync=True)
+            self._done(1)
+            return name if written else None
+        with self._pending_changed:
+            self._metrics['queued'] += 1
+        return name
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='quest-file-export', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+            self._done(len(batch))
+            if stop:
+                return
+
+    def _done(self, count):
+        with self._pending_changed:
+            self._pending -= count
+            self._pending_changed.notify_all()
+
+    def _write_batch(self, batch, sync=False):
+        """Записывает пачку; ошибки печатаются и учитываются, но не пробрасываются"""
+        written = 0
+        size = 0
+        with self._write_lock:
+            try:
+                if self.file_format == 'jsonl':
+                    size = self._append_segments(batch)
+                else:
+                    for name, document in batch:
+                        path = os.path.join(self.location, *name.split('/'))
+                        _write_atomic(path, document)
+                        size += os.path.getsize(path)
+                written = len(batch)
+            except Exception as e:
+                print(f"Ошибка сохранения файла: {e}")
+                traceback.print_exc()
+        with self._pending_changed:
+            self._metrics['written'] += written
+            self._metrics['failed'] += len(batch) - written
+            self._metrics['bytes'] += size
+            if sync:
+                self._metrics['sync_writes'] += len(batch)
+        return written == len(batch)
+
+    def _append_segments(self, batch):
+        """Дописывает строки пачки в сегменты; возвращает число записанных байт"""
+        segments = {}
+        for name, document in batch:
+            segment = name.split('#', 1)[0]
+            segments.setdefault(segment, []).append(json.dumps(document, ensure_ascii=False))
+        size = 0
+        for segment, lines in segments.items():
+            data = ("\n".join(lines) + "\n").encode('utf-8')
+            if self.compression == 'gzip':
+                data = gzip.compress(data)
+            path = os.path.join(self.location, *segment.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(data)
+            size += len(data)
+        return size
+
+    def flush(self, timeout=None):
+        """Ждет записи всего, что уже в очереди; False, если не успели за timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending_changed:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_changed.wait(remaining)
+        return True
+
+    def close(self):
+        """Дописывает очередь (не дольше CLOSE_TIMEOUT) и останавливает писатель"""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        if not self.flush(self.close_timeout):
+            print(f"⚠️ Не все квесты записаны в файлы: в очереди {self._pending}")
+        try:
+            self._queue.put(None, timeout=self.close_timeout)
+        except queue.Full:
+            return
+        thread.join(self.close_timeout)
+
+    def metrics(self):
+        """Снимок счетчиков: поставлено в очередь, записано, ошибки, глубина очереди"""
+        with self._pending_changed:
+            metrics = dict(self._metrics)
+            metrics['pending'] = self._pending
+        metrics['mode'] = self.mode
+        metrics['format'] = self.file_format
+        return metrics
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_file_exporter():
+    """Выгрузка процесса по настройке QUEST_FILE_EXPORT"""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = QuestFileExporter.from_settings()
+    return _exporter
+
+
+def reset_file_exporter():
+    """Дописывает очередь и пересоздает выгрузку (после изменения настроек)"""
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
+
+
+@receiver(setting_changed)
+def _reset_on_settings_change(setting, **kwargs):
+    """Пересоздает выгрузку при изменении QUEST_FILE_EXPORT (override_settings)"""
+    if setting == 'QUEST_FILE_EXPORT':
+        reset_file_exporter()
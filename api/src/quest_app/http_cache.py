@@ -0,0 +1,69 @@
+"""
+HTTP-кэширование ответов с данными квестов
+
+Квест после сохранения практически не меняется, поэтому ответы по нему
+снабжаются ETag (id квеста + Quest.content_hash) и Last-Modified (created_at).
+Повторный запрос с If-None-Match/If-Modified-Since получает 304 после одного
+запроса к БД, без загрузки quest_data и сериализации. Cache-Control задается
+настройкой QUEST_HTTP_CACHE.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+# Меняется вместе с форматом ответов, чтобы клиенты не получали 304 на старые данные
+ETAG_VERSION = 1
+
+
+def quest_etag(quest_id, quest_hash):
+    return f'"q{ETAG_VERSION}-{quest_id}-{quest_hash[:32]}"'
+
+
+def page_etag(request, quests):
+    """ETag страницы списка: адрес запроса + id и хэши квестов на странице"""
+    digest = hashlib.sha256(f"{ETAG_VERSION}\n{request.get_full_path()}".encode('utf-8'))
+    for quest in quests:
+        digest.update(f"\n{quest.id}:{quest.content_hash}".encode('utf-8'))
+    return f'"p{ETAG_VERSION}-{digest.hexdigest()[:32]}"'
+
+
+def set_cache_headers(response, etag=None, last_modified=None):
+    if etag and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified is not None and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+    max_age = getattr(settings, 'QUEST_HTTP_CACHE', {}).get('MAX_AGE', 0)
+    patch_cache_control(response, max_age=max_age, must_revalidate=True)
+    return response
+
+
+def conditional_quest_view(view):
+    """Условные запросы для представлений с аргументом quest_id
+
+    Если квест не найден или хэш еще не посчитан, представление вызывается
+    как обычно (и само возвращает 404).
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        from .models import Quest
+
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        row = (Quest.objects.filter(id=kwargs['quest_id'])
+               .values_list('content_hash', 'created_at').first())
+        if row is None or not row[0]:
+            return view(request, *args, **kwargs)
+
+        etag = quest_etag(kwargs['quest_id'], row[0])
+        last_modified = int(row[1].timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return set_cache_headers(response, etag, last_modified)
+    return wrapper
@@ -0,0 +1,379 @@
+"""
+Измерение этапов генерации: время, токены, повторы, ошибки разбора, объем ответа
+
+QuestGenerator открывает RunRecorder на каждую генерацию; драйверы этапов
+в langchain_generator оборачивают вызов цепочки в stage_scope(), а
+RateLimitedModel сообщает о токенах и повторах после 429 через
+record_llm_call()/record_retry(). Текущая запись и этап передаются через
+contextvars, поэтому доходят и до потоков chain.batch, и до задач asyncio.
+
+Итог сохраняется в GenerationRun (и GenerationStageRun по этапам), отчеты -
+GET /metrics (формат Prometheus) и GET /api/metrics/ (перцентили за период).
+"""
+
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+try:
+    from langchain_core.exceptions import OutputParserException
+except ImportError:
+    OutputParserException = ValueError
+
+RUN_SUCCESS = 'success'
+RUN_FAILED = 'failed'
+RUN_CACHED = 'cached'
+
+STAGE_DONE = 'done'
+STAGE_FAILED = 'failed'
+STAGE_CHECKPOINT = 'checkpoint'
+
+# Границы корзин гистограммы длительности этапов для /metrics, сек
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+_current_run = contextvars.ContextVar('quest_generation_run', default=None)
+_current_stage = contextvars.ContextVar('quest_generation_stage', default=None)
+
+
+class StageStats:
+    """Счетчики одного этапа в рамках генерации (суммируются по попыткам)"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.status = STAGE_DONE
+        self.wall_seconds = 0.0
+        self.attempts = 0
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.parse_failures = 0
+        self.payload_bytes = 0
+        self.prompt_tokens_saved = 0
+
+
+class RunRecorder:
+    """Накопитель измерений одной генерации"""
+
+    def __init__(self, params=None):
+        self.params = params or {}
+        self.started = time.monotonic()
+        self.stages = {}
+        self.attempts = 0
+        self.status = RUN_SUCCESS
+        self.error = ''
+        self.wall_seconds = 0.0
+        self.run = None
+
+    def stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = StageStats(stage)
+        return self.stages[stage]
+
+    @contextmanager
+    def activate(self):
+        """Делает запись текущей для кода внутри блока"""
+        token = _current_run.set(self)
+        try:
+            yield self
+        finally:
+            _current_run.reset(token)
+
+    def finish(self, result):
+        if result.get('error'):
+            self.status = RUN_FAILED
+            self.error = str(result['error'])
+        self.wall_seconds = time.monotonic() - self.started
+
+    def save(self):
+        """Сохраняет GenerationRun с этапами; ошибки записи не мешают генерации"""
+        from .models import GenerationRun, GenerationStageRun
+
+        stages = list(self.stages.values())
+        try:
+            self.run = GenerationRun.objects.create(
+                status=self.status,
+                error=self.error[:1000],
+                genre=str(self.params.get('genre') or '')[:100],
+                scene_count=self.params.get('scene_count'),
+                attempts=self.attempts,
+                wall_ms=int(self.wall_seconds * 1000),
+                llm_calls=sum(stats.llm_calls for stats in stages),
+                prompt_tokens=sum(stats.prompt_tokens for stats in stages),
+                completion_tokens=sum(stats.completion_tokens for stats in stages),
+                retries=sum(stats.retries for stats in stages),
+                prompt_tokens_saved=sum(stats.prompt_tokens_saved for stats in stages),
+            )
+            GenerationStageRun.objects.bulk_create([
+                GenerationStageRun(
+                    run=self.run,
+                    stage=stats.stage,
+                    status=stats.status,
+                    wall_ms=int(stats.wall_seconds * 1000),
+                    attempts=stats.attempts,
+                    llm_calls=stats.llm_calls,
+                    prompt_tokens=stats.prompt_tokens,
+                    completion_tokens=stats.completion_tokens,
+                    retries=stats.retries,
+                    parse_failures=stats.parse_failures,
+                    payload_bytes=stats.payload_bytes,
+                    prompt_tokens_saved=stats.prompt_tokens_saved,
+                )
+                for stats in stages
+            ])
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить измерения генерации: {e}")
+            self.run = None
+        return self.run
+
+    def summary(self):
+        """Строка для журнала: время и токены по этапам, сэкономленные сжатием токены"""
+        parts = [
+            f"{stats.stage} {stats.wall_seconds:.1f}с/{stats.prompt_tokens + stats.completion_tokens} ток."
+            for stats in self.stages.values()
+        ]
+        saved = sum(stats.prompt_tokens_saved for stats in self.stages.values())
+        if saved:
+            parts.append(f"сжатие промптов сэкономило {saved} ток.")
+        return ", ".join(parts)
+
+
+def current_stage_stats():
+    recorder = _current_run.get()
+    stage = _current_stage.get()
+    if recorder is None or stage is None:
+        return None
+    return recorder.stage(stage)
+
+
+def is_parse_failure(error):
+    return isinstance(error, (OutputParserException, json.JSONDecodeError))
+
+
+@contextmanager
+def stage_scope(stage, total=1, restored=0):
+    """Измеряет вызов цепочки этапа
+
+    total - число вызовов этапа (пачек этапа 3), restored - сколько из них
+    восстановлено из контрольных точек. Статус этапа - итог последней попытки.
+    """
+    recorder = _current_run.get()
+    if recorder is None:
+        yield None
+        return
+    stats = recorder.stage(stage)
+    stats.attempts += 1
+    token = _current_stage.set(stage)
+    started = time.monotonic()
+    try:
+        yield stats
+    except Exception as e:
+        stats.status = STAGE_FAILED
+        if is_parse_failure(e) and not getattr(e, '_quest_recorded', False):
+            stats.parse_failures += 1
+        raise
+    else:
+        stats.status = STAGE_CHECKPOINT if restored >= total else STAGE_DONE
+    finally:
+        stats.wall_seconds += time.monotonic() - started
+        _current_stage.reset(token)
+
+
+def record_results(stats, results):
+    """Учитывает результаты этапа: объем ответа и ошибки разбора (batch с return_exceptions)"""
+    if stats is None:
+        return
+    for result in results:
+        if isinstance(result, Exception):
+            if is_parse_failure(result):
+                stats.parse_failures += 1
+                # stage_scope не должен учесть эту ошибку второй раз
+                result._quest_recorded = True
+        elif result is not None:
+            stats.payload_bytes += len(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+
+
+def record_llm_call(message):
+    """Вызов модели завершен: токены из usage_metadata ответа"""
+    stats = current_stage_stats()
+    if stats is None:
+        return
+    stats.llm_calls += 1
+    usage = getattr(message, 'usage_metadata', None) or {}
+    stats.prompt_tokens += usage.get('input_tokens') or 0
+    stats.completion_tokens += usage.get('output_tokens') or 0
+
+
+def record_compaction(stage, saved_tokens):
+    """Вход этапа сжат (prompt_compaction): сколько токенов промпта сэкономлено"""
+    recorder = _current_run.get()
+    if recorder is not None:
+        recorder.stage(stage).prompt_tokens_saved += saved_tokens
+
+
+def record_retry():
+    """Повтор вызова модели после ответа 429"""
+    stats = current_stage_stats()
+    if stats is not None:
+        stats.retries += 1
+
+
+def _percentile_ms(queryset, fraction):
+    count = queryset.count()
+    if not count:
+        return None
+    offset = min(count - 1, int(round(fraction * (count - 1))))
+    return queryset.order_by('wall_ms').values_list('wall_ms', flat=True)[offset]
+
+
+def stage_report(days=7):
+    """Сводка по этапам за последние days дней: p50/p99 времени, средние токены"""
+    from django.db.models import Avg, Count, Sum
+    from django.utils import timezone
+
+    from .models import GenerationStageRun
+
+    since = timezone.now() - timedelta(days=days)
+    recent = GenerationStageRun.objects.filter(run__created_at__gte=since).exclude(status=STAGE_CHECKPOINT)
+    report = {}
+    rows = recent.values('stage').annotate(
+        count=Count('id'),
+        avg_prompt_tokens=Avg('prompt_tokens'),
+        avg_completion_tokens=Avg('completion_tokens'),
+        retries=Sum('retries'),
+        parse_failures=Sum('parse_failures'),
+        avg_payload_bytes=Avg('payload_bytes'),
+        avg_prompt_tokens_saved=Avg('prompt_tokens_saved'),
+    ).order_by()
+    for row in rows:
+        stage_runs = recent.filter(stage=row['stage'])
+        report[row['stage']] = {
+            "count": row['count'],
+            "p50_ms": _percentile_ms(stage_runs, 0.5),
+            "p99_ms": _percentile_ms(stage_runs, 0.99),
+            "avg_prompt_tokens": round(row['avg_prompt_tokens'] or 0),
+            "avg_completion_tokens": round(row['avg_completion_tokens'] or 0),
+            "retries": row['retries'] or 0,
+            "parse_failures": row['parse_failures'] or 0,
+            "avg_payload_bytes": round(row['avg_payload_bytes'] or 0),
+            "avg_prompt_tokens_saved": round(row['avg_prompt_tokens_saved'] or 0),
+        }
+    return report
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_aggregates_cache = (0.0, None)
+_aggregates_lock = threading.Lock()
+
+
+def _generation_aggregates():
+    """Итоги GenerationRun по статусам и GenerationStageRun по этапам
+
+    Агрегаты по таблицам целиком кэшируются в процессе на
+    QUEST_METRICS['PROMETHEUS_CACHE_TTL'] секунд: частый опрос /metrics не
+    запускает GROUP BY на каждый запрос.
+    """
+    global _aggregates_cache
+    from django.conf import settings
+    from django.db.models import Count, Q, Sum
+
+    from .models import GenerationRun, GenerationStageRun
+
+    ttl = getattr(settings, 'QUEST_METRICS', {}).get('PROMETHEUS_CACHE_TTL', 5)
+    expires_at, cached = _aggregates_cache
+    if cached is not None and time.monotonic() < expires_at:
+        return cached
+    with _aggregates_lock:
+        expires_at, cached = _aggregates_cache
+        if cached is not None and time.monotonic() < expires_at:
+            return cached
+        runs = list(GenerationRun.objects.values('status').annotate(count=Count('id')).order_by())
+        buckets = {f"le_{index}": Count('id', filter=Q(wall_ms__lte=int(bound * 1000)))
+                   for index, bound in enumerate(DURATION_BUCKETS)}
+        stages = list(GenerationStageRun.objects.exclude(status=STAGE_CHECKPOINT).values('stage').annotate(
+            count=Count('id'),
+            wall_ms_sum=Sum('wall_ms'),
+            prompt_tokens=Sum('prompt_tokens'),
+            completion_tokens=Sum('completion_tokens'),
+            llm_calls=Sum('llm_calls'),
+            retries=Sum('retries'),
+            parse_failures=Sum('parse_failures'),
+            payload_bytes=Sum('payload_bytes'),
+            prompt_tokens_saved=Sum('prompt_tokens_saved'),
+            failed=Count('id', filter=Q(status=STAGE_FAILED)),
+            **buckets,
+        ).order_by('stage'))
+        _aggregates_cache = (time.monotonic() + ttl, (runs, stages))
+    return runs, stages
+
+
+def prometheus_metrics():
+    """Метрики генерации в текстовом формате Prometheus
+
+    Счетчики и гистограмма считаются по таблицам GenerationRun/GenerationStageRun,
+    поэтому учитывают генерации всех процессов (обработчиков очереди в том числе);
+    агрегаты кэшируются на несколько секунд (см. _generation_aggregates).
+    """
+    from .file_export import get_file_exporter
+    from .rate_limit import get_governor
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    runs, stages = _generation_aggregates()
+    metric('quest_generation_runs_total', 'counter', "Генерации квестов по итогу",
+           [({"status": row['status']}, row['count']) for row in runs])
+
+    histogram = []
+    for row in stages:
+        for index, bound in enumerate(DURATION_BUCKETS):
+            histogram.append(({"stage": row['stage'], "le": bound}, row[f"le_{index}"]))
+        histogram.append(({"stage": row['stage'], "le": "+Inf"}, row['count']))
+    lines.append("# HELP quest_stage_duration_seconds Время этапа генерации")
+    lines.append("# TYPE quest_stage_duration_seconds histogram")
+    for labels, value in histogram:
+        lines.append(f'quest_stage_duration_seconds_bucket{{stage="{labels["stage"]}",le="{labels["le"]}"}} {value}')
+    for row in stages:
+        lines.append(f'quest_stage_duration_seconds_sum{{stage="{row["stage"]}"}} {(row["wall_ms_sum"] or 0) / 1000}')
+        lines.append(f'quest_stage_duration_seconds_count{{stage="{row["stage"]}"}} {row["count"]}')
+
+    metric('quest_stage_tokens_total', 'counter', "Токены LLM по этапам",
+           [({"stage": row['stage'], "kind": "prompt"}, row['prompt_tokens'] or 0) for row in stages] +
+           [({"stage": row['stage'], "kind": "completion"}, row['completion_tokens'] or 0) for row in stages])
+    for name, field, help_text in (
+        ('quest_stage_llm_calls_total', 'llm_calls', "Вызовы модели по этапам"),
+        ('quest_stage_retries_total', 'retries', "Повторы вызовов модели после 429"),
+        ('quest_stage_parse_failures_total', 'parse_failures', "Ошибки разбора JSON ответа модели"),
+        ('quest_stage_payload_bytes_total', 'payload_bytes', "Объем результатов этапа, байт"),
+        ('quest_stage_failures_total', 'failed', "Этапы, завершившиеся ошибкой"),
+        ('quest_stage_prompt_tokens_saved_total', 'prompt_tokens_saved', "Токены промпта, сэкономленные сжатием"),
+    ):
+        metric(name, 'counter', help_text, [({"stage": row['stage']}, row[field] or 0) for row in stages])
+
+    governor = get_governor().metrics()
+    metric('quest_llm_queue_waiting', 'gauge', "Запросы к LLM, ожидающие в очереди ограничителя (этот процесс)",
+           [({}, governor['waiting'])])
+    metric('quest_llm_in_flight', 'gauge', "Выполняющиеся запросы к LLM (этот процесс)",
+           [({}, governor['in_flight'])])
+    metric('quest_llm_queue_wait_seconds_total', 'counter', "Суммарное ожидание в очереди ограничителя (этот процесс)",
+           [({}, governor['wait_seconds_total'])])
+    metric('quest_llm_rate_limited_total', 'counter', "Ответы 429 от провайдера (этот процесс)",
+           [({}, governor['rate_limited'])])
+    export = get_file_exporter().metrics()
+    metric('quest_file_export_pending', 'gauge', "Квесты в очереди записи в файлы (этот процесс)",
+           [({}, export['pending'])])
+    metric('quest_file_export_failed_total', 'counter', "Ошибки записи квестов в файлы (этот процесс)",
+           [({}, export['failed'])])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,260 @@
+"""
+Очередь фоновой генерации квестов на базе таблицы GenerationJob
+
+Очередь не требует внешнего брокера: задачи хранятся в основной БД
+(SQLite/PostgreSQL), а локальные процессы-обработчики забирают их
+командой `python manage.py run_quest_workers`.
+"""
+
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .langchain_generator import GENERATION_STAGES
+from .llm_generator import get_quest_generator
+from .models import GenerationJob
+from .storage import store_quest
+
+GENERATION_PARAMS = ('genre', 'hero', 'goal', 'scene_count', 'max_depth', 'complexity', 'ending_type', 'use_cache')
+
+
+def get_jobs_config():
+    """Настройки очереди с значениями по умолчанию"""
+    config = {
+        'WORKERS': 2,
+        'POLL_INTERVAL': 1.0,
+        'STALE_TIMEOUT': 900,
+        'MAX_ATTEMPTS': 3,
+    }
+    config.update(getattr(settings, 'QUEST_JOBS', {}))
+    return config
+
+
+def default_worker_name():
+    """Имя обработчика вида host:pid"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def build_job(params, batch=None, item_key=''):
+    """Несохраненная задача генерации (для bulk_create)"""
+    job_params = {key: params[key] for key in GENERATION_PARAMS if key in params}
+    progress = {stage: {"status": "pending"} for stage, _ in GENERATION_STAGES}
+    return GenerationJob(params=job_params, progress=progress, batch=batch, item_key=item_key)
+
+
+def enqueue_job(params):
+    """Ставит генерацию в очередь и возвращает созданную задачу"""
+    job = build_job(params)
+    job.save()
+    return job
+
+
+def claim_next_job(worker_name, batch=None):
+    """Атомарно забирает самую старую задачу из очереди (или из пакета batch)
+
+    На PostgreSQL используется SELECT ... FOR UPDATE SKIP LOCKED, на SQLite
+    конкуренцию между процессами разрешает условный UPDATE по статусу.
+    """
+    with transaction.atomic():
+        queryset = GenerationJob.objects.filter(status=GenerationJob.STATUS_PENDING).order_by('created_at', 'id')
+        if batch is not None:
+            queryset = queryset.filter(batch=batch)
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        job = queryset.first()
+        if job is None:
+            return None
+
+        now = timezone.now()
+        claimed = GenerationJob.objects.filter(id=job.id, status=GenerationJob.STATUS_PENDING).update(
+            status=GenerationJob.STATUS_RUNNING,
+            worker=worker_name,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+
+    if not claimed:
+        # Задачу успел забрать другой обработчик
+        return None
+
+    job.refresh_from_db()
+    return job
+
+
+def requeue_stale_jobs(stale_timeout=None, max_attempts=None):
+    """Возвращает в очередь задачи, обработчик которых перестал отвечать"""
+    config = get_jobs_config()
+    stale_timeout = stale_timeout if stale_timeout is not None else config['STALE_TIMEOUT']
+    max_attempts = max_attempts if max_attempts is not None else config['MAX_ATTEMPTS']
+
+    deadline = timezone.now() - timedelta(seconds=stale_timeout)
+    stale = GenerationJob.objects.filter(status=GenerationJob.STATUS_RUNNING, heartbeat_at__lt=deadline)
+
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=GenerationJob.STATUS_FAILED,
+        error="Превышено число попыток: обработчик перестал отвечать",
+        finished_at=timezone.now(),
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status=GenerationJob.STATUS_PENDING,
+        worker='',
+    )
+    return requeued, failed
+
+
+def _is_dead_local_worker(worker_name):
+    """Обработчик вида host:pid[/n] запущен на этой машине и его процесса уже нет"""
+    host, _, rest = worker_name.rpartition(':')
+    if host != socket.gethostname():
+        return False
+    try:
+        pid = int(rest.split('/')[0])
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # Процесс есть, но принадлежит другому пользователю
+        return False
+    return False
+
+
+def requeue_orphaned_jobs(batch=None):
+    """Сразу возвращает в очередь задачи завершившихся локальных обработчиков
+
+    В отличие от requeue_stale_jobs не ждет STALE_TIMEOUT: используется при
+    перезапуске пакетной генерации на той же машине.
+    """
+    running = GenerationJob.objects.filter(status=GenerationJob.STATUS_RUNNING)
+    if batch is not None:
+        running = running.filter(batch=batch)
+    orphaned = [job_id for job_id, worker in running.values_list('id', 'worker')
+                if _is_dead_local_worker(worker)]
+    if not orphaned:
+        return 0
+    return GenerationJob.objects.filter(id__in=orphaned, status=GenerationJob.STATUS_RUNNING).update(
+        status=GenerationJob.STATUS_PENDING,
+        worker='',
+    )
+
+
+class JobProgressReporter:
+    """Сохраняет прогресс этапов генерации в запись задачи"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def __call__(self, stage, status, info=None):
+        now = timezone.now()
+        entry = dict(self.job.progress.get(stage, {}))
+        entry['status'] = status
+        if status == 'started':
+            entry['started_at'] = now.isoformat()
+        else:
+            entry['finished_at'] = now.isoformat()
+        if info:
+            entry.update(info)
+
+        self.job.progress[stage] = entry
+        self.job.stage = stage
+        self.job.heartbeat_at = now
+        GenerationJob.objects.filter(id=self.job.id).update(
+            progress=self.job.progress,
+            stage=stage,
+            heartbeat_at=now,
+        )
+
+
+def _finish_job(job, **fields):
+    fields['finished_at'] = timezone.now()
+    for name, value in fields.items():
+        setattr(job, name, value)
+    GenerationJob.objects.filter(id=job.id).update(**fields)
+
+
+def generate_job_quest(job, generator):
+    """Генерирует квест по параметрам задачи, сохраняя прогресс этапов
+
+    Запись измерений генерации остается в job.generation_run.
+    """
+    params = job.params
+    job.generation_run = None
+    return generator.generate_quest(
+        genre=params['genre'],
+        hero=params['hero'],
+        goal=params['goal'],
+        scene_count=params.get('scene_count', 10),
+        max_depth=params.get('max_depth', 5),
+        complexity=params.get('complexity', 'medium'),
+        ending_type=params.get('ending_type', 'single'),
+        use_cache=params.get('use_cache', True),
+        progress_callback=JobProgressReporter(job),
+        # Повторный запуск задачи продолжает с последнего успешного этапа
+        checkpoint_scope=f"job-{job.id}",
+        run_callback=lambda run: setattr(job, 'generation_run', run),
+    )
+
+
+def run_job(job, generator=None):
+    """Выполняет задачу: генерирует квест и сохраняет его"""
+    generator = generator or get_quest_generator()
+    params = job.params
+
+    print(f"▶️ Задача {job.id}: генерация квеста {params.get('genre')} - {params.get('hero')}")
+
+    try:
+        quest_data = generate_job_quest(job, generator)
+
+        if 'error' in quest_data:
+            print(f"Ошибка генерации: {quest_data['error']}")
+            _finish_job(job, status=GenerationJob.STATUS_FAILED, error=quest_data['error'])
+            return job
+
+        quest, saved_file = store_quest(quest_data, params['genre'], params['hero'], params['goal'],
+                                       run=job.generation_run)
+        _finish_job(job, status=GenerationJob.STATUS_DONE, quest=quest, saved_file=saved_file or '')
+
+    except Exception as e:
+        print(f"Ошибка в задаче {job.id}: {e}")
+        traceback.print_exc()
+        _finish_job(job, status=GenerationJob.STATUS_FAILED, error=f"Внутренняя ошибка сервера: {str(e)}")
+
+    return job
+
+
+def worker_loop(worker_name=None, poll_interval=None, stale_timeout=None, max_jobs=None, stop_event=None):
+    """Основной цикл обработчика: забирает задачи из очереди и выполняет их"""
+    config = get_jobs_config()
+    worker_name = worker_name or default_worker_name()
+    poll_interval = poll_interval if poll_interval is not None else config['POLL_INTERVAL']
+    processed = 0
+
+    print(f"👷 Обработчик {worker_name} запущен")
+
+    requeue_stale_jobs(stale_timeout=stale_timeout)
+
+    while stop_event is None or not stop_event.is_set():
+        job = claim_next_job(worker_name)
+        if job is None:
+            # Очередь пуста - заодно подбираем задачи "упавших" обработчиков
+            requeue_stale_jobs(stale_timeout=stale_timeout)
+            time.sleep(poll_interval)
+            continue
+
+        run_job(job)
+        processed += 1
+        if max_jobs is not None and processed >= max_jobs:
+            break
+
+    print(f"👷 Обработчик {worker_name} остановлен, выполнено задач: {processed}")
+    return processed
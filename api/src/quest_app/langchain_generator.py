@@ -2,9 +2,17 @@
 Улучшенный многоэтапный генератор квестов через LangChain
 """
 
-import json
+import functools
 import os
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable
+
+from asgiref.sync import sync_to_async
+
+from .instrumentation import record_results, stage_scope
+from .prompt_compaction import compact, encode_plan, encode_quest, encode_structure, get_compaction_config
+from .quest_graph import validate_quest_graph
+from .rate_limit import RateLimitedModel
+from .result_cache import get_stage_checkpoints, make_checkpoint_key
 
 # Импорт Pydantic для валидации данных
 try:
@@ -55,47 +63,124 @@ if PYDANTIC_AVAILABLE:
     class Quest(BaseModel):
         scenes: List[QuestScene] = Field(..., description="Список сцен квеста")
 
+# Версия конвейера генерации, сохраняется в Quest.generator_version.
+# Увеличивайте при изменении промптов или состава этапов
+GENERATOR_VERSION = "langchain-4stage-4"
+
+# Идентификаторы этапов генерации (используются в отчетах о прогрессе)
+STAGE_STRUCTURE = "structure"
+STAGE_PLANNING = "planning"
+STAGE_CONTENT = "content"
+STAGE_VALIDATION = "validation"
+
+GENERATION_STAGES = [
+    (STAGE_STRUCTURE, "Структурная карта"),
+    (STAGE_PLANNING, "Детальное планирование"),
+    (STAGE_CONTENT, "Генерация контента"),
+    (STAGE_VALIDATION, "Валидация и исправления"),
+]
+
+ProgressCallback = Callable[[str, str, Optional[Dict[str, Any]]], None]
+SceneCallback = Callable[[Dict[str, Any]], None]
+
+# Режимы этапа 4 (QUEST_VALIDATION_MODE):
+# local - только локальная проверка графа, без обращения к модели;
+# hybrid - локальная проверка, модель вызывается лишь для исправления текста;
+# llm - вся проверка выполняется моделью
+VALIDATION_LOCAL = "local"
+VALIDATION_HYBRID = "hybrid"
+VALIDATION_LLM = "llm"
+
+# Режимы этапа 3 (QUEST_CONTENT_MODE):
+# single - весь контент одним запросом;
+# parallel - сцены генерируются пачками по QUEST_CONTENT_BATCH_SIZE,
+# не более QUEST_CONTENT_CONCURRENCY запросов одновременно
+CONTENT_SINGLE = "single"
+CONTENT_PARALLEL = "parallel"
+
+
 class LangChainQuestGenerator:
     """Многоэтапный генератор квестов с детальным планированием"""
     
-    def __init__(self):
-        self.llm = None
+    def __init__(self, llm=None, validation_mode: Optional[str] = None,
+                 content_mode: Optional[str] = None, content_batch_size: Optional[int] = None,
+                 content_concurrency: Optional[int] = None):
+        self.llm = llm               # Готовая модель (например, FakeQuestChatModel)
+        self.model = None            # self.llm за общим ограничителем запросов (rate_limit.py)
+        self.validation_mode = (validation_mode or
+                                os.getenv('QUEST_VALIDATION_MODE', VALIDATION_HYBRID)).lower()
+        self.content_mode = (content_mode or
+                             os.getenv('QUEST_CONTENT_MODE', CONTENT_SINGLE)).lower()
+        self.content_batch_size = max(1, int(content_batch_size or
+                                             os.getenv('QUEST_CONTENT_BATCH_SIZE', '2')))
+        self.content_concurrency = max(1, int(content_concurrency or
+                                              os.getenv('QUEST_CONTENT_CONCURRENCY', '8')))
         self.step1_mapper = None     # Этап 1: Структурная карта
         self.step2_planner = None    # Этап 2: Детальное планирование
         self.step3_generator = None  # Этап 3: Генерация контента
+        self.step3_scene_generator = None  # Этап 3 (parallel): контент части сцен
         self.step4_validator = None  # Этап 4: Валидация и исправления
         self.setup_langchain()
     
+    def pipeline_signature(self) -> str:
+        """Версия конвейера и режимы этапов 3-4 и сжатия промптов (часть ключа кэша результатов)"""
+        compaction = 'compact' if get_compaction_config()['ENABLED'] else 'full'
+        return f"{GENERATOR_VERSION}/{self.content_mode}/{self.validation_mode}/{compaction}"
+    
     def is_available(self) -> bool:
         """Проверка доступности LangChain"""
         return (LANGCHAIN_CORE_AVAILABLE and 
-                MISTRAL_LANGCHAIN_AVAILABLE and 
-                self.llm is not None)
+                self.llm is not None and
+                self.step1_mapper is not None)
+    
+    def _create_llm(self):
+        """Создание модели по настройке QUEST_LLM_BACKEND (mistral или fake)"""
+        backend = os.getenv('QUEST_LLM_BACKEND', 'mistral').lower()
+        
+        if backend == 'fake':
+            from .fake_llm import FakeQuestChatModel
+            print("🧪 Используется FakeQuestChatModel (без обращения к Mistral AI)")
+            return FakeQuestChatModel(
+                latency=float(os.getenv('QUEST_FAKE_LLM_LATENCY', '0')),
+                seconds_per_token=float(os.getenv('QUEST_FAKE_LLM_SECONDS_PER_TOKEN', '0')),
+                text_paragraphs=int(os.getenv('QUEST_FAKE_LLM_TEXT_PARAGRAPHS', '1')),
+            )
+        
+        if not MISTRAL_LANGCHAIN_AVAILABLE:
+            print("❌ Mistral AI для LangChain недоступен")
+            return None
+        
+        # Получаем API ключ
+        api_key = os.getenv('MISTRAL_API_KEY')
+        if not api_key:
+            print("❌ MISTRAL_API_KEY не найден в переменных окружения")
+            return None
+        
+        # Инициализация Mistral AI
+        return ChatMistralAI(
+            model="mistral-large-latest",
+            mistral_api_key=api_key,
+            temperature=0.7
+        )
     
     def setup_langchain(self):
         """Настройка LangChain и создание цепочек"""
-        if not LANGCHAIN_CORE_AVAILABLE or not MISTRAL_LANGCHAIN_AVAILABLE:
+        if not LANGCHAIN_CORE_AVAILABLE:
             print("❌ LangChain компоненты недоступны")
             return
             
         try:
-            # Получаем API ключ
-            api_key = os.getenv('MISTRAL_API_KEY')
-            if not api_key:
-                print("❌ MISTRAL_API_KEY не найден в переменных окружения")
+            if self.llm is None:
+                self.llm = self._create_llm()
+            if self.llm is None:
                 return
-            
-            # Инициализация Mistral AI
-            self.llm = ChatMistralAI(
-                model="mistral-large-latest",
-                mistral_api_key=api_key,
-                temperature=0.7
-            )
+            self.model = RateLimitedModel(self.llm)
             
             # Создание всех этапов
             self._create_step1_mapping()
             self._create_step2_planning()
             self._create_step3_generation()
+            self._create_step3_scene_generation()
             self._create_step4_validation()
             
             print("✅ LangChain Quest Generator настроен успешно")
@@ -158,7 +243,7 @@ class LangChainQuestGenerator:
             ("human", "Создай структурную карту квеста.")
         ])
         
-        self.step1_mapper = mapping_prompt | self.llm | JsonOutputParser()
+        self.step1_mapper = mapping_prompt | self.model | JsonOutputParser()
     
     def _create_step2_planning(self):
         """Этап 2: Детальное планирование выборов"""
@@ -202,7 +287,7 @@ class LangChainQuestGenerator:
             ("human", "Создай детальный план выборов.")
         ])
         
-        self.step2_planner = planning_prompt | self.llm | JsonOutputParser()
+        self.step2_planner = planning_prompt | self.model | JsonOutputParser()
     
     def _create_step3_generation(self):
         """Этап 3: Генерация полного контента"""
@@ -240,7 +325,47 @@ class LangChainQuestGenerator:
             ("human", "Сгенерируй полный контент по плану.")
         ])
         
-        self.step3_generator = generation_prompt | self.llm | JsonOutputParser()
+        self.step3_generator = generation_prompt | self.model | JsonOutputParser()
+    
+    def _create_step3_scene_generation(self):
+        """Этап 3 в режиме parallel: контент для нескольких сцен плана"""
+        scene_prompt = ChatPromptTemplate.from_messages([
+            ("system", """ЭТАП 3: ГЕНЕРАЦИЯ КОНТЕНТА ЧАСТИ СЦЕН
+
+Тема квеста: {theme}
+Параметры: {genre}, {hero}, {goal}
+Все сцены квеста: {scene_ids}
+План: {detailed_plan}
+
+ЗАДАЧА: Создай ПОЛНЫЕ тексты ТОЛЬКО для сцен из плана выше.
+
+ТРЕБОВАНИЯ:
+1. Текст сцены: минимум 50 слов, живое описание
+2. Выборы: точно как в плане, интересные формулировки
+3. next_scene: ТОЛЬКО из списка всех сцен квеста
+4. Стиль: соответствует жанру и теме квеста
+
+ВАЖНО: НЕ меняй структуру из плана, только добавляй детали!
+
+Формат ответа:
+{{
+  "scenes": [
+    {{
+      "scene_id": "точно как в плане",
+      "text": "Полное описание ситуации (50+ слов)",
+      "choices": [
+        {{
+          "text": "Текст выбора как в плане",
+          "next_scene": "точно как указано в плане"
+        }}
+      ]
+    }}
+  ]
+}}"""),
+            ("human", "Сгенерируй контент для этих сцен.")
+        ])
+        
+        self.step3_scene_generator = scene_prompt | self.model | JsonOutputParser()
     
     def _create_step4_validation(self):
         """Этап 4: Валидация и автоисправления"""
@@ -249,6 +374,8 @@ class LangChainQuestGenerator:
 
 Квест: {quest}
 
+Найденные проблемы (исправь в первую очередь): {issues}
+
 ПРОВЕРЬ И ИСПРАВЬ:
 1. Каждая сцена (кроме quest_end) имеет минимум 2 выбора
 2. Все next_scene существуют в списке сцен
@@ -269,84 +396,412 @@ class LangChainQuestGenerator:
             ("human", "Проверь и исправь квест.")
         ])
         
-        self.step4_validator = validation_prompt | self.llm | JsonOutputParser()
+        self.step4_validator = validation_prompt | self.model | JsonOutputParser()
     
-    def generate_quest(self, genre: str, hero: str, goal: str, scene_count: int = 10, 
-                      max_depth: int = 5, complexity: str = "medium", 
-                      ending_type: str = "single") -> Dict[str, Any]:
-        """Многоэтапная генерация квеста"""
+    @staticmethod
+    def _report_progress(progress_callback: Optional[ProgressCallback], stage: str,
+                         status: str, info: Optional[Dict[str, Any]] = None):
+        """Передает событие о ходе генерации подписчику (если он задан)"""
+        if progress_callback is None:
+            return
+        try:
+            progress_callback(stage, status, info)
+        except Exception as e:
+            print(f"⚠️ Ошибка обработчика прогресса: {e}")
+    
+    @staticmethod
+    def _emit_scenes(scene_callback: Optional[SceneCallback], scenes: List[Any]):
+        """Передает готовые сцены этапа 3 подписчику (если он задан)"""
+        if scene_callback is None:
+            return
+        for scene in scenes:
+            if not isinstance(scene, dict):
+                continue
+            try:
+                scene_callback(scene)
+            except Exception as e:
+                print(f"⚠️ Ошибка обработчика сцен: {e}")
+    
+    async def _astream_scenes(self, chain, params: Dict[str, Any],
+                              scene_callback: SceneCallback) -> Dict[str, Any]:
+        """Вызывает цепочку этапа 3 в режиме потока
+
+        JsonOutputParser отдает частично разобранный JSON по мере ответа модели;
+        сцена считается готовой, когда модель начала писать следующую.
+        """
+        result = None
+        emitted = 0
+        async for partial in chain.astream(params):
+            result = partial
+            scenes = partial.get('scenes') if isinstance(partial, dict) else None
+            if isinstance(scenes, list) and len(scenes) - 1 > emitted:
+                self._emit_scenes(scene_callback, scenes[emitted:len(scenes) - 1])
+                emitted = len(scenes) - 1
+        if not isinstance(result, dict):
+            raise ValueError("Модель вернула пустой ответ")
+        self._emit_scenes(scene_callback, (result.get('scenes') or [])[emitted:])
+        return result
+    
+    async def _arun_chain(self, stage: str, chain, inputs: List[Dict[str, Any]],
+                          scene_callback: Optional[SceneCallback] = None) -> List[Any]:
+        """Асинхронно вызывает цепочку для всех inputs (список результатов или исключений)
+
+        Если задан scene_callback, сцены этапа 3 передаются ему сразу по готовности.
+        """
+        stream = scene_callback is not None and stage == STAGE_CONTENT
+        if len(inputs) == 1:
+            if stream:
+                return [await self._astream_scenes(chain, inputs[0], scene_callback)]
+            return [await chain.ainvoke(inputs[0])]
         
-        if not self.is_available():
-            return {"error": "LangChain генератор недоступен"}
+        config = {"max_concurrency": self.content_concurrency}
+        if not stream:
+            return await chain.abatch(inputs, config=config, return_exceptions=True)
         
-        try:
-            print("🗺️ Этап 1: Создание структурной карты...")
-            
-            # Этап 1: Структурная карта
-            structure_params = {
-                "genre": genre,
-                "hero": hero,
-                "goal": goal,
-                "scene_count": scene_count
-            }
-            
-            quest_structure = self.step1_mapper.invoke(structure_params)
-            print(f"✅ Структура создана: {len(quest_structure.get('quest_structure', {}).get('scenes', []))} сцен")
-            
-            print("📋 Этап 2: Детальное планирование выборов...")
-            
-            # Этап 2: Детальное планирование
-            planning_params = {
-                "quest_structure": json.dumps(quest_structure, ensure_ascii=False),
+        results = [None] * len(inputs)
+        async for index, result in chain.abatch_as_completed(inputs, config=config, return_exceptions=True):
+            results[index] = result
+            if isinstance(result, dict):
+                self._emit_scenes(scene_callback, result.get('scenes') or [])
+        return results
+    
+    def _generate_content_parallel(self, quest_structure: Dict[str, Any], planned_scenes: List[Dict[str, Any]],
+                                   genre: str, hero: str, goal: str):
+        """Этап 3 в режиме parallel (шаг конвейера _pipeline)
+
+        План делится на пачки по content_batch_size сцен; конвейер выдает список
+        параметров, и все пачки генерируются одновременно. Сцены собираются в
+        порядке плана.
+        """
+        planned_scenes = [entry for entry in planned_scenes if isinstance(entry, dict)]
+        if not planned_scenes:
+            return {"scenes": []}
+        
+        scene_ids = ", ".join(str(entry.get('scene_id')) for entry in planned_scenes)
+        theme = quest_structure.get('quest_structure', {}).get('theme', '')
+        size = self.content_batch_size
+        batches = [planned_scenes[start:start + size] for start in range(0, len(planned_scenes), size)]
+        batch_params = [
+            {
+                "detailed_plan": compact(STAGE_CONTENT, {"detailed_plan": batch}, encode_plan),
+                "scene_ids": scene_ids,
+                "theme": theme,
                 "genre": genre,
                 "hero": hero,
                 "goal": goal
             }
-            
-            detailed_plan = self.step2_planner.invoke(planning_params)
-            planned_scenes = detailed_plan.get('detailed_plan', [])
-            print(f"✅ План детализирован: {len(planned_scenes)} сцен с выборами")
-            
-            print("✍️ Этап 3: Генерация полного контента...")
-            
-            # Этап 3: Генерация контента
+            for batch in batches
+        ]
+        print(f"⚡ Контент генерируется параллельно: {len(batches)} запросов "
+              f"(по {size} сцен, одновременно до {self.content_concurrency})")
+        
+        batch_results = yield STAGE_CONTENT, self.step3_scene_generator, batch_params
+        
+        generated = {}
+        for result in batch_results:
+            for scene in result.get('scenes', []):
+                if isinstance(scene, dict) and scene.get('scene_id') not in generated:
+                    generated[scene.get('scene_id')] = scene
+        # Порядок плана; сцены, которых нет в плане, - в конце
+        ordered = [generated.pop(entry.get('scene_id')) for entry in planned_scenes
+                   if entry.get('scene_id') in generated]
+        return {"scenes": ordered + list(generated.values())}
+    
+    @staticmethod
+    def _validate_locally(quest_content: Dict[str, Any], max_depth: Optional[int]) -> Dict[str, Any]:
+        """Локальная проверка графа, учитывается в измерениях как этап 4"""
+        with stage_scope(STAGE_VALIDATION, 1, 0) as stats:
+            result = validate_quest_graph(quest_content, max_depth)
+            record_results(stats, [result])
+        return result
+
+    def _validate(self, quest_content: Dict[str, Any], max_depth: Optional[int]):
+        """Этап 4: проверка и исправление квеста (шаг конвейера _pipeline)
+
+        Структура проверяется локально; к модели обращаемся только в режиме llm
+        или когда локальная проверка нашла проблемы в тексте сцен.
+        """
+        if self.validation_mode == VALIDATION_LLM:
+            validation_params = {
+                "quest": compact(STAGE_VALIDATION, quest_content, encode_quest, limits=(None,)),
+                "issues": "нет",
+            }
+            return (yield STAGE_VALIDATION, self.step4_validator, validation_params)
+        
+        local_result = self._validate_locally(quest_content, max_depth)
+        text_issues = local_result['text_issues']
+        if (local_result['validation_result'] == 'failed' or not text_issues
+                or self.validation_mode == VALIDATION_LOCAL):
+            return local_result
+        
+        print(f"✏️ Проблемы с текстом ({len(text_issues)}), исправление передается модели...")
+        validation_params = {
+            "quest": compact(STAGE_VALIDATION, local_result['final_quest'], encode_quest, limits=(None,)),
+            "issues": "; ".join(text_issues),
+        }
+        llm_result = yield STAGE_VALIDATION, self.step4_validator, validation_params
+        if llm_result.get('validation_result') not in ('passed', 'fixed'):
+            print("⚠️ Модель не исправила текст, используется локально исправленный квест")
+            return local_result
+        
+        # Ответ модели еще раз проверяется локально: она могла нарушить структуру
+        checked = self._validate_locally(llm_result.get('final_quest', local_result['final_quest']), max_depth)
+        if checked['validation_result'] == 'failed':
+            return local_result
+        return {
+            "validation_result": "fixed",
+            "issues_found": local_result['issues_found'] + llm_result.get('issues_found', []) + checked['issues_found'],
+            "corrections_made": (local_result['corrections_made'] + llm_result.get('corrections_made', [])
+                                 + checked['corrections_made']),
+            "text_issues": checked['text_issues'],
+            "final_quest": checked['final_quest'],
+            "stats": checked['stats'],
+        }
+    
+    def _pipeline(self, genre: str, hero: str, goal: str, scene_count: int,
+                  report: Callable[..., None], max_depth: Optional[int] = None):
+        """Описание этапов генерации, общее для синхронного и асинхронного запуска
+
+        Генератор выдает кортежи (этап, цепочка, параметры) и получает обратно
+        результат вызова цепочки. Если параметры - список, цепочка вызывается для
+        всех элементов одновременно и обратно передается список результатов.
+        Итоговый квест возвращается через StopIteration.
+        """
+        print("🗺️ Этап 1: Создание структурной карты...")
+        report(STAGE_STRUCTURE, "started")
+        
+        # Этап 1: Структурная карта
+        structure_params = {
+            "genre": genre,
+            "hero": hero,
+            "goal": goal,
+            "scene_count": scene_count
+        }
+        
+        quest_structure = yield STAGE_STRUCTURE, self.step1_mapper, structure_params
+        structure_scenes = quest_structure.get('quest_structure', {}).get('scenes', [])
+        print(f"✅ Структура создана: {len(structure_scenes)} сцен")
+        report(STAGE_STRUCTURE, "done", {"scenes": len(structure_scenes)})
+        
+        print("📋 Этап 2: Детальное планирование выборов...")
+        report(STAGE_PLANNING, "started")
+        
+        # Этап 2: Детальное планирование
+        planning_params = {
+            "quest_structure": compact(STAGE_PLANNING, quest_structure, encode_structure),
+            "genre": genre,
+            "hero": hero,
+            "goal": goal
+        }
+        
+        detailed_plan = yield STAGE_PLANNING, self.step2_planner, planning_params
+        planned_scenes = detailed_plan.get('detailed_plan', [])
+        print(f"✅ План детализирован: {len(planned_scenes)} сцен с выборами")
+        report(STAGE_PLANNING, "done", {"scenes": len(planned_scenes)})
+        
+        print("✍️ Этап 3: Генерация полного контента...")
+        report(STAGE_CONTENT, "started")
+        
+        # Этап 3: Генерация контента
+        if self.content_mode == CONTENT_PARALLEL:
+            quest_content = yield from self._generate_content_parallel(
+                quest_structure, planned_scenes, genre, hero, goal)
+        else:
             generation_params = {
-                "detailed_plan": json.dumps(detailed_plan, ensure_ascii=False),
+                "detailed_plan": compact(STAGE_CONTENT, detailed_plan, encode_plan),
                 "genre": genre,
                 "hero": hero,
                 "goal": goal
             }
             
-            quest_content = self.step3_generator.invoke(generation_params)
-            generated_scenes = quest_content.get('scenes', [])
-            print(f"✅ Контент сгенерирован: {len(generated_scenes)} сцен")
-            
-            print("🔍 Этап 4: Валидация и исправления...")
-            
-            # Этап 4: Валидация и исправления
-            validation_params = {
-                "quest": json.dumps(quest_content, ensure_ascii=False)
-            }
-            
-            validation_result = self.step4_validator.invoke(validation_params)
-            
-            if validation_result.get('validation_result') == 'passed':
-                print("✅ Квест прошел валидацию!")
-                final_quest = validation_result.get('final_quest', quest_content)
-            elif validation_result.get('validation_result') == 'fixed':
-                print("🔧 Квест исправлен автоматически!")
-                corrections = validation_result.get('corrections_made', [])
-                for correction in corrections:
-                    print(f"  - {correction}")
-                final_quest = validation_result.get('final_quest', quest_content)
-            else:
-                issues = validation_result.get('issues_found', [])
-                print(f"❌ Критические ошибки: {issues}")
-                return {"error": f"Не удалось исправить ошибки: {', '.join(issues)}"}
-            
-            print("🎉 Квест успешно создан!")
-            return final_quest
-            
+            quest_content = yield STAGE_CONTENT, self.step3_generator, generation_params
+        generated_scenes = quest_content.get('scenes', [])
+        print(f"✅ Контент сгенерирован: {len(generated_scenes)} сцен")
+        report(STAGE_CONTENT, "done", {"scenes": len(generated_scenes)})
+        
+        print("🔍 Этап 4: Валидация и исправления...")
+        report(STAGE_VALIDATION, "started")
+        
+        # Этап 4: Валидация и исправления
+        validation_result = yield from self._validate(quest_content, max_depth)
+        
+        if validation_result.get('validation_result') == 'passed':
+            print("✅ Квест прошел валидацию!")
+            final_quest = validation_result.get('final_quest', quest_content)
+        elif validation_result.get('validation_result') == 'fixed':
+            print("🔧 Квест исправлен автоматически!")
+            corrections = validation_result.get('corrections_made', [])
+            for correction in corrections:
+                print(f"  - {correction}")
+            final_quest = validation_result.get('final_quest', quest_content)
+        else:
+            issues = validation_result.get('issues_found', [])
+            print(f"❌ Критические ошибки: {issues}")
+            report(STAGE_VALIDATION, "failed", {"issues": issues})
+            return {"error": f"Не удалось исправить ошибки: {', '.join(issues)}"}
+        
+        remaining = validation_result.get('text_issues') or []
+        for issue in remaining:
+            print(f"⚠️ Не исправлено: {issue}")
+        report(STAGE_VALIDATION, "done",
+               {"result": validation_result.get('validation_result'),
+                "unresolved_issues": len(remaining),
+                **validation_result.get('stats', {})})
+        print("🎉 Квест успешно создан!")
+        return final_quest
+    
+    @staticmethod
+    def _load_checkpoint(store, key):
+        """Результат этапа, сохраненный при предыдущей попытке (или None)"""
+        if store is None or key is None:
+            return None
+        try:
+            return store.get(key)
+        except Exception as e:
+            print(f"⚠️ Ошибка чтения контрольной точки: {e}")
+            return None
+    
+    @staticmethod
+    def _save_checkpoint(store, key, result):
+        if store is None or key is None:
+            return
+        try:
+            store.set(key, result)
+        except Exception as e:
+            print(f"⚠️ Ошибка записи контрольной точки: {e}")
+    
+    @staticmethod
+    def _drop_checkpoint(store, key):
+        if store is None or key is None:
+            return
+        try:
+            store.delete(key)
+        except Exception as e:
+            print(f"⚠️ Ошибка удаления контрольной точки: {e}")
+    
+    @staticmethod
+    def _checkpoint_keys(store, checkpoint_scope, stage, batch):
+        if store is None:
+            return [None] * len(batch)
+        return [make_checkpoint_key(checkpoint_scope, stage, params) for params in batch]
+    
+    @staticmethod
+    def _raise_first_error(results):
+        """После batch(..., return_exceptions=True): успешные результаты уже сохранены"""
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+    
+    def generate_quest(self, genre: str, hero: str, goal: str, scene_count: int = 10, 
+                      max_depth: int = 5, complexity: str = "medium", 
+                      ending_type: str = "single",
+                      progress_callback: Optional[ProgressCallback] = None,
+                      checkpoint_scope: Optional[str] = None) -> Dict[str, Any]:
+        """Многоэтапная генерация квеста
+
+        Если задан checkpoint_scope, результат каждого этапа сохраняется как
+        контрольная точка (ключ - область + этап + хэш входа этапа), и
+        повторный запуск с той же областью продолжает с последнего успешного этапа.
+        """
+        
+        if not self.is_available():
+            return {"error": "LangChain генератор недоступен"}
+        
+        report = functools.partial(self._report_progress, progress_callback)
+        pipeline = self._pipeline(genre, hero, goal, scene_count, report, max_depth)
+        store = get_stage_checkpoints() if checkpoint_scope else None
+        checkpoint_keys = []
+        written_keys = []
+        
+        try:
+            stage, chain, params = next(pipeline)
+            while True:
+                batch = params if isinstance(params, list) else [params]
+                checkpoint_keys = self._checkpoint_keys(store, checkpoint_scope, stage, batch)
+                written_keys.extend(key for key in checkpoint_keys if key is not None)
+                results = [self._load_checkpoint(store, key) for key in checkpoint_keys]
+                missing = [index for index, result in enumerate(results) if result is None]
+                if len(missing) < len(batch):
+                    print(f"♻️ Этап {stage} восстановлен из контрольной точки "
+                          f"({len(batch) - len(missing)} из {len(batch)})")
+                with stage_scope(stage, len(batch), len(batch) - len(missing)) as stats:
+                    if len(missing) == 1:
+                        fresh = [chain.invoke(batch[missing[0]])]
+                    elif missing:
+                        fresh = chain.batch([batch[index] for index in missing],
+                                            config={"max_concurrency": self.content_concurrency},
+                                            return_exceptions=True)
+                    else:
+                        fresh = []
+                    record_results(stats, fresh)
+                    for index, result in zip(missing, fresh):
+                        if not isinstance(result, Exception):
+                            results[index] = result
+                            self._save_checkpoint(store, checkpoint_keys[index], result)
+                    self._raise_first_error(fresh)
+                stage, chain, params = pipeline.send(results if isinstance(params, list) else results[0])
+        except StopIteration as finished:
+            # Ошибку дал результат последнего этапа - при повторе он выполняется заново.
+            # После успеха контрольные точки области больше не нужны
+            for key in (checkpoint_keys if 'error' in finished.value else written_keys):
+                self._drop_checkpoint(store, key)
+            return finished.value
+        except Exception as e:
+            print(f"❌ Ошибка в многоэтапной генерации: {e}")
+            return {"error": f"Ошибка генерации: {str(e)}"}
+    
+    async def agenerate_quest(self, genre: str, hero: str, goal: str, scene_count: int = 10,
+                              max_depth: int = 5, complexity: str = "medium",
+                              ending_type: str = "single",
+                              progress_callback: Optional[ProgressCallback] = None,
+                              checkpoint_scope: Optional[str] = None,
+                              scene_callback: Optional[SceneCallback] = None) -> Dict[str, Any]:
+        """Асинхронная многоэтапная генерация квеста (этапы вызываются через ainvoke)
+
+        scene_callback получает каждую сцену этапа 3, как только модель ее дописала.
+        """
+        
+        if not self.is_available():
+            return {"error": "LangChain генератор недоступен"}
+        
+        report = functools.partial(self._report_progress, progress_callback)
+        pipeline = self._pipeline(genre, hero, goal, scene_count, report, max_depth)
+        store = get_stage_checkpoints() if checkpoint_scope else None
+        checkpoint_keys = []
+        written_keys = []
+        
+        try:
+            stage, chain, params = next(pipeline)
+            while True:
+                batch = params if isinstance(params, list) else [params]
+                checkpoint_keys = self._checkpoint_keys(store, checkpoint_scope, stage, batch)
+                written_keys.extend(key for key in checkpoint_keys if key is not None)
+                results = [None] * len(batch)
+                if store is not None:
+                    for index, key in enumerate(checkpoint_keys):
+                        results[index] = await sync_to_async(self._load_checkpoint)(store, key)
+                missing = [index for index, result in enumerate(results) if result is None]
+                if len(missing) < len(batch):
+                    print(f"♻️ Этап {stage} восстановлен из контрольной точки "
+                          f"({len(batch) - len(missing)} из {len(batch)})")
+                with stage_scope(stage, len(batch), len(batch) - len(missing)) as stats:
+                    fresh = []
+                    if missing:
+                        fresh = await self._arun_chain(stage, chain, [batch[index] for index in missing],
+                                                       scene_callback)
+                    record_results(stats, fresh)
+                    for index, result in zip(missing, fresh):
+                        if not isinstance(result, Exception):
+                            results[index] = result
+                            if store is not None:
+                                await sync_to_async(self._save_checkpoint)(store, checkpoint_keys[index], result)
+                    self._raise_first_error(fresh)
+                stage, chain, params = pipeline.send(results if isinstance(params, list) else results[0])
+        except StopIteration as finished:
+            if store is not None:
+                for key in (checkpoint_keys if 'error' in finished.value else written_keys):
+                    await sync_to_async(self._drop_checkpoint)(store, key)
+            return finished.value
         except Exception as e:
             print(f"❌ Ошибка в многоэтапной генерации: {e}")
-            return {"error": f"Ошибка генерации: {str(e)}"}
\ No newline at end of file
+            return {"error": f"Ошибка генерации: {str(e)}"}
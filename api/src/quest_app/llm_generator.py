@@ -2,32 +2,215 @@
 Упрощенный генератор квестов через LangChain
 """
 
-from . import langchain_generator
+import threading
+import uuid
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import instrumentation, langchain_generator
+from .result_cache import get_result_cache, make_cache_key, reset_caches
 
 class QuestGenerator:
     """Упрощенная обертка для LangChain генератора"""
     
-    def __init__(self):
-        self.langchain_gen = langchain_generator.LangChainQuestGenerator()
+    def __init__(self, llm=None):
+        self.langchain_gen = langchain_generator.LangChainQuestGenerator(llm=llm)
+    
+    @staticmethod
+    def _cache_lookup(cache_key, progress_callback=None):
+        """Ищет готовый квест в кэше результатов"""
+        cache = get_result_cache()
+        if cache is None:
+            return None
+        try:
+            cached = cache.get(cache_key)
+        except Exception as e:
+            print(f"⚠️ Ошибка чтения кэша результатов: {e}")
+            return None
+        if cached is None:
+            return None
+        
+        print("♻️ Квест найден в кэше результатов")
+        for stage, _ in langchain_generator.GENERATION_STAGES:
+            langchain_generator.LangChainQuestGenerator._report_progress(
+                progress_callback, stage, "cached")
+        return cached
+    
+    @staticmethod
+    def _cache_store(cache_key, result):
+        """Сохраняет успешный результат в кэш"""
+        cache = get_result_cache()
+        if cache is None or 'error' in result:
+            return
+        try:
+            cache.set(cache_key, result)
+        except Exception as e:
+            print(f"⚠️ Ошибка записи в кэш результатов: {e}")
     
     def generate_quest(self, genre: str, hero: str, goal: str, scene_count: int = 10, 
                       max_depth: int = 5, complexity: str = "medium", 
-                      ending_type: str = "single", max_retries: int = 3):
-        """Генерирует квест используя только LangChain"""
+                      ending_type: str = "single", max_retries: int = 3,
+                      progress_callback=None, use_cache: bool = True,
+                      checkpoint_scope: Optional[str] = None, run_callback=None):
+        """Генерирует квест используя только LangChain
+
+        При use_cache=True результат для тех же (после нормализации) параметров
+        берется из кэша; use_cache=False всегда генерирует новый вариант.
+        При ошибке делается до max_retries попыток, каждая продолжает с последнего
+        успешного этапа (контрольные точки в области checkpoint_scope).
+        Измерения этапов сохраняются в GenerationRun; run_callback получает эту
+        запись, чтобы связать ее с сохраненным квестом (store_quest(..., run=run)).
+        """
+        
+        recorder = instrumentation.RunRecorder({"genre": genre, "scene_count": scene_count})
+        cache_key = make_cache_key(genre, hero, goal, scene_count, max_depth, complexity, ending_type,
+                                   self.langchain_gen.pipeline_signature())
+        if use_cache:
+            cached = self._cache_lookup(cache_key, progress_callback)
+            if cached is not None:
+                recorder.status = instrumentation.RUN_CACHED
+                self._finish_run(recorder, cached, run_callback)
+                return cached
+        
+        if not self.langchain_gen.is_available():
+            return {"error": "LangChain генератор недоступен. Проверьте установку langchain-mistralai."}
+        
+        checkpoint_scope = checkpoint_scope or uuid.uuid4().hex
+        attempts = max(1, int(max_retries))
+        
+        try:
+            with recorder.activate():
+                for attempt in range(1, attempts + 1):
+                    recorder.attempts = attempt
+                    result = self.langchain_gen.generate_quest(
+                        genre=genre,
+                        hero=hero,
+                        goal=goal,
+                        scene_count=scene_count,
+                        max_depth=max_depth,
+                        complexity=complexity,
+                        ending_type=ending_type,
+                        progress_callback=progress_callback,
+                        checkpoint_scope=checkpoint_scope
+                    )
+                    if 'error' not in result:
+                        break
+                    if attempt < attempts:
+                        print(f"🔁 Попытка {attempt + 1} из {attempts}: продолжаем с последнего успешного этапа")
+            self._cache_store(cache_key, result)
+        except Exception as e:
+            result = {"error": f"Ошибка генерации: {str(e)}"}
+        self._finish_run(recorder, result, run_callback)
+        return result
+    
+    async def agenerate_quest(self, genre: str, hero: str, goal: str, scene_count: int = 10,
+                              max_depth: int = 5, complexity: str = "medium",
+                              ending_type: str = "single", max_retries: int = 3,
+                              progress_callback=None, use_cache: bool = True,
+                              checkpoint_scope: Optional[str] = None, scene_callback=None,
+                              run_callback=None):
+        """Асинхронная версия generate_quest для ASGI
+
+        scene_callback получает сцены этапа 3 по мере генерации (для потоковой выдачи).
+        """
+        
+        recorder = instrumentation.RunRecorder({"genre": genre, "scene_count": scene_count})
+        cache_key = make_cache_key(genre, hero, goal, scene_count, max_depth, complexity, ending_type,
+                                   self.langchain_gen.pipeline_signature())
+        if use_cache:
+            cached = await sync_to_async(self._cache_lookup)(cache_key, progress_callback)
+            if cached is not None:
+                recorder.status = instrumentation.RUN_CACHED
+                await sync_to_async(self._finish_run)(recorder, cached, run_callback)
+                return cached
         
         if not self.langchain_gen.is_available():
             return {"error": "LangChain генератор недоступен. Проверьте установку langchain-mistralai."}
         
+        checkpoint_scope = checkpoint_scope or uuid.uuid4().hex
+        attempts = max(1, int(max_retries))
+        
         try:
-            result = self.langchain_gen.generate_quest(
-                genre=genre,
-                hero=hero,
-                goal=goal,
-                scene_count=scene_count,
-                max_depth=max_depth,
-                complexity=complexity,
-                ending_type=ending_type
-            )
-            return result
+            with recorder.activate():
+                for attempt in range(1, attempts + 1):
+                    recorder.attempts = attempt
+                    result = await self.langchain_gen.agenerate_quest(
+                        genre=genre,
+                        hero=hero,
+                        goal=goal,
+                        scene_count=scene_count,
+                        max_depth=max_depth,
+                        complexity=complexity,
+                        ending_type=ending_type,
+                        progress_callback=progress_callback,
+                        checkpoint_scope=checkpoint_scope,
+                        scene_callback=scene_callback
+                    )
+                    if 'error' not in result:
+                        break
+                    if attempt < attempts:
+                        print(f"🔁 Попытка {attempt + 1} из {attempts}: продолжаем с последнего успешного этапа")
+            await sync_to_async(self._cache_store)(cache_key, result)
         except Exception as e:
-            return {"error": f"Ошибка генерации: {str(e)}"}
\ No newline at end of file
+            result = {"error": f"Ошибка генерации: {str(e)}"}
+        await sync_to_async(self._finish_run)(recorder, result, run_callback)
+        return result
+    
+    @staticmethod
+    def _finish_run(recorder, result, run_callback=None):
+        """Сохраняет измерения генерации и передает запись в run_callback"""
+        recorder.finish(result)
+        if recorder.stages:
+            print(f"📊 Этапы генерации: {recorder.summary()}")
+        run = recorder.save()
+        if run is not None and run_callback is not None:
+            run_callback(run)
+
+
+# Общий для процесса генератор: клиент Mistral и цепочки этапов создаются один раз
+_shared_generator = None
+_shared_generator_lock = threading.Lock()
+
+
+def get_quest_generator() -> QuestGenerator:
+    """Возвращает общий генератор, создавая его при первом обращении
+
+    Если генератор не смог настроиться (например, не задан MISTRAL_API_KEY),
+    при следующем обращении настройка повторяется.
+    """
+    generator = _shared_generator
+    if generator is not None and generator.langchain_gen.is_available():
+        return generator
+    
+    with _shared_generator_lock:
+        generator = _shared_generator
+        if generator is None or not generator.langchain_gen.is_available():
+            generator = _build_shared_generator()
+    return generator
+
+
+def reload_quest_generator() -> QuestGenerator:
+    """Пересоздает общий генератор (вызывать после изменения настроек LLM)"""
+    with _shared_generator_lock:
+        return _build_shared_generator()
+
+
+def _build_shared_generator() -> QuestGenerator:
+    global _shared_generator
+    _shared_generator = QuestGenerator()
+    return _shared_generator
+
+
+@receiver(setting_changed)
+def _reset_caches_on_settings_change(setting, **kwargs):
+    """Сбрасывает кэши генерации при изменении их настроек (override_settings)
+
+    Модель и ключ LangChainQuestGenerator читает из переменных окружения, а не
+    из settings, поэтому после их изменения общий генератор нужно пересоздать
+    явно через reload_quest_generator().
+    """
+    if setting in ('QUEST_RESULT_CACHE', 'QUEST_STAGE_CHECKPOINTS'):
+        reset_caches()
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+
+class Command(BaseCommand):
+    help = ("Заполняет поля сводки квестов (scene_count, choice_count, max_depth, ending_count) "
+            "и content_hash по quest_data")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Пересчитать все квесты, а не только те, где сводка еще не заполнена")
+        parser.add_argument('--batch-size', type=int, default=500, help="Квестов в одном UPDATE")
+
+    def handle(self, *args, **options):
+        from quest_app.models import Quest
+
+        quests = Quest.objects.only('id', 'quest_data').order_by('id')
+        if not options['all']:
+            quests = quests.filter(Q(scene_count__isnull=True) | Q(content_hash=''))
+
+        batch_size = options['batch_size']
+        batch = []
+        updated = failed = 0
+        for quest in quests.iterator(chunk_size=batch_size):
+            try:
+                quest.refresh_summary()
+            except (TypeError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f"Квест {quest.id}: не удалось разобрать quest_data ({e})")
+                continue
+            batch.append(quest)
+            if len(batch) >= batch_size:
+                updated += Quest.objects.bulk_update(batch, Quest.SUMMARY_FIELDS)
+                batch = []
+        if batch:
+            updated += Quest.objects.bulk_update(batch, Quest.SUMMARY_FIELDS)
+
+        self.stdout.write(self.style.SUCCESS(f"Обновлено квестов: {updated}, с ошибками: {failed}"))
@@ -0,0 +1,31 @@
+import importlib
+import json
+
+from django.core.management.base import BaseCommand
+
+from quest_app.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Запускает бенчмарк приложения (список: python manage.py benchmark --help)"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='benchmark', required=True, title="бенчмарки")
+        for name, module_path in BENCHMARKS.items():
+            module = importlib.import_module(module_path)
+            subparser = subparsers.add_parser(name, help=module.DESCRIPTION)
+            subparser.add_argument('--json', dest='json_output', default=None,
+                                   help="Сохранить результаты в JSON файл")
+            module.add_arguments(subparser)
+
+    def handle(self, *args, **options):
+        name = options.pop('benchmark')
+        json_output = options.pop('json_output')
+        module = importlib.import_module(BENCHMARKS[name])
+
+        results = module.run(self.stdout, **options)
+
+        if json_output:
+            with open(json_output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {json_output}"))
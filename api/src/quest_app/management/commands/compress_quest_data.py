@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Перезаписывает quest_data по настройке QUEST_DATA_COMPRESSION и выводит отчет "
+            "о сэкономленном месте; --train предварительно обучает общий словарь сжатия")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--train', action='store_true', help="Обучить новый словарь на сохраненных квестах")
+        parser.add_argument('--sample-size', type=int, default=500, help="Квестов в обучающей выборке")
+        parser.add_argument('--batch-size', type=int, default=500, help="Квестов в одном UPDATE")
+        parser.add_argument('--report', action='store_true', help="Только вывести текущий объем, ничего не меняя")
+
+    def handle(self, *args, **options):
+        from quest_app import compression
+        from quest_app.json_codec import get_codec
+        from quest_app.models import CompressionDictionary, Quest
+
+        before = compression.storage_report(Quest)
+        if options['report']:
+            self.stdout.write(f"Квестов: {before['rows']}, сжато: {before['compressed_rows']}, "
+                              f"объем quest_data: {before['stored_bytes']} байт")
+            return
+
+        algorithm = compression.get_compression_config()['ALGORITHM']
+        if options['train']:
+            if algorithm == 'none':
+                raise CommandError("Сжатие выключено: задайте QUEST_DATA_COMPRESSION (zlib или zstd)")
+            codec = get_codec()
+            samples = [
+                codec.dumps(quest_data)
+                for quest_data in Quest.objects.order_by('-id')
+                .values_list('quest_data', flat=True)[:options['sample_size']]
+            ]
+            try:
+                data = compression.train_dictionary(samples, algorithm)
+            except Exception as e:
+                raise CommandError(f"Не удалось обучить словарь: {e}")
+            dictionary = CompressionDictionary.objects.create(
+                algorithm=algorithm, data=data, sample_count=len(samples))
+            compression.reset_dictionary_cache()
+            self.stdout.write(f"Обучен словарь {algorithm} #{dictionary.id}: {len(data)} байт, "
+                              f"квестов в выборке: {len(samples)}")
+
+        rewritten = compression.recompress_quests(Quest, batch_size=options['batch_size'])
+        after = compression.storage_report(Quest)
+
+        self.stdout.write(f"Перезаписано квестов: {rewritten} (алгоритм: {algorithm})")
+        for line in compression.format_report(before, after):
+            self.stdout.write(line)
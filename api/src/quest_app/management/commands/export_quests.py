@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Выгружает квесты в двоичный архив (см. quest_app/quest_archive.py) для переноса "
+            "в другое окружение командой import_quests")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл архива")
+        parser.add_argument('--genre', default=None, help="Только квесты этого жанра")
+        parser.add_argument('--ids', default=None, help="Только квесты с этими id через запятую")
+        parser.add_argument('--compression', default='zlib', choices=['zlib', 'none'],
+                            help="Сжатие записей архива")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Квестов в одном запросе к БД")
+
+    def handle(self, *args, **options):
+        import os
+        import time
+
+        from quest_app.models import Quest
+        from quest_app.quest_archive import QuestArchiveWriter
+
+        queryset = Quest.objects.order_by('id')
+        if options['genre']:
+            queryset = queryset.filter(quest_input__genre=options['genre'])
+        if options['ids']:
+            try:
+                ids = [int(value) for value in options['ids'].split(',') if value.strip()]
+            except ValueError:
+                raise CommandError("--ids: ожидаются целые числа через запятую")
+            queryset = queryset.filter(id__in=ids)
+
+        rows = queryset.values_list(
+            'id', 'created_at', 'quest_data', 'generator_version',
+            'quest_input__genre', 'quest_input__hero', 'quest_input__goal',
+        ).iterator(chunk_size=options['chunk_size'])
+
+        started = time.perf_counter()
+        try:
+            with QuestArchiveWriter(options['path'], compression=options['compression']) as archive:
+                for quest_id, created_at, quest_data, generator_version, genre, hero, goal in rows:
+                    archive.write(quest_id, quest_data, genre=genre, hero=hero, goal=goal,
+                                  generator_version=generator_version, created_at=created_at)
+        except (OSError, TypeError) as e:
+            raise CommandError(f"Не удалось записать архив: {e}")
+
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Выгружено квестов: {archive.count} в {options['path']} ({size} байт, "
+            f"{elapsed:.1f} с)"))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Генерирует пакет квестов по JSONL-файлу (строка - объект с genre, hero, goal и "
+            "необязательными параметрами генерации). Повторный запуск с тем же файлом "
+            "продолжает прерванный пакет")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', required=True, help="JSONL-файл с элементами пакета")
+        parser.add_argument('--concurrency', type=int, default=None, help="Одновременных генераций")
+        parser.add_argument('--name', default='', help="Название пакета (по умолчанию - имя файла)")
+        parser.add_argument('--flush-size', type=int, default=None, help="Квестов в одном bulk_create")
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="Повторить элементы, завершившиеся ошибкой в прошлых запусках")
+
+    def handle(self, *args, **options):
+        import os
+
+        from quest_app.batches import create_batch, read_items_file, run_batch
+        from quest_app.models import GenerationJob
+
+        try:
+            items, source_hash = read_items_file(options['input'])
+            batch, created = create_batch(items, name=options['name'] or os.path.basename(options['input']),
+                                          source_hash=source_hash)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"Пакет {batch.id}: элементов {len(items)}, новых задач {created}")
+        if options['retry_failed']:
+            retried = batch.jobs.filter(status=GenerationJob.STATUS_FAILED).update(
+                status=GenerationJob.STATUS_PENDING, error='', worker='', finished_at=None)
+            self.stdout.write(f"Повторно поставлено в очередь: {retried}")
+
+        try:
+            result = run_batch(batch, concurrency=options['concurrency'], flush_size=options['flush_size'])
+        except KeyboardInterrupt:
+            raise CommandError("Прервано: готовые квесты сохранены; повторите команду с тем же файлом, "
+                               "чтобы догенерировать остальные элементы пакета")
+
+        counts = batch.status_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f"За запуск: готово {result['done']}, с ошибками {result['failed']}. "
+            f"Всего в пакете: " + ", ".join(f"{status} {count}" for status, count in counts.items())))
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Загружает квесты из архива export_quests пачками bulk_create. Квесты получают "
+            "новые id и сохраняют время создания; --get показывает один квест из архива без загрузки")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл архива")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Квестов в одном bulk_create")
+        parser.add_argument('--skip-existing', action='store_true',
+                            help="Пропускать квесты, уже сохраненные в БД (по хэшу quest_data)")
+        parser.add_argument('--without-scene-tables', action='store_true',
+                            help="Не заполнять QuestScene/QuestChoice при загрузке (быстрее; "
+                                 "потом python manage.py index_quest_scenes)")
+        parser.add_argument('--get', type=int, default=None, metavar='ID',
+                            help="Вывести квест с этим id из архива в JSON и выйти")
+
+    def handle(self, *args, **options):
+        import json
+        import time
+
+        from quest_app.json_codec import content_hash
+        from quest_app.models import Quest
+        from quest_app.quest_archive import ArchiveError, QuestArchiveReader
+        from quest_app.storage import store_quests_bulk
+
+        try:
+            archive = QuestArchiveReader(options['path'])
+        except (OSError, ArchiveError) as e:
+            raise CommandError(f"Не удалось открыть архив: {e}")
+
+        with archive:
+            if options['get'] is not None:
+                record = archive.get(options['get'])
+                if record is None:
+                    raise CommandError(f"Квеста {options['get']} нет в архиве")
+                record['created_at'] = record['created_at'].isoformat() if record['created_at'] else None
+                self.stdout.write(json.dumps(record, ensure_ascii=False, indent=2))
+                return
+
+            self.stdout.write(f"Квестов в архиве: {len(archive)}")
+            batch_size = max(1, options['batch_size'])
+            started = time.perf_counter()
+            imported = skipped = 0
+            entries = []
+            # Хэши квестов, уже загруженных из этого архива (повторы внутри архива)
+            seen = set()
+            scene_tables = False if options['without_scene_tables'] else None
+
+            def flush():
+                nonlocal imported, skipped
+                if options['skip_existing']:
+                    hashes = [content_hash(entry['quest_data']) for entry in entries]
+                    seen.update(Quest.objects.filter(content_hash__in=set(hashes) - seen)
+                                .values_list('content_hash', flat=True))
+                    fresh = []
+                    for entry, quest_hash in zip(entries, hashes):
+                        if quest_hash not in seen:
+                            seen.add(quest_hash)
+                            fresh.append(entry)
+                    skipped += len(entries) - len(fresh)
+                else:
+                    fresh = entries
+                imported += len(store_quests_bulk(fresh, save_files=False, scene_tables=scene_tables))
+                entries.clear()
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"  загружено {imported}, пропущено {skipped} ({imported / elapsed:.0f} квестов/с)")
+
+            try:
+                for record in archive:
+                    entries.append({
+                        'quest_data': record['quest_data'],
+                        'genre': record['genre'],
+                        'hero': record['hero'],
+                        'goal': record['goal'],
+                        'generator_version': record['generator_version'],
+                        'created_at': record['created_at'],
+                    })
+                    if len(entries) >= batch_size:
+                        flush()
+                if entries:
+                    flush()
+            except ArchiveError as e:
+                raise CommandError(f"Архив поврежден после {imported + skipped} квестов: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено квестов: {imported}, пропущено: {skipped} ({time.perf_counter() - started:.1f} с)"))
+        if options['without_scene_tables'] and imported:
+            self.stdout.write("Таблицы сцен не заполнены: выполните python manage.py index_quest_scenes")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Заполняет таблицы QuestScene/QuestChoice по quest_data сохраненных квестов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Перезаписать строки всех квестов, а не только еще не разобранных")
+
+    def handle(self, *args, **options):
+        from quest_app.models import Quest
+
+        quests = Quest.objects.only('id', 'quest_data').order_by('id')
+        if not options['all']:
+            quests = quests.filter(scene_rows__isnull=True)
+
+        indexed = failed = scene_total = choice_total = 0
+        for quest in quests.iterator(chunk_size=200):
+            try:
+                scenes, choices = quest.sync_scene_rows()
+            except (TypeError, ValueError, AttributeError) as e:
+                failed += 1
+                self.stderr.write(f"Квест {quest.id}: не удалось разобрать quest_data ({e})")
+                continue
+            indexed += 1
+            scene_total += scenes
+            choice_total += choices
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Разобрано квестов: {indexed} (сцен: {scene_total}, выборов: {choice_total}), с ошибками: {failed}"))
@@ -0,0 +1,77 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def _stop_worker(signum, frame):
+    """SIGTERM (Process.terminate) останавливает обработчик так же, как Ctrl+C"""
+    # Повторные сигналы не должны прервать запись очереди файлов
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def run_worker_process(worker_name, poll_interval, stale_timeout):
+    """Точка входа дочернего процесса-обработчика"""
+    import django
+    django.setup()
+
+    from quest_app.file_export import get_file_exporter
+    from quest_app.jobs import worker_loop
+
+    signal.signal(signal.SIGTERM, _stop_worker)
+    signal.signal(signal.SIGINT, _stop_worker)
+    try:
+        worker_loop(worker_name=worker_name, poll_interval=poll_interval, stale_timeout=stale_timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Дочерний процесс multiprocessing завершается через os._exit, минуя atexit:
+        # очередь выгрузки в файлы дописываем здесь, иначе saved_file задач укажет в пустоту
+        get_file_exporter().close()
+
+
+class Command(BaseCommand):
+    help = "Запускает пул локальных процессов, обрабатывающих очередь генерации квестов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Количество процессов-обработчиков")
+        parser.add_argument('--poll-interval', type=float, default=None, help="Пауза между опросами пустой очереди, сек")
+        parser.add_argument('--stale-timeout', type=int, default=None,
+                            help="Через сколько секунд без отчета задача возвращается в очередь")
+
+    def handle(self, *args, **options):
+        from quest_app.jobs import default_worker_name, get_jobs_config
+
+        config = get_jobs_config()
+        workers = options['workers'] or config['WORKERS']
+        poll_interval = options['poll_interval'] if options['poll_interval'] is not None else config['POLL_INTERVAL']
+        stale_timeout = options['stale_timeout'] if options['stale_timeout'] is not None else config['STALE_TIMEOUT']
+
+        # Дочерние процессы открывают собственные соединения с БД
+        connections.close_all()
+
+        base_name = default_worker_name()
+        processes = []
+        for index in range(workers):
+            process = multiprocessing.Process(
+                target=run_worker_process,
+                args=(f"{base_name}/{index}", poll_interval, stale_timeout),
+                daemon=True,
+            )
+            process.start()
+            processes.append(process)
+
+        self.stdout.write(self.style.SUCCESS(f"Запущено обработчиков: {workers}"))
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Остановка обработчиков...")
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
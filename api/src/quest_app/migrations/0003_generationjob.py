@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0002_alter_quest_quest_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('params', models.JSONField(verbose_name='Параметры генерации')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('stage', models.CharField(blank=True, default='', max_length=32, verbose_name='Текущий этап')),
+                ('progress', models.JSONField(blank=True, default=dict, verbose_name='Прогресс по этапам')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Количество попыток')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('saved_file', models.CharField(blank=True, default='', max_length=255)),
+                ('worker', models.CharField(blank=True, default='', max_length=100, verbose_name='Обработчик')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('quest', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='quest_app.quest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='quest_app_g_status_343326_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0003_generationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=32, verbose_name='Пространство ключей')),
+                ('key', models.CharField(max_length=64, verbose_name='Хэш входных данных')),
+                ('value', models.JSONField(verbose_name='Сохраненный результат')),
+                ('created_at', models.DateTimeField()),
+                ('accessed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['namespace', 'accessed_at'], name='quest_app_c_namespa_eb8f5d_idx')],
+                'constraints': [models.UniqueConstraint(fields=('namespace', 'key'), name='unique_cached_result_key')],
+            },
+        ),
+    ]
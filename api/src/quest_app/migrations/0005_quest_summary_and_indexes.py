@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0004_cachedresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quest',
+            name='choice_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Количество выборов'),
+        ),
+        migrations.AddField(
+            model_name='quest',
+            name='ending_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Количество концовок'),
+        ),
+        migrations.AddField(
+            model_name='quest',
+            name='generator_version',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Версия генератора'),
+        ),
+        migrations.AddField(
+            model_name='quest',
+            name='max_depth',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Максимальная глубина'),
+        ),
+        migrations.AddField(
+            model_name='quest',
+            name='scene_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Количество сцен'),
+        ),
+        migrations.AddIndex(
+            model_name='quest',
+            index=models.Index(fields=['created_at', 'id'], name='quest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questinput',
+            index=models.Index(fields=['genre'], name='questinput_genre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questinput',
+            index=models.Index(fields=['hero'], name='questinput_hero_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questinput',
+            index=models.Index(fields=['created_at'], name='questinput_created_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def reencode_quest_data(apps, schema_editor):
+    """Перезаписывает quest_data одним кодированием
+
+    Прежняя версия UnicodeJSONField сохраняла JSON-объект повторно
+    закодированным в JSON-строку; поле читает оба варианта, а запись идет
+    уже в новом формате.
+    """
+    Quest = apps.get_model('quest_app', 'Quest')
+    batch = []
+    for quest in Quest.objects.only('id', 'quest_data').order_by('id').iterator(chunk_size=BATCH_SIZE):
+        batch.append(quest)
+        if len(batch) >= BATCH_SIZE:
+            Quest.objects.bulk_update(batch, ['quest_data'])
+            batch = []
+    if batch:
+        Quest.objects.bulk_update(batch, ['quest_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0005_quest_summary_and_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(reencode_quest_data, migrations.RunPython.noop),
+    ]
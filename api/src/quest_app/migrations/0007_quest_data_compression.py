@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:23
+
+import quest_app.fields
+from django.db import migrations, models
+
+
+def recompress_quest_data(apps, schema_editor):
+    # Существующие квесты перезаписываются по текущей настройке
+    # QUEST_DATA_COMPRESSION (при none строки не меняются по содержимому)
+    from quest_app import compression
+
+    Quest = apps.get_model('quest_app', 'Quest')
+    if not Quest.objects.exists():
+        return
+    before = compression.storage_report(Quest)
+    compression.recompress_quests(Quest)
+    for line in compression.format_report(before, compression.storage_report(Quest)):
+        print(f"   {line}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0006_reencode_quest_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('algorithm', models.CharField(max_length=16, verbose_name='Алгоритм')),
+                ('data', models.BinaryField(verbose_name='Словарь')),
+                ('sample_count', models.PositiveIntegerField(default=0, verbose_name='Квестов в обучающей выборке')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='quest',
+            name='quest_data',
+            field=quest_app.fields.UnicodeJSONField(compress=True, verbose_name='Данные квеста в JSON'),
+        ),
+        migrations.RunPython(recompress_quest_data, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0007_quest_data_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestChoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scene_id', models.CharField(max_length=100, verbose_name='ID сцены')),
+                ('position', models.PositiveIntegerField(verbose_name='Порядковый номер в сцене')),
+                ('text', models.TextField(blank=True, default='', verbose_name='Текст выбора')),
+                ('next_scene', models.CharField(max_length=100, verbose_name='Следующая сцена')),
+                ('quest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='choice_rows', to='quest_app.quest')),
+            ],
+            options={
+                'ordering': ['quest', 'scene_id', 'position'],
+                'indexes': [models.Index(fields=['quest', 'scene_id'], name='questchoice_edge_idx'), models.Index(fields=['next_scene', 'quest'], name='questchoice_target_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='QuestScene',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scene_id', models.CharField(max_length=100, verbose_name='ID сцены')),
+                ('position', models.PositiveIntegerField(verbose_name='Порядковый номер в квесте')),
+                ('text', models.TextField(blank=True, default='', verbose_name='Текст сцены')),
+                ('depth', models.PositiveIntegerField(blank=True, null=True, verbose_name='Расстояние от start')),
+                ('choice_count', models.PositiveIntegerField(default=0, verbose_name='Количество выборов')),
+                ('is_ending', models.BooleanField(default=False, verbose_name='Финальная сцена')),
+                ('quest', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scene_rows', to='quest_app.quest')),
+            ],
+            options={
+                'ordering': ['quest', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('quest', 'scene_id'), name='unique_quest_scene')],
+            },
+        ),
+    ]
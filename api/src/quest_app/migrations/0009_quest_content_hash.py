@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:27
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def fill_content_hash(apps, schema_editor):
+    from quest_app.json_codec import content_hash
+
+    Quest = apps.get_model('quest_app', 'Quest')
+    batch = []
+    for quest in Quest.objects.only('id', 'quest_data').order_by('id').iterator(chunk_size=BATCH_SIZE):
+        quest.content_hash = content_hash(quest.quest_data)
+        batch.append(quest)
+        if len(batch) >= BATCH_SIZE:
+            Quest.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        Quest.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0008_scene_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quest',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Хэш данных квеста'),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
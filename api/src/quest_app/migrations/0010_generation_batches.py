@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0009_quest_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, default='', max_length=200, verbose_name='Название')),
+                ('source_hash', models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='Хэш входного файла')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='item_key',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Ключ элемента пакета'),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='quest_app.generationbatch'),
+        ),
+        migrations.AddConstraint(
+            model_name='generationjob',
+            constraint=models.UniqueConstraint(fields=('batch', 'item_key'), name='unique_batch_item'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0010_generation_batches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('success', 'Успешно'), ('failed', 'Ошибка'), ('cached', 'Из кэша')], max_length=16, verbose_name='Итог')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('genre', models.CharField(blank=True, default='', max_length=100, verbose_name='Жанр')),
+                ('scene_count', models.PositiveIntegerField(blank=True, null=True, verbose_name='Запрошено сцен')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток генерации')),
+                ('wall_ms', models.PositiveIntegerField(default=0, verbose_name='Время, мс')),
+                ('llm_calls', models.PositiveIntegerField(default=0, verbose_name='Вызовов модели')),
+                ('prompt_tokens', models.PositiveIntegerField(default=0, verbose_name='Токенов запроса')),
+                ('completion_tokens', models.PositiveIntegerField(default=0, verbose_name='Токенов ответа')),
+                ('retries', models.PositiveIntegerField(default=0, verbose_name='Повторов после 429')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('quest', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='runs', to='quest_app.quest')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GenerationStageRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stage', models.CharField(max_length=32, verbose_name='Этап')),
+                ('status', models.CharField(max_length=16, verbose_name='Итог этапа')),
+                ('wall_ms', models.PositiveIntegerField(default=0, verbose_name='Время, мс')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Запусков этапа')),
+                ('llm_calls', models.PositiveIntegerField(default=0, verbose_name='Вызовов модели')),
+                ('prompt_tokens', models.PositiveIntegerField(default=0, verbose_name='Токенов запроса')),
+                ('completion_tokens', models.PositiveIntegerField(default=0, verbose_name='Токенов ответа')),
+                ('retries', models.PositiveIntegerField(default=0, verbose_name='Повторов после 429')),
+                ('parse_failures', models.PositiveIntegerField(default=0, verbose_name='Ошибок разбора ответа')),
+                ('payload_bytes', models.PositiveIntegerField(default=0, verbose_name='Объем результата, байт')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='quest_app.generationrun')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stage', 'wall_ms'], name='stagerun_stage_wall_idx')],
+            },
+        ),
+    ]
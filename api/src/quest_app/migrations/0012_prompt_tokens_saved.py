@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quest_app', '0011_generation_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationrun',
+            name='prompt_tokens_saved',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сэкономлено токенов запроса'),
+        ),
+        migrations.AddField(
+            model_name='generationstagerun',
+            name='prompt_tokens_saved',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сэкономлено токенов запроса'),
+        ),
+    ]
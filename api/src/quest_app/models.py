@@ -1,5 +1,10 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from .fields import UnicodeJSONField
+from .json_codec import content_hash
+from .quest_graph import (
+    build_graph, scene_distances, short_scene_id, summarize_quest, END_SCENE, MAX_SCENE_ID_LENGTH,
+)
 import json
 
 class QuestInput(models.Model):
@@ -8,19 +13,324 @@ class QuestInput(models.Model):
     hero = models.CharField(max_length=200, verbose_name="Главный герой")
     goal = models.TextField(verbose_name="Цель квеста")
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['genre'], name='questinput_genre_idx'),
+            models.Index(fields=['hero'], name='questinput_hero_idx'),
+            models.Index(fields=['created_at'], name='questinput_created_idx'),
+        ]
     
     def __str__(self):
         return f"Квест: {self.genre} - {self.hero}"
 
+class QuestQuerySet(models.QuerySet):
+    def summaries(self):
+        """Квесты для списков: входные данные одним JOIN, сводка - из полей модели"""
+        return self.select_related('quest_input')
+
+
 class Quest(models.Model):
     """Модель для хранения сгенерированного квеста"""
     quest_input = models.ForeignKey(QuestInput, on_delete=models.CASCADE, related_name='quests')
-    quest_data = UnicodeJSONField(verbose_name="Данные квеста в JSON")
+    quest_data = UnicodeJSONField(compress=True, verbose_name="Данные квеста в JSON")
     created_at = models.DateTimeField(auto_now_add=True)
+
+    # Сводка по quest_data, пересчитывается при сохранении (NULL - еще не заполнена,
+    # см. python manage.py backfill_quest_summaries)
+    scene_count = models.PositiveIntegerField(null=True, blank=True, verbose_name="Количество сцен")
+    choice_count = models.PositiveIntegerField(null=True, blank=True, verbose_name="Количество выборов")
+    max_depth = models.PositiveIntegerField(null=True, blank=True, verbose_name="Максимальная глубина")
+    ending_count = models.PositiveIntegerField(null=True, blank=True, verbose_name="Количество концовок")
+    generator_version = models.CharField(max_length=32, blank=True, default='', verbose_name="Версия генератора")
+    # SHA-256 quest_data, основа ETag ответов API
+    content_hash = models.CharField(max_length=64, blank=True, default='', verbose_name="Хэш данных квеста")
+
+    SUMMARY_FIELDS = ('scene_count', 'choice_count', 'max_depth', 'ending_count', 'content_hash')
+
+    objects = QuestQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='quest_created_idx'),
+        ]
     
     def __str__(self):
         return f"Квест {self.id} - {self.quest_input.genre}"
+
+    def refresh_summary(self):
+        """Пересчитывает поля сводки и хэш по quest_data"""
+        quest_data = self.quest_data
+        if isinstance(quest_data, str):
+            quest_data = json.loads(quest_data)
+        for name, value in summarize_quest(quest_data).items():
+            setattr(self, name, value)
+        self.content_hash = content_hash(quest_data)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        data_changed = 'quest_data' not in self.get_deferred_fields() and (
+            update_fields is None or 'quest_data' in update_fields)
+        if data_changed:
+            self.refresh_summary()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.SUMMARY_FIELDS)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if data_changed and getattr(settings, 'QUEST_SCENE_TABLES', False):
+                self.sync_scene_rows()
+        if data_changed:
+            from .quest_analytics import invalidate_quest_analytics
+            from .quest_runtime import invalidate_compiled_quest
+            from .scene_index import invalidate_scene_index
+            invalidate_scene_index(self.id)
+            invalidate_compiled_quest(self.id)
+            invalidate_quest_analytics(self.id)
+
+    def sync_scene_rows(self):
+        """Перезаписывает строки QuestScene/QuestChoice по quest_data"""
+        scene_rows, choice_rows = self.build_scene_rows()
+        with transaction.atomic():
+            QuestChoice.objects.filter(quest=self).delete()
+            QuestScene.objects.filter(quest=self).delete()
+            QuestScene.objects.bulk_create(scene_rows)
+            QuestChoice.objects.bulk_create(choice_rows)
+        return len(scene_rows), len(choice_rows)
+
+    def build_scene_rows(self):
+        """Несохраненные строки QuestScene/QuestChoice по quest_data
+
+        Сцены без scene_id и повторы scene_id пропускаются (остается первая).
+        id длиннее столбца (квесты, не прошедшие проверку) сокращаются так же,
+        как при проверке (short_scene_id), поэтому ребра по-прежнему сходятся.
+        """
+        quest_data = self.quest_data
+        if isinstance(quest_data, str):
+            quest_data = json.loads(quest_data)
+        scenes = []
+        seen = set()
+        for scene in (quest_data or {}).get('scenes') or []:
+            if isinstance(scene, dict) and scene.get('scene_id') and scene['scene_id'] not in seen:
+                seen.add(scene['scene_id'])
+                scenes.append(scene)
+        distances = scene_distances(build_graph(scenes))
+
+        scene_rows = []
+        choice_rows = []
+        for position, scene in enumerate(scenes):
+            scene_id = short_scene_id(scene['scene_id'])
+            choices = [choice for choice in scene.get('choices') or [] if isinstance(choice, dict)]
+            scene_rows.append(QuestScene(
+                quest=self,
+                scene_id=scene_id,
+                position=position,
+                text=scene.get('text') or '',
+                depth=distances.get(scene['scene_id']),
+                choice_count=len(choices),
+                is_ending=scene_id == END_SCENE,
+            ))
+            choice_rows.extend(
+                QuestChoice(
+                    quest=self,
+                    scene_id=scene_id,
+                    position=index,
+                    text=choice.get('text') or '',
+                    next_scene=short_scene_id(choice.get('next_scene') or ''),
+                )
+                for index, choice in enumerate(choices)
+            )
+        return scene_rows, choice_rows
     
     def get_scenes(self):
         """Возвращает список сцен из JSON данных"""
         return self.quest_data.get('scenes', [])
+
+
+class QuestScene(models.Model):
+    """Сцена квеста в отдельной таблице (копия quest_data['scenes'] для запросов в SQL)
+
+    Заполняется при сохранении Quest, если включена настройка QUEST_SCENE_TABLES
+    (для старых квестов - python manage.py index_quest_scenes).
+    """
+    quest = models.ForeignKey(Quest, on_delete=models.CASCADE, related_name='scene_rows')
+    scene_id = models.CharField(max_length=MAX_SCENE_ID_LENGTH, verbose_name="ID сцены")
+    position = models.PositiveIntegerField(verbose_name="Порядковый номер в квесте")
+    text = models.TextField(blank=True, default='', verbose_name="Текст сцены")
+    depth = models.PositiveIntegerField(null=True, blank=True, verbose_name="Расстояние от start")
+    choice_count = models.PositiveIntegerField(default=0, verbose_name="Количество выборов")
+    is_ending = models.BooleanField(default=False, verbose_name="Финальная сцена")
+
+    class Meta:
+        ordering = ['quest', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['quest', 'scene_id'], name='unique_quest_scene'),
+        ]
+
+    def __str__(self):
+        return f"Сцена {self.scene_id} квеста {self.quest_id}"
+
+
+class QuestChoice(models.Model):
+    """Выбор в сцене - ребро графа квеста scene_id -> next_scene"""
+    quest = models.ForeignKey(Quest, on_delete=models.CASCADE, related_name='choice_rows')
+    scene_id = models.CharField(max_length=MAX_SCENE_ID_LENGTH, verbose_name="ID сцены")
+    position = models.PositiveIntegerField(verbose_name="Порядковый номер в сцене")
+    text = models.TextField(blank=True, default='', verbose_name="Текст выбора")
+    next_scene = models.CharField(max_length=MAX_SCENE_ID_LENGTH, verbose_name="Следующая сцена")
+
+    class Meta:
+        ordering = ['quest', 'scene_id', 'position']
+        indexes = [
+            models.Index(fields=['quest', 'scene_id'], name='questchoice_edge_idx'),
+            models.Index(fields=['next_scene', 'quest'], name='questchoice_target_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scene_id} -> {self.next_scene}"
+
+
+class GenerationBatch(models.Model):
+    """Пакет задач генерации (POST /api/batches/, python manage.py generate_quests)
+
+    Состояние каждого элемента пакета - статус его задачи GenerationJob.
+    """
+    name = models.CharField(max_length=200, blank=True, default='', verbose_name="Название")
+    source_hash = models.CharField(max_length=64, blank=True, default='', db_index=True,
+                                   verbose_name="Хэш входного файла")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Пакет {self.id} {self.name}".strip()
+
+    def status_counts(self):
+        """Количество задач пакета по статусам"""
+        counts = {status: 0 for status, _ in GenerationJob.STATUS_CHOICES}
+        for row in self.jobs.order_by().values('status').annotate(count=models.Count('id')):
+            counts[row['status']] = row['count']
+        return counts
+
+
+class GenerationJob(models.Model):
+    """Задача фоновой генерации квеста (очередь в базе данных)"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    params = models.JSONField(verbose_name="Параметры генерации")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Статус")
+    stage = models.CharField(max_length=32, blank=True, default='', verbose_name="Текущий этап")
+    progress = models.JSONField(default=dict, blank=True, verbose_name="Прогресс по этапам")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Количество попыток")
+    error = models.TextField(blank=True, default='', verbose_name="Ошибка")
+    quest = models.ForeignKey(Quest, null=True, blank=True, on_delete=models.SET_NULL, related_name='jobs')
+    saved_file = models.CharField(max_length=255, blank=True, default='')
+    worker = models.CharField(max_length=100, blank=True, default='', verbose_name="Обработчик")
+    batch = models.ForeignKey(GenerationBatch, null=True, blank=True, on_delete=models.CASCADE, related_name='jobs')
+    item_key = models.CharField(max_length=64, blank=True, default='', verbose_name="Ключ элемента пакета")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['batch', 'item_key'], name='unique_batch_item'),
+        ]
+
+    def __str__(self):
+        return f"Задача {self.id} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+
+class GenerationRun(models.Model):
+    """Измерения одной генерации квеста (см. instrumentation.py)"""
+    STATUS_CHOICES = [
+        ('success', 'Успешно'),
+        ('failed', 'Ошибка'),
+        ('cached', 'Из кэша'),
+    ]
+
+    quest = models.ForeignKey(Quest, null=True, blank=True, on_delete=models.SET_NULL, related_name='runs')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, verbose_name="Итог")
+    error = models.TextField(blank=True, default='', verbose_name="Ошибка")
+    genre = models.CharField(max_length=100, blank=True, default='', verbose_name="Жанр")
+    scene_count = models.PositiveIntegerField(null=True, blank=True, verbose_name="Запрошено сцен")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток генерации")
+    wall_ms = models.PositiveIntegerField(default=0, verbose_name="Время, мс")
+    llm_calls = models.PositiveIntegerField(default=0, verbose_name="Вызовов модели")
+    prompt_tokens = models.PositiveIntegerField(default=0, verbose_name="Токенов запроса")
+    completion_tokens = models.PositiveIntegerField(default=0, verbose_name="Токенов ответа")
+    retries = models.PositiveIntegerField(default=0, verbose_name="Повторов после 429")
+    prompt_tokens_saved = models.PositiveIntegerField(default=0, verbose_name="Сэкономлено токенов запроса")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Генерация {self.id} ({self.status}, {self.wall_ms} мс)"
+
+
+class GenerationStageRun(models.Model):
+    """Измерения одного этапа генерации"""
+    run = models.ForeignKey(GenerationRun, on_delete=models.CASCADE, related_name='stages')
+    stage = models.CharField(max_length=32, verbose_name="Этап")
+    status = models.CharField(max_length=16, verbose_name="Итог этапа")
+    wall_ms = models.PositiveIntegerField(default=0, verbose_name="Время, мс")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Запусков этапа")
+    llm_calls = models.PositiveIntegerField(default=0, verbose_name="Вызовов модели")
+    prompt_tokens = models.PositiveIntegerField(default=0, verbose_name="Токенов запроса")
+    completion_tokens = models.PositiveIntegerField(default=0, verbose_name="Токенов ответа")
+    retries = models.PositiveIntegerField(default=0, verbose_name="Повторов после 429")
+    parse_failures = models.PositiveIntegerField(default=0, verbose_name="Ошибок разбора ответа")
+    payload_bytes = models.PositiveIntegerField(default=0, verbose_name="Объем результата, байт")
+    prompt_tokens_saved = models.PositiveIntegerField(default=0, verbose_name="Сэкономлено токенов запроса")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stage', 'wall_ms'], name='stagerun_stage_wall_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.stage}: {self.wall_ms} мс"
+
+
+class CachedResult(models.Model):
+    """Запись кэша результатов генерации (хранилище 'database')"""
+    namespace = models.CharField(max_length=32, verbose_name="Пространство ключей")
+    key = models.CharField(max_length=64, verbose_name="Хэш входных данных")
+    value = models.JSONField(verbose_name="Сохраненный результат")
+    created_at = models.DateTimeField()
+    accessed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['namespace', 'key'], name='unique_cached_result_key'),
+        ]
+        indexes = [
+            models.Index(fields=['namespace', 'accessed_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.namespace}:{self.key}"
+
+
+class CompressionDictionary(models.Model):
+    """Общий словарь сжатия quest_data, обученный на сохраненных квестах"""
+    algorithm = models.CharField(max_length=16, verbose_name="Алгоритм")
+    data = models.BinaryField(verbose_name="Словарь")
+    sample_count = models.PositiveIntegerField(default=0, verbose_name="Квестов в обучающей выборке")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Словарь {self.algorithm} #{self.id}"
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class QuestCursorPagination(CursorPagination):
+    """Курсорная пагинация списка квестов: от новых к старым
+
+    В отличие от OFFSET, стоимость запроса страницы не растет с ее номером,
+    а новые квесты не сдвигают уже загруженные страницы.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
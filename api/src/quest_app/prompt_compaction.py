@@ -0,0 +1,155 @@
+"""
+Сжатие данных, которые этапы генерации передают друг другу
+
+Раньше этап 2 получал json.dumps всей структурной карты, а этап 3 - весь
+detailed_plan с полями reasoning, choice_type и choice_strategy. Теперь каждый
+этап получает только нужные ему поля в построчной записи:
+  - этап 2: тема и по строке на сцену "id [тип]: суть -> куда ведут выборы";
+  - этап 3: по строке на сцену "id: ситуация" и строки выборов "- текст -> id";
+  - этап 4 (проверка моделью): квест без пробелов в JSON, тексты нужны целиком.
+
+Размер считается токенизатором (QUEST_PROMPT_COMPACTION['TOKENIZER'] - путь к
+tokenizer.json модели, нужен пакет tokenizers), без него - оценкой по длине
+текста. Если запись не укладывается в бюджет этапа, описания сцен
+укорачиваются. Сэкономленные токены учитываются в измерениях генерации
+(instrumentation.record_compaction).
+"""
+
+import json
+import threading
+
+from django.conf import settings
+
+from .instrumentation import record_compaction
+from .rate_limit import CHARS_PER_TOKEN
+
+try:
+    from tokenizers import Tokenizer
+    TOKENIZERS_AVAILABLE = True
+except ImportError:
+    Tokenizer = None
+    TOKENIZERS_AVAILABLE = False
+
+# Ограничения длины описаний сцен, по очереди, пока запись не уложится в бюджет
+TEXT_LIMITS = (None, 160, 80, 40, 0)
+
+
+def get_compaction_config():
+    """Настройки сжатия с значениями по умолчанию"""
+    config = {
+        'ENABLED': True,
+        'TOKENIZER': '',
+        'BUDGETS': {},
+    }
+    config.update(getattr(settings, 'QUEST_PROMPT_COMPACTION', {}))
+    return config
+
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def _get_tokenizer(path):
+    """Токенизатор из файла (None, если не задан или не загрузился)"""
+    if not path or not TOKENIZERS_AVAILABLE:
+        return None
+    if path not in _tokenizers:
+        with _tokenizers_lock:
+            if path not in _tokenizers:
+                try:
+                    _tokenizers[path] = Tokenizer.from_file(str(path))
+                except Exception as e:
+                    print(f"⚠️ Не удалось загрузить токенизатор {path}: {e}, используется оценка по длине")
+                    _tokenizers[path] = None
+    return _tokenizers[path]
+
+
+def count_tokens(text):
+    """Число токенов текста: токенизатором модели или оценкой по длине"""
+    tokenizer = _get_tokenizer(get_compaction_config()['TOKENIZER'])
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _clip(value, limit):
+    """Текст в одну строку, не длиннее limit символов"""
+    text = " ".join(str(value or '').split())
+    if limit is None or len(text) <= limit:
+        return text
+    return text[:limit].rstrip() + "…" if limit else ""
+
+
+def encode_structure(quest_structure, limit=None):
+    """Структурная карта для этапа 2: тема, сцены с типом, сутью и переходами"""
+    structure = quest_structure.get('quest_structure', quest_structure)
+    flow = structure.get('flow') or {}
+    lines = [
+        f"Тема: {_clip(structure.get('theme'), None)}",
+        "Сцены (id [тип]: суть -> куда ведут выборы):",
+    ]
+    described = set()
+    for scene in structure.get('scenes') or []:
+        if not isinstance(scene, dict):
+            continue
+        scene_id = scene.get('scene_id')
+        described.add(scene_id)
+        targets = ", ".join(str(target) for target in flow.get(scene_id) or [])
+        lines.append(f"{scene_id} [{scene.get('type', '')}]: {_clip(scene.get('concept'), limit)} -> {targets}")
+    for scene_id, targets in flow.items():
+        if scene_id not in described and isinstance(targets, list):
+            lines.append(f"{scene_id} []:  -> {', '.join(str(target) for target in targets)}")
+    return "\n".join(lines)
+
+
+def encode_plan(detailed_plan, limit=None):
+    """План для этапа 3: ситуация сцены и выборы (без reasoning и типов выборов)"""
+    planned_scenes = detailed_plan.get('detailed_plan', detailed_plan) if isinstance(detailed_plan, dict) \
+        else detailed_plan
+    lines = ["Сцены плана (id: ситуация; ниже выборы: - текст выбора -> id следующей сцены):"]
+    for entry in planned_scenes or []:
+        if not isinstance(entry, dict):
+            continue
+        lines.append(f"{entry.get('scene_id')}: {_clip(entry.get('situation'), limit)}")
+        for choice in entry.get('planned_choices') or []:
+            if isinstance(choice, dict):
+                lines.append(f"  - {_clip(choice.get('choice_text'), None)} -> {choice.get('next_scene')}")
+    return "\n".join(lines)
+
+
+def encode_quest(quest, limit=None):
+    """Квест для проверки моделью: JSON без пробелов (тексты сцен не сокращаются)"""
+    return json.dumps(quest, ensure_ascii=False, separators=(',', ':'))
+
+
+def compact(stage, value, encoder, limits=TEXT_LIMITS):
+    """Текст value для промпта этапа stage
+
+    При выключенном сжатии (или если value не разбирается) возвращает прежний
+    json.dumps. Иначе кодирует value encoder'ом, укорачивая описания по limits,
+    пока запись не уложится в бюджет этапа, и учитывает сэкономленные токены.
+    """
+    original = json.dumps(value, ensure_ascii=False)
+    config = get_compaction_config()
+    if not config['ENABLED']:
+        return original
+    try:
+        budget = config['BUDGETS'].get(stage)
+        for limit in limits:
+            text = encoder(value, limit)
+            tokens = count_tokens(text)
+            if not budget or tokens <= budget:
+                break
+        else:
+            print(f"⚠️ Вход этапа {stage} больше бюджета: {tokens} > {budget} ток.")
+    except (AttributeError, TypeError) as e:
+        print(f"⚠️ Вход этапа {stage} не сжат: {e}")
+        return original
+
+    original_tokens = count_tokens(original)
+    if tokens >= original_tokens:
+        return original
+    if limit is not None:
+        print(f"🗜️ Описания сцен этапа {stage} сокращены до {limit} символов (бюджет {budget} ток.)")
+    record_compaction(stage, original_tokens - tokens)
+    return text
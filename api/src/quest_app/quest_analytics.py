@@ -0,0 +1,223 @@
+"""
+Структурная аналитика квеста по графу сцен
+
+Для /api/quests/<id>/analytics/: длиннейший и кратчайший путь от start до
+quest_end, распределение числа переходов из сцен (ветвление), недостижимые
+сцены и тупики (из них нельзя дойти до quest_end), концовки и число различных
+прохождений. Все величины считаются за один проход по сценам в топологическом
+порядке: для каждой сцены запоминаются глубины и число путей до нее из start,
+поэтому время линейно по числу сцен и выборов даже на больших квестах.
+
+Прохождение - последовательность сцен от start до quest_end (выборы в одну и
+ту же сцену - одно прохождение). Если из start достижим цикл, прохождений
+бесконечно много: playthroughs - None, has_cycles - True, а глубины считаются
+без ребер, ведущих назад (как Quest.max_depth).
+
+Результат зависит только от quest_data и кэшируется в памяти процесса (LRU с
+TTL, настройка QUEST_ANALYTICS), сбрасывается при изменении quest_data.
+"""
+
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from .quest_graph import (
+    END_SCENE, START_SCENE, acyclic_graph, build_graph, find_back_edges, reachable_from, topological_order,
+)
+from .scene_index import SceneIndexCache
+
+# Значения ending_type у generate_quest
+ENDING_SINGLE = 'single'
+ENDING_TYPES = (ENDING_SINGLE, 'multiple', 'branching')
+
+
+def get_analytics_config():
+    """Настройки кэша аналитики с значениями по умолчанию"""
+    config = {
+        'MAX_ENTRIES': 1024,
+        'TTL': 3600,
+    }
+    config.update(getattr(settings, 'QUEST_ANALYTICS', {}))
+    return config
+
+
+def _can_finish(graph):
+    """Сцены, из которых можно дойти до quest_end (обход обратных ребер)"""
+    if END_SCENE not in graph:
+        return set()
+    incoming = {node: [] for node in graph}
+    for node, targets in graph.items():
+        for target in targets:
+            if target in incoming:
+                incoming[target].append(node)
+    seen = {END_SCENE}
+    stack = [END_SCENE]
+    while stack:
+        for source in incoming[stack.pop()]:
+            if source not in seen:
+                seen.add(source)
+                stack.append(source)
+    return seen
+
+
+def analyze_quest(quest_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Структурная статистика quest_data (см. описание модуля)"""
+    scenes = [scene for scene in (quest_data or {}).get('scenes') or []
+              if isinstance(scene, dict) and scene.get('scene_id')]
+    graph = build_graph(scenes)
+    reachable = reachable_from(graph, START_SCENE)
+    has_cycles = bool(find_back_edges(graph, START_SCENE))
+    dag = acyclic_graph(graph)
+
+    # Глубины и число путей из start для каждой сцены: сцена обрабатывается
+    # после всех сцен, ведущих в нее, поэтому ее значения уже окончательные
+    shortest = {}
+    longest = {}
+    paths = {}
+    if START_SCENE in dag:
+        shortest[START_SCENE] = longest[START_SCENE] = 0
+        paths[START_SCENE] = 1
+    for node in topological_order(dag):
+        if node not in paths:
+            continue
+        for target in dict.fromkeys(dag[node]):
+            if target not in dag:
+                continue
+            if target in paths:
+                shortest[target] = min(shortest[target], shortest[node] + 1)
+                longest[target] = max(longest[target], longest[node] + 1)
+                paths[target] += paths[node]
+            else:
+                shortest[target] = shortest[node] + 1
+                longest[target] = longest[node] + 1
+                paths[target] = paths[node]
+
+    finishing = _can_finish(graph)
+    branching = Counter(
+        len({target for target in graph[node] if target in graph})
+        for node in graph if node in reachable and node != END_SCENE
+    )
+    branch_total = sum(branching.values())
+
+    ending_ids = [node for node, targets in graph.items()
+                  if node != END_SCENE and targets and all(target == END_SCENE for target in targets)]
+    if not ending_ids and END_SCENE in graph:
+        ending_ids = [END_SCENE]
+    endings = []
+    for node in ending_ids:
+        offset = 0 if node == END_SCENE else 1
+        endings.append({
+            "scene_id": node,
+            "reachable": node in paths,
+            "min_depth": shortest[node] + offset if node in paths else None,
+            "max_depth": longest[node] + offset if node in paths else None,
+            "playthroughs": paths[node] if node in paths and not has_cycles else None,
+        })
+
+    finished = END_SCENE in paths
+    return {
+        "scene_count": len(graph),
+        "reachable_scene_count": len(reachable),
+        "min_depth": shortest[END_SCENE] if finished else None,
+        "max_depth": longest[END_SCENE] if finished else None,
+        "playthroughs": (paths[END_SCENE] if finished else 0) if not has_cycles else None,
+        "has_cycles": has_cycles,
+        "branching": {
+            "distribution": {str(count): branching[count] for count in sorted(branching)},
+            "average": round(sum(count * scenes for count, scenes in branching.items()) / branch_total, 2)
+            if branch_total else 0,
+            "max": max(branching, default=0),
+        },
+        "ending_count": sum(1 for ending in endings if ending["reachable"]),
+        "endings": endings,
+        "unreachable_scenes": [node for node in graph if node not in reachable],
+        "dead_end_scenes": [node for node in graph if node in reachable and node not in finishing],
+    }
+
+
+def check_constraints(analytics: Dict[str, Any], max_depth: Optional[int] = None,
+                      ending_type: Optional[str] = None) -> Dict[str, Any]:
+    """Соответствие квеста параметрам генерации
+
+    max_depth - длиннейший путь до quest_end не больше заданного (как в
+    validate_quest_graph); ending_type single - одна концовка, multiple и
+    branching - не меньше двух; structure - quest_end достижим, нет циклов,
+    недостижимых сцен и тупиков. ValueError, если ending_type неизвестен.
+    """
+    if ending_type and ending_type not in ENDING_TYPES:
+        raise ValueError(f"ending_type должен быть одним из: {', '.join(ENDING_TYPES)}")
+    checks = {}
+    if max_depth is not None:
+        actual = analytics["max_depth"]
+        checks["max_depth"] = {
+            "expected": max_depth,
+            "actual": actual,
+            "passed": actual is not None and actual <= max_depth,
+        }
+    if ending_type:
+        count = analytics["ending_count"]
+        checks["ending_type"] = {
+            "expected": ending_type,
+            "actual": count,
+            "passed": count == 1 if ending_type == ENDING_SINGLE else count >= 2,
+        }
+    checks["structure"] = {
+        "passed": (analytics["max_depth"] is not None and not analytics["has_cycles"]
+                   and not analytics["unreachable_scenes"] and not analytics["dead_end_scenes"]),
+    }
+    return {"passed": all(check["passed"] for check in checks.values()), "checks": checks}
+
+
+def generation_params(quest_id):
+    """max_depth и ending_type последней задачи генерации квеста (пустой словарь, если задачи нет)"""
+    from .models import GenerationJob
+
+    params = (GenerationJob.objects.filter(quest_id=quest_id).order_by('-id')
+              .values_list('params', flat=True).first()) or {}
+    return {key: params[key] for key in ('max_depth', 'ending_type') if params.get(key) is not None}
+
+
+def build_quest_analytics(quest_id):
+    """Аналитика сохраненного квеста; Quest.DoesNotExist, если квеста нет"""
+    from .models import Quest
+
+    quest = Quest.objects.only('id', 'quest_data').get(id=quest_id)
+    return analyze_quest(quest.quest_data)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = get_analytics_config()
+                _cache = SceneIndexCache(max_entries=config['MAX_ENTRIES'], ttl=config['TTL'])
+    return _cache
+
+
+def get_quest_analytics(quest_id):
+    """Аналитика квеста из кэша (считается при первом обращении)"""
+    cache = _get_cache()
+    analytics = cache.get(quest_id)
+    if analytics is None:
+        analytics = build_quest_analytics(quest_id)
+        cache.set(quest_id, analytics)
+    return analytics
+
+
+def invalidate_quest_analytics(quest_id):
+    """Удаляет аналитику квеста из кэша (после изменения quest_data)"""
+    _get_cache().delete(quest_id)
+
+
+def reset_analytics_cache():
+    """Сбрасывает кэш целиком (после изменения настроек)"""
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,340 @@
+"""
+Двоичный архив квестов для переноса между окружениями
+
+python manage.py export_quests / import_quests. Формат (целые - little-endian):
+
+  заголовок   b'QARC', версия (u16), сжатие записей (u16: 0 - нет, 1 - zlib)
+  записи      длина (u32) + данные записи, по одной на квест, подряд
+  строки      таблица строк: количество (varint), затем длина (varint) + UTF-8
+  индекс      пары (id квеста, смещение записи) по u64, по возрастанию id
+  окончание   смещение строк, смещение индекса, количество квестов (u64) и b'QEND'
+
+Запись - id, время создания, жанр, герой, цель, версия генератора и
+quest_data в компактной двоичной форме (тег типа + значение, целые - varint).
+Ключи словарей, scene_id, next_scene и жанр хранятся номером в таблице строк:
+они повторяются в каждом квесте. Таблица и индекс пишутся в конце, поэтому
+архив пишется потоком, не держа квесты в памяти. Чтение идет через mmap:
+перебор записей подряд или поиск записи по id двоичным поиском по индексу.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+MAGIC = b'QARC'
+END_MAGIC = b'QEND'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+TRAILER = struct.Struct('<QQQ4s')
+LENGTH = struct.Struct('<I')
+INDEX_ENTRY = struct.Struct('<QQ')
+FLOAT = struct.Struct('<d')
+
+COMPRESSIONS = {'none': 0, 'zlib': 1}
+
+# Значения этих ключей повторяются между сценами и квестами
+INTERNED_FIELDS = frozenset({'scene_id', 'next_scene', 'type'})
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_REF, T_LIST, T_DICT = range(9)
+
+
+class ArchiveError(ValueError):
+    """Файл не является архивом квестов или поврежден"""
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+def _timestamp(value):
+    """Время в микросекундах UTC (0 - не задано)"""
+    if value is None:
+        return 0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+class QuestArchiveWriter:
+    """Потоковая запись архива: with QuestArchiveWriter(path) as archive: archive.write(...)
+
+    Файл пишется во временный файл рядом и переименовывается при закрытии.
+    """
+
+    def __init__(self, path, compression='zlib', level=6):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Неизвестное сжатие архива: {compression}")
+        self.path = str(path)
+        self.compression = compression
+        self.level = level
+        self.count = 0
+        self._strings = []
+        self._string_ids = {}
+        self._index = []
+        self._file = None
+        self._temp_path = None
+
+    def __enter__(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, self._temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, COMPRESSIONS[self.compression]))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._finish()
+            self._file.close()
+            os.replace(self._temp_path, self.path)
+        else:
+            self._file.close()
+            os.remove(self._temp_path)
+        return False
+
+    def _intern(self, value):
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return string_id
+
+    def _encode(self, out, value, intern=False):
+        if value is None:
+            out.append(T_NONE)
+        elif value is True:
+            out.append(T_TRUE)
+        elif value is False:
+            out.append(T_FALSE)
+        elif isinstance(value, int):
+            out.append(T_INT)
+            _write_varint(out, _zigzag(value))
+        elif isinstance(value, float):
+            out.append(T_FLOAT)
+            out += FLOAT.pack(value)
+        elif isinstance(value, str):
+            if intern:
+                out.append(T_REF)
+                _write_varint(out, self._intern(value))
+            else:
+                encoded = value.encode('utf-8')
+                out.append(T_STR)
+                _write_varint(out, len(encoded))
+                out += encoded
+        elif isinstance(value, (list, tuple)):
+            out.append(T_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self._encode(out, item)
+        elif isinstance(value, dict):
+            out.append(T_DICT)
+            _write_varint(out, len(value))
+            for key, item in value.items():
+                key = str(key)
+                _write_varint(out, self._intern(key))
+                self._encode(out, item, intern=key in INTERNED_FIELDS)
+        else:
+            raise TypeError(f"Тип {type(value).__name__} не поддерживается архивом")
+
+    def write(self, quest_id, quest_data, genre='', hero='', goal='', generator_version='', created_at=None):
+        """Добавляет квест в архив"""
+        out = bytearray()
+        _write_varint(out, quest_id)
+        _write_varint(out, _timestamp(created_at))
+        self._encode(out, genre, intern=True)
+        self._encode(out, hero)
+        self._encode(out, goal)
+        self._encode(out, generator_version, intern=True)
+        self._encode(out, quest_data)
+        payload = zlib.compress(out, self.level) if self.compression == 'zlib' else bytes(out)
+
+        self._index.append((quest_id, self._file.tell()))
+        self._file.write(LENGTH.pack(len(payload)))
+        self._file.write(payload)
+        self.count += 1
+
+    def _finish(self):
+        strings_offset = self._file.tell()
+        out = bytearray()
+        _write_varint(out, len(self._strings))
+        for value in self._strings:
+            encoded = value.encode('utf-8')
+            _write_varint(out, len(encoded))
+            out += encoded
+        self._file.write(out)
+
+        index_offset = self._file.tell()
+        self._index.sort()
+        self._file.write(b"".join(INDEX_ENTRY.pack(quest_id, offset) for quest_id, offset in self._index))
+        self._file.write(TRAILER.pack(strings_offset, index_offset, len(self._index), END_MAGIC))
+
+
+class QuestArchiveReader:
+    """Чтение архива через mmap: перебор (for record in reader) и get(quest_id)
+
+    Записи - словари с ключами id, created_at, genre, hero, goal,
+    generator_version и quest_data.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._file = open(self.path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ArchiveError(f"Пустой файл: {self.path}")
+        try:
+            self._read_layout()
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            self.close()
+            raise ArchiveError(f"Поврежденный архив {self.path}: {e}")
+        except ArchiveError:
+            self.close()
+            raise
+
+    def _read_layout(self):
+        data = self._data
+        magic, version, compression = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ArchiveError(f"Файл {self.path} не является архивом квестов")
+        if version != VERSION:
+            raise ArchiveError(f"Неподдерживаемая версия архива: {version}")
+        self.compressed = compression == COMPRESSIONS['zlib']
+        self._strings_offset, self._index_offset, self.count, end = TRAILER.unpack_from(
+            data, len(data) - TRAILER.size)
+        if end != END_MAGIC:
+            raise ArchiveError(f"Архив {self.path} не дописан до конца")
+
+        count, pos = _read_varint(data, self._strings_offset)
+        strings = []
+        for _ in range(count):
+            length, pos = _read_varint(data, pos)
+            strings.append(data[pos:pos + length].decode('utf-8'))
+            pos += length
+        self.strings = strings
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def _read_record(self, offset):
+        """Запись по смещению и смещение следующей"""
+        try:
+            (length,) = LENGTH.unpack_from(self._data, offset)
+            payload = self._data[offset + LENGTH.size:offset + LENGTH.size + length]
+            if self.compressed:
+                payload = zlib.decompress(payload)
+            record = _RecordDecoder(payload, self.strings).record()
+        except (struct.error, IndexError, zlib.error, UnicodeDecodeError) as e:
+            raise ArchiveError(f"Поврежденная запись по смещению {offset}: {e}")
+        return record, offset + LENGTH.size + length
+
+    def __iter__(self):
+        offset = HEADER.size
+        while offset < self._strings_offset:
+            record, offset = self._read_record(offset)
+            yield record
+
+    def get(self, quest_id):
+        """Запись квеста по id (двоичный поиск по индексу) или None"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            current, offset = INDEX_ENTRY.unpack_from(self._data, self._index_offset + middle * INDEX_ENTRY.size)
+            if current < quest_id:
+                low = middle + 1
+            elif current > quest_id:
+                high = middle
+            else:
+                return self._read_record(offset)[0]
+        return None
+
+
+class _RecordDecoder:
+    def __init__(self, data, strings):
+        self.data = data
+        self.strings = strings
+        self.pos = 0
+
+    def varint(self):
+        value, self.pos = _read_varint(self.data, self.pos)
+        return value
+
+    def value(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == T_REF:
+            return self.strings[self.varint()]
+        if tag == T_STR:
+            length = self.varint()
+            start = self.pos
+            self.pos += length
+            return self.data[start:self.pos].decode('utf-8')
+        if tag == T_DICT:
+            return {self.strings[self.varint()]: self.value() for _ in range(self.varint())}
+        if tag == T_LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == T_INT:
+            return _unzigzag(self.varint())
+        if tag == T_FLOAT:
+            (value,) = FLOAT.unpack_from(self.data, self.pos)
+            self.pos += FLOAT.size
+            return value
+        if tag == T_NONE:
+            return None
+        if tag == T_TRUE:
+            return True
+        if tag == T_FALSE:
+            return False
+        raise ArchiveError(f"Неизвестный тег значения: {tag}")
+
+    def record(self):
+        quest_id = self.varint()
+        created = self.varint()
+        return {
+            'id': quest_id,
+            'created_at': EPOCH + timedelta(microseconds=created) if created else None,
+            'genre': self.value(),
+            'hero': self.value(),
+            'goal': self.value(),
+            'generator_version': self.value(),
+            'quest_data': self.value(),
+        }
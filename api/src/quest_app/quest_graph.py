@@ -0,0 +1,397 @@
+"""
+Локальная проверка и исправление графа сцен квеста
+
+Правила, которые раньше проверял этап 4 через LLM, чисто структурные, поэтому
+они проверяются здесь за миллисекунды:
+- каждая сцена, кроме quest_end, имеет минимум 2 выбора;
+- все next_scene указывают на существующие сцены;
+- quest_end имеет единственный выбор ("Завершить квест") -> quest_end;
+- нет циклов (выборы не ведут назад);
+- все сцены достижимы из start, из каждой сцены можно дойти до quest_end.
+
+Структурные ошибки исправляются детерминированно. Проблемы с текстом (пустые или
+слишком короткие описания) и превышение max_depth исправить локально нельзя -
+они возвращаются в text_issues, и генератор передает такой квест на доработку
+модели.
+"""
+
+import copy
+import hashlib
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+START_SCENE = "start"
+END_SCENE = "quest_end"
+END_CHOICE_TEXT = "Завершить квест"
+MIN_CHOICES = 2
+MIN_SCENE_TEXT = 10
+# Длина столбцов scene_id/next_scene в QuestScene/QuestChoice
+MAX_SCENE_ID_LENGTH = 100
+
+# Тексты выборов, которые добавляются при исправлении структуры
+CONTINUE_CHOICE_TEXT = "Двигаться дальше"
+FINISH_CHOICE_TEXT = "Завершить путь"
+PLACEHOLDER_END_TEXT = "Путешествие подошло к концу."
+
+
+def short_scene_id(scene_id: str) -> str:
+    """scene_id не длиннее MAX_SCENE_ID_LENGTH
+
+    Длинный id заменяется началом и хэшем всего id: разные id, совпадающие в
+    первых символах, остаются разными.
+    """
+    scene_id = str(scene_id)
+    if len(scene_id) <= MAX_SCENE_ID_LENGTH:
+        return scene_id
+    digest = hashlib.sha256(scene_id.encode('utf-8')).hexdigest()[:16]
+    return f"{scene_id[:MAX_SCENE_ID_LENGTH - len(digest) - 1]}~{digest}"
+
+
+def build_graph(scenes: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Список смежности: scene_id -> next_scene всех выборов (без quest_end -> quest_end)"""
+    graph = {}
+    for scene in scenes:
+        scene_id = scene.get('scene_id')
+        targets = [choice.get('next_scene') for choice in scene.get('choices') or []]
+        graph[scene_id] = [target for target in targets if not (scene_id == END_SCENE and target == END_SCENE)]
+    return graph
+
+
+def reachable_from(graph: Dict[str, List[str]], source: str) -> set:
+    """Множество сцен, достижимых из source"""
+    if source not in graph:
+        return set()
+    seen = {source}
+    stack = [source]
+    while stack:
+        for target in graph.get(stack.pop(), []):
+            if target in graph and target not in seen:
+                seen.add(target)
+                stack.append(target)
+    return seen
+
+
+def find_back_edges(graph: Dict[str, List[str]], source: str) -> List[tuple]:
+    """Ребра (сцена, индекс выбора), ведущие назад при обходе в глубину из source"""
+    back_edges = []
+    if source not in graph:
+        return back_edges
+    on_stack = {source}
+    visited = {source}
+    stack = [(source, 0)]
+    while stack:
+        node, index = stack[-1]
+        targets = graph.get(node, [])
+        if index >= len(targets):
+            stack.pop()
+            on_stack.discard(node)
+            continue
+        stack[-1] = (node, index + 1)
+        target = targets[index]
+        if target in on_stack:
+            back_edges.append((node, index))
+        elif target in graph and target not in visited:
+            visited.add(target)
+            on_stack.add(target)
+            stack.append((target, 0))
+    return back_edges
+
+
+def topological_order(graph: Dict[str, List[str]]) -> List[str]:
+    """Порядок сцен ациклического графа (порядок списка сцен сохраняется, где возможно)"""
+    indegree = {node: 0 for node in graph}
+    for targets in graph.values():
+        for target in set(targets):
+            if target in indegree:
+                indegree[target] += 1
+    ready = deque(node for node in graph if indegree[node] == 0)
+    order = []
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for target in dict.fromkeys(graph[node]):
+            if target in indegree:
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    ready.append(target)
+    return order
+
+
+def path_depths(graph: Dict[str, List[str]], source: str = START_SCENE,
+                target: str = END_SCENE) -> Optional[Dict[str, int]]:
+    """Кратчайший и длиннейший путь (в переходах) от source до target в ациклическом графе"""
+    order = topological_order(graph)
+    if len(order) != len(graph) or source not in graph or target not in graph:
+        return None
+    shortest = {source: 0}
+    longest = {source: 0}
+    for node in order:
+        if node not in longest:
+            continue
+        for next_node in graph[node]:
+            if next_node not in graph:
+                continue
+            shortest[next_node] = min(shortest.get(next_node, shortest[node] + 1), shortest[node] + 1)
+            longest[next_node] = max(longest.get(next_node, longest[node] + 1), longest[node] + 1)
+    if target not in longest:
+        return None
+    return {"min_depth": shortest[target], "max_depth": longest[target]}
+
+
+def scene_distances(graph: Dict[str, List[str]], source: str = START_SCENE) -> Dict[str, int]:
+    """Кратчайшее расстояние (в переходах) от source до каждой достижимой сцены"""
+    if source not in graph:
+        return {}
+    distances = {source: 0}
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        for next_node in graph.get(node, []):
+            if next_node in graph and next_node not in distances:
+                distances[next_node] = distances[node] + 1
+                queue.append(next_node)
+    return distances
+
+
+def acyclic_graph(graph: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Копия графа без ребер, ведущих назад (обход из start, затем из остальных сцен)"""
+    acyclic = {node: list(targets) for node, targets in graph.items()}
+    handled = set()
+    for source in [START_SCENE] + list(graph):
+        if source in handled or source not in acyclic:
+            continue
+        handled |= reachable_from(acyclic, source)
+        for node, index in sorted(find_back_edges(acyclic, source), reverse=True):
+            del acyclic[node][index]
+    return acyclic
+
+
+def summarize_quest(quest: Dict[str, Any]) -> Dict[str, int]:
+    """Сводка по квесту для денормализованных полей Quest
+
+    ending_count - число сцен, все выборы которых ведут в quest_end (если
+    таких нет, единственная концовка - сама quest_end); max_depth - длиннейший
+    путь от start до quest_end без учета ребер, ведущих назад.
+    """
+    scenes = [scene for scene in (quest or {}).get('scenes') or []
+              if isinstance(scene, dict) and scene.get('scene_id')]
+    graph = build_graph(scenes)
+    depths = path_depths(acyclic_graph(graph))
+    endings = [scene_id for scene_id, targets in graph.items()
+               if scene_id != END_SCENE and targets and all(target == END_SCENE for target in targets)]
+    return {
+        "scene_count": len(scenes),
+        "choice_count": sum(len(scene.get('choices') or []) for scene in scenes),
+        "max_depth": depths['max_depth'] if depths else 0,
+        "ending_count": len(endings) or int(END_SCENE in graph),
+    }
+
+
+class _Repair:
+    """Состояние одного прохода проверки: рабочая копия сцен и журналы"""
+
+    def __init__(self, scenes):
+        self.scenes = scenes
+        self.issues = []
+        self.corrections = []
+        self.text_issues = []
+
+    @property
+    def by_id(self):
+        return {scene['scene_id']: scene for scene in self.scenes}
+
+    def fix(self, issue, correction):
+        self.issues.append(issue)
+        self.corrections.append(correction)
+
+
+def _normalize_scenes(repair, raw_scenes):
+    seen = set()
+    for scene in raw_scenes:
+        if not isinstance(scene, dict) or not isinstance(scene.get('scene_id'), str) or not scene['scene_id']:
+            repair.fix("Сцена без scene_id", "Сцена без scene_id удалена")
+            continue
+        scene_id = short_scene_id(scene['scene_id'])
+        if scene_id in seen:
+            repair.fix(f"Повторяющийся scene_id '{scene_id}'", f"Удален дубликат сцены '{scene_id}'")
+            continue
+        if scene_id != scene['scene_id']:
+            repair.fix(f"scene_id длиннее {MAX_SCENE_ID_LENGTH} символов", f"scene_id сокращен до '{scene_id}'")
+            scene['scene_id'] = scene_id
+        seen.add(scene_id)
+        choices = [choice for choice in scene.get('choices') or [] if isinstance(choice, dict)]
+        for choice in choices:
+            target = choice.get('next_scene')
+            if not isinstance(target, str) or not target:
+                # Список, число, null от модели - такой же висячий выбор, как ссылка на несуществующую сцену
+                choice['next_scene'] = END_SCENE
+                repair.fix(f"'{scene_id}': некорректный next_scene {target!r}",
+                           f"Выбор '{scene_id}' -> {target!r} перенаправлен в '{END_SCENE}'")
+            elif len(target) > MAX_SCENE_ID_LENGTH:
+                choice['next_scene'] = short_scene_id(target)
+        scene['choices'] = choices
+        repair.scenes.append(scene)
+
+
+def _ensure_entry_and_end(repair):
+    ids = [scene['scene_id'] for scene in repair.scenes]
+    if START_SCENE not in ids:
+        old_id = next((scene_id for scene_id in ids if scene_id != END_SCENE), None)
+        if old_id is not None:
+            for scene in repair.scenes:
+                if scene['scene_id'] == old_id:
+                    scene['scene_id'] = START_SCENE
+                for choice in scene['choices']:
+                    if choice.get('next_scene') == old_id:
+                        choice['next_scene'] = START_SCENE
+            repair.fix("Нет стартовой сцены 'start'", f"Сцена '{old_id}' переименована в '{START_SCENE}'")
+
+    if END_SCENE not in ids:
+        repair.scenes.append({"scene_id": END_SCENE, "text": PLACEHOLDER_END_TEXT, "choices": []})
+        repair.fix(f"Нет финальной сцены '{END_SCENE}'", f"Добавлена сцена '{END_SCENE}'")
+        repair.text_issues.append(f"Сцене '{END_SCENE}' нужен финальный текст")
+
+    # В quest_end остается один выбор, ведущий в саму себя (формулировка модели сохраняется)
+    end_scene = repair.by_id[END_SCENE]
+    finishing = [choice for choice in end_scene['choices']
+                 if choice.get('next_scene') == END_SCENE and str(choice.get('text') or '').strip()]
+    if len(end_scene['choices']) != 1 or len(finishing) != 1:
+        end_scene['choices'] = finishing[:1] or [{"text": END_CHOICE_TEXT, "next_scene": END_SCENE}]
+        repair.fix(f"У '{END_SCENE}' должен быть единственный выбор '{END_CHOICE_TEXT}'",
+                   f"Выборы '{END_SCENE}' заменены на '{end_scene['choices'][0]['text']}'")
+
+
+def _retarget_dangling(repair):
+    ids = set(repair.by_id)
+    for scene in repair.scenes:
+        if scene['scene_id'] == END_SCENE:
+            continue
+        for choice in scene['choices']:
+            target = choice.get('next_scene')
+            if target not in ids:
+                choice['next_scene'] = END_SCENE
+                repair.fix(f"'{scene['scene_id']}' ведет в несуществующую сцену '{target}'",
+                           f"Выбор '{scene['scene_id']}' -> '{target}' перенаправлен в '{END_SCENE}'")
+
+
+def _break_cycles(repair):
+    by_id = repair.by_id
+    graph = build_graph(repair.scenes)
+    # Сначала обходим из start, затем из недостижимых сцен - в них тоже не должно быть циклов
+    sources = [START_SCENE] + [scene['scene_id'] for scene in repair.scenes]
+    handled = set()
+    for source in sources:
+        if source in handled or source not in graph:
+            continue
+        handled |= reachable_from(graph, source)
+        for scene_id, index in find_back_edges(graph, source):
+            target = graph[scene_id][index]
+            by_id[scene_id]['choices'][index]['next_scene'] = END_SCENE
+            graph[scene_id][index] = END_SCENE
+            repair.fix(f"Цикл: '{scene_id}' ведет назад в '{target}'",
+                       f"Выбор '{scene_id}' -> '{target}' перенаправлен в '{END_SCENE}'")
+
+
+def _drop_unreachable(repair):
+    reachable = reachable_from(build_graph(repair.scenes), START_SCENE) | {END_SCENE}
+    kept = []
+    for scene in repair.scenes:
+        if scene['scene_id'] in reachable:
+            kept.append(scene)
+        else:
+            repair.fix(f"Сцена '{scene['scene_id']}' недостижима из '{START_SCENE}'",
+                       f"Удалена недостижимая сцена '{scene['scene_id']}'")
+    repair.scenes = kept
+
+
+def _add_missing_choices(repair):
+    graph = build_graph(repair.scenes)
+    order = topological_order(graph)
+    position = {scene_id: index for index, scene_id in enumerate(order)}
+    for scene in repair.scenes:
+        scene_id = scene['scene_id']
+        if scene_id == END_SCENE or len(scene['choices']) >= MIN_CHOICES:
+            continue
+        if not scene['choices']:
+            repair.issues.append(f"Тупик: из '{scene_id}' нет выборов")
+        else:
+            repair.issues.append(f"У '{scene_id}' меньше {MIN_CHOICES} выборов")
+
+        # Новые выборы ведут только вперед по топологическому порядку - циклов не появится
+        used = {choice.get('next_scene') for choice in scene['choices']}
+        candidates = [other for other in order[position[scene_id] + 1:]
+                      if other != END_SCENE and other not in used]
+        candidates.append(END_SCENE)
+        while len(scene['choices']) < MIN_CHOICES:
+            target = candidates.pop(0) if candidates else END_SCENE
+            text = FINISH_CHOICE_TEXT if target == END_SCENE else CONTINUE_CHOICE_TEXT
+            scene['choices'].append({"text": text, "next_scene": target})
+            used.add(target)
+            repair.corrections.append(f"В '{scene_id}' добавлен выбор -> '{target}'")
+
+
+def _check_texts(repair):
+    for scene in repair.scenes:
+        scene_id = scene['scene_id']
+        if len(str(scene.get('text') or '').strip()) < MIN_SCENE_TEXT:
+            repair.text_issues.append(f"Слишком короткий текст сцены '{scene_id}'")
+        for choice in scene['choices']:
+            if not str(choice.get('text') or '').strip():
+                repair.text_issues.append(f"Пустой текст выбора в '{scene_id}' -> '{choice.get('next_scene')}'")
+
+
+def _failed(repair, quest, issue):
+    """Результат проверки, когда квест нельзя исправить локально"""
+    return {
+        "validation_result": "failed",
+        "issues_found": repair.issues + [issue],
+        "corrections_made": repair.corrections,
+        "text_issues": [],
+        "final_quest": quest,
+        "stats": {"scenes": len(repair.scenes)},
+    }
+
+
+def validate_quest_graph(quest: Dict[str, Any], max_depth: Optional[int] = None) -> Dict[str, Any]:
+    """Проверяет и исправляет структуру квеста
+
+    Возвращает словарь в формате ответа этапа 4 (validation_result, issues_found,
+    corrections_made, final_quest) и дополнительно text_issues (нужна доработка
+    текста моделью) и stats (число сцен, глубина путей до quest_end).
+    """
+    quest = copy.deepcopy(quest) if isinstance(quest, dict) else {}
+    repair = _Repair([])
+    _normalize_scenes(repair, quest.get('scenes') or [])
+
+    if not repair.scenes:
+        return _failed(repair, quest, "Квест не содержит сцен")
+
+    _ensure_entry_and_end(repair)
+    _retarget_dangling(repair)
+    _break_cycles(repair)
+    _drop_unreachable(repair)
+    _add_missing_choices(repair)
+    _check_texts(repair)
+    if START_SCENE not in repair.by_id:
+        # Кроме quest_end сцен нет - переименовать в start нечего
+        return _failed(repair, quest, f"Нет стартовой сцены '{START_SCENE}'")
+
+    stats = {"scenes": len(repair.scenes)}
+    depths = path_depths(build_graph(repair.scenes))
+    if depths:
+        stats.update(depths)
+        if max_depth and depths['max_depth'] > int(max_depth):
+            # Глубину локально не сокращаем: это изменило бы сюжет, а не только
+            # структуру, поэтому в гибридном режиме это задача для модели
+            repair.text_issues.append(f"Глубина {depths['max_depth']} превышает max_depth {max_depth}: "
+                                      f"сократи самый длинный путь от '{START_SCENE}' до '{END_SCENE}'")
+
+    quest['scenes'] = repair.scenes
+    return {
+        "validation_result": "fixed" if repair.corrections else "passed",
+        "issues_found": repair.issues,
+        "corrections_made": repair.corrections,
+        "text_issues": repair.text_issues,
+        "final_quest": quest,
+        "stats": stats,
+    }
@@ -0,0 +1,251 @@
+"""
+Прохождение квеста на сервере
+
+quest_data компилируется в граф с целочисленными номерами сцен: тексты сцен
+и выборов лежат в кортежах, а переходы - в двух массивах (выборы сцены i -
+элементы offsets[i]:offsets[i + 1] массива targets). Ход - проверка номера
+выбора и чтение массива, без поиска по списку сцен. Скомпилированные квесты
+кэшируются в памяти процесса (LRU с TTL, настройка QUEST_RUNTIME) и
+сбрасываются при изменении quest_data.
+
+Состояние прохождения на сервере не хранится: оно целиком в подписанном
+токене сессии (id квеста, версия quest_data, номер сцены, число ходов -
+18 байт до подписи), который клиент передает с каждым запросом и получает
+новым после хода. Поэтому число одновременных игроков не влияет на память,
+а сессия работает в любом процессе. Если quest_data изменился, старые сессии
+этого квеста перестают приниматься.
+"""
+
+import base64
+import struct
+import threading
+from array import array
+
+from django.conf import settings
+from django.core import signing
+
+from .json_codec import content_hash
+from .quest_graph import END_SCENE, START_SCENE
+from .scene_index import SceneIndexCache
+
+SESSION_SALT = 'quest_app.quest_runtime.session'
+SESSION_STATE = struct.Struct('<QIIH')
+MAX_STEPS = 0xffff
+
+
+class SessionError(ValueError):
+    """Ошибка сессии прохождения"""
+
+
+class InvalidSession(SessionError):
+    """Токен поврежден, подделан или просрочен"""
+
+
+class StaleSession(SessionError):
+    """quest_data изменился после начала сессии"""
+
+
+class InvalidChoice(SessionError):
+    """Нет выбора с таким номером в текущей сцене"""
+
+
+def get_runtime_config():
+    """Настройки прохождения с значениями по умолчанию"""
+    config = {
+        'MAX_ENTRIES': 1024,
+        'TTL': 3600,
+        'SESSION_MAX_AGE': 7 * 24 * 3600,
+    }
+    config.update(getattr(settings, 'QUEST_RUNTIME', {}))
+    return config
+
+
+class CompiledQuest:
+    """Граф квеста с целочисленными номерами сцен (только для чтения)"""
+
+    __slots__ = ('quest_id', 'version', 'scene_ids', 'texts', 'offsets', 'targets', 'choice_texts', 'start')
+
+    def __init__(self, quest_id, version, scene_ids, texts, offsets, targets, choice_texts, start):
+        self.quest_id = quest_id
+        self.version = version
+        self.scene_ids = scene_ids
+        self.texts = texts
+        self.offsets = offsets
+        self.targets = targets
+        self.choice_texts = choice_texts
+        self.start = start
+
+    def __len__(self):
+        return len(self.scene_ids)
+
+    def choices(self, scene):
+        """Тексты выборов сцены"""
+        return self.choice_texts[self.offsets[scene]:self.offsets[scene + 1]]
+
+    def is_finished(self, scene):
+        return self.offsets[scene] == self.offsets[scene + 1]
+
+    def move(self, scene, choice):
+        """Номер сцены после выбора choice; InvalidChoice, если такого выбора нет"""
+        first, last = self.offsets[scene], self.offsets[scene + 1]
+        if first == last:
+            raise InvalidChoice("Прохождение завершено")
+        if not 0 <= choice < last - first:
+            raise InvalidChoice(f"В сцене {self.scene_ids[scene]} нет выбора {choice}")
+        return self.targets[first + choice]
+
+    def describe(self, scene):
+        """Сцена в виде для ответа API"""
+        return {
+            "scene_id": self.scene_ids[scene],
+            "text": self.texts[scene],
+            "choices": [{"index": index, "text": text} for index, text in enumerate(self.choices(scene))],
+            "finished": self.is_finished(scene),
+        }
+
+
+def compile_quest(quest_id, quest_data, version=0):
+    """Компилирует quest_data; ValueError, если в квесте нет сцен
+
+    Сцены без scene_id и повторы scene_id пропускаются (остается первая),
+    выборы в несуществующие сцены и выбор quest_end -> quest_end отбрасываются:
+    сцена без выборов - конец прохождения.
+    """
+    scenes = []
+    positions = {}
+    for scene in (quest_data or {}).get('scenes') or []:
+        if isinstance(scene, dict) and scene.get('scene_id') and scene['scene_id'] not in positions:
+            positions[scene['scene_id']] = len(scenes)
+            scenes.append(scene)
+    if not scenes:
+        raise ValueError("В квесте нет сцен")
+
+    offsets = array('I', [0])
+    targets = array('I')
+    choice_texts = []
+    for scene in scenes:
+        for choice in scene.get('choices') or []:
+            if not isinstance(choice, dict):
+                continue
+            target = positions.get(choice.get('next_scene'))
+            if target is None or (scene['scene_id'] == END_SCENE and choice.get('next_scene') == END_SCENE):
+                continue
+            targets.append(target)
+            choice_texts.append(str(choice.get('text') or ''))
+        offsets.append(len(targets))
+
+    return CompiledQuest(
+        quest_id=quest_id,
+        version=version,
+        scene_ids=tuple(str(scene['scene_id']) for scene in scenes),
+        texts=tuple(str(scene.get('text') or '') for scene in scenes),
+        offsets=offsets,
+        targets=targets,
+        choice_texts=tuple(choice_texts),
+        start=positions.get(START_SCENE, 0),
+    )
+
+
+def _version(quest_hash):
+    """32-битная версия quest_data по его SHA-256"""
+    return int(quest_hash[:8], 16)
+
+
+def build_compiled_quest(quest_id):
+    """Компилирует сохраненный квест; Quest.DoesNotExist, если квеста нет"""
+    from .models import Quest
+
+    quest = Quest.objects.only('id', 'quest_data', 'content_hash').get(id=quest_id)
+    quest_hash = quest.content_hash or content_hash(quest.quest_data)
+    return compile_quest(quest_id, quest.quest_data, _version(quest_hash))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = get_runtime_config()
+                _cache = SceneIndexCache(max_entries=config['MAX_ENTRIES'], ttl=config['TTL'])
+    return _cache
+
+
+def get_compiled_quest(quest_id):
+    """Скомпилированный квест из кэша (компилируется при первом обращении)"""
+    cache = _get_cache()
+    compiled = cache.get(quest_id)
+    if compiled is None:
+        compiled = build_compiled_quest(quest_id)
+        cache.set(quest_id, compiled)
+    return compiled
+
+
+def invalidate_compiled_quest(quest_id):
+    """Удаляет квест из кэша (после изменения quest_data)"""
+    _get_cache().delete(quest_id)
+
+
+def reset_runtime_cache():
+    """Сбрасывает кэш целиком (после изменения настроек)"""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def encode_session(quest_id, version, scene, steps):
+    """Подписанный токен состояния прохождения"""
+    state = SESSION_STATE.pack(quest_id, version, scene, min(steps, MAX_STEPS))
+    payload = base64.urlsafe_b64encode(state).rstrip(b'=').decode('ascii')
+    return signing.TimestampSigner(salt=SESSION_SALT).sign(payload)
+
+
+def decode_session(token):
+    """(quest_id, version, scene, steps) из токена; InvalidSession, если он не принят"""
+    max_age = get_runtime_config()['SESSION_MAX_AGE']
+    try:
+        payload = signing.TimestampSigner(salt=SESSION_SALT).unsign(token, max_age=max_age)
+        state = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+        return SESSION_STATE.unpack(state)
+    except signing.SignatureExpired:
+        raise InvalidSession("Сессия просрочена, начните прохождение заново")
+    except (signing.BadSignature, ValueError, struct.error):
+        raise InvalidSession("Недействительная сессия")
+
+
+def _session_response(compiled, scene, steps):
+    return {
+        "session": encode_session(compiled.quest_id, compiled.version, scene, steps),
+        "quest_id": compiled.quest_id,
+        "steps": steps,
+        **compiled.describe(scene),
+    }
+
+
+def _load_session(token):
+    quest_id, version, scene, steps = decode_session(token)
+    compiled = get_compiled_quest(quest_id)
+    if compiled.version != version or scene >= len(compiled):
+        raise StaleSession("Квест изменился после начала прохождения, начните заново")
+    return compiled, scene, steps
+
+
+def start_session(quest_id):
+    """Новое прохождение с начальной сцены"""
+    compiled = get_compiled_quest(quest_id)
+    return _session_response(compiled, compiled.start, 0)
+
+
+def session_state(token):
+    """Текущая сцена сессии"""
+    compiled, scene, steps = _load_session(token)
+    return _session_response(compiled, scene, steps)
+
+
+def choose(token, choice):
+    """Ход: выбор с номером choice в текущей сцене; новое состояние с новым токеном"""
+    compiled, scene, steps = _load_session(token)
+    return _session_response(compiled, compiled.move(scene, choice), steps + 1)
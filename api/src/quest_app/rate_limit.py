@@ -0,0 +1,397 @@
+"""
+Ограничение частоты обращений к LLM на уровне процесса
+
+Все цепочки генератора вызывают модель через RateLimitedModel, а тот -
+через общий для процесса LLMGovernor:
+- корзины токенов для запросов в секунду и токенов LLM в минуту;
+- ограничение числа одновременных запросов;
+- при ответе 429 (rate limit) запрос повторяется с экспоненциальной задержкой
+  со случайным разбросом, а новые запросы всех потоков приостанавливаются на
+  то же время, чтобы не устроить лавину повторов.
+
+Настройка - QUEST_LLM_RATE_LIMIT; 0 в лимите означает "без ограничения".
+Счетчики (время ожидания в очереди, число 429 и повторов) - LLMGovernor.metrics()
+и GET /api/metrics/.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .instrumentation import record_llm_call, record_retry
+
+try:
+    from langchain_core.runnables import Runnable
+except ImportError:
+    Runnable = object
+
+# Оценка токенов по длине текста (для русского текста у Mistral ~3 символа на токен)
+CHARS_PER_TOKEN = 3
+# Сколько токенов резервируется под ответ до того, как известен фактический расход
+DEFAULT_OUTPUT_TOKENS = 2000
+# Пауза перед повторной проверкой, когда заняты все слоты одновременных запросов
+SLOT_POLL_INTERVAL = 0.05
+
+
+def get_rate_limit_config():
+    """Настройки ограничителя с значениями по умолчанию"""
+    config = {
+        'REQUESTS_PER_SECOND': 0,
+        'TOKENS_PER_MINUTE': 0,
+        'MAX_CONCURRENCY': 0,
+        'MAX_RETRIES': 5,
+        'BACKOFF_BASE': 1.0,
+        'BACKOFF_MAX': 60.0,
+        'OUTPUT_TOKENS': DEFAULT_OUTPUT_TOKENS,
+    }
+    config.update(getattr(settings, 'QUEST_LLM_RATE_LIMIT', {}))
+    return config
+
+
+def is_rate_limit_error(error):
+    """Ответ провайдера 429 (или сообщение о превышении лимита)"""
+    response = getattr(error, 'response', None)
+    status_code = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if status_code == 429:
+        return True
+    message = str(error).lower()
+    return '429' in message or 'rate limit' in message or 'too many requests' in message
+
+
+def _retry_after(error):
+    """Значение заголовка Retry-After в секундах (или None)"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(value):
+    """Грубая оценка числа токенов входа модели"""
+    if hasattr(value, 'to_string'):
+        text = value.to_string()
+    elif isinstance(value, (list, tuple)):
+        text = " ".join(str(getattr(item, 'content', item)) for item in value)
+    else:
+        text = str(value)
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _used_tokens(message):
+    usage = getattr(message, 'usage_metadata', None) or {}
+    return usage.get('total_tokens')
+
+
+class TokenBucket:
+    """Корзина: rate единиц в секунду, емкость capacity (без блокировок - под замком владельца)"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Через сколько секунд можно будет списать amount (0 - уже можно)"""
+        self._refill(now)
+        # Запрос больше емкости пропускается при полной корзине, иначе он ждал бы вечно
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def adjust(self, amount):
+        """Поправка после того, как стал известен фактический расход"""
+        self.level = min(self.capacity, self.level - amount)
+
+
+class LLMGovernor:
+    """Общий для процесса ограничитель запросов к модели"""
+
+    def __init__(self, requests_per_second=0, tokens_per_minute=0, max_concurrency=0,
+                 max_retries=5, backoff_base=1.0, backoff_max=60.0, output_tokens=DEFAULT_OUTPUT_TOKENS):
+        self.requests = TokenBucket(requests_per_second, max(1.0, requests_per_second)) \
+            if requests_per_second else None
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.output_tokens = output_tokens
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._metrics = {
+            'requests': 0,
+            'waiting': 0,
+            'rate_limited': 0,
+            'retries': 0,
+            'failed': 0,
+            'tokens': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    @classmethod
+    def from_settings(cls):
+        config = get_rate_limit_config()
+        return cls(
+            requests_per_second=float(config['REQUESTS_PER_SECOND'] or 0),
+            tokens_per_minute=float(config['TOKENS_PER_MINUTE'] or 0),
+            max_concurrency=int(config['MAX_CONCURRENCY'] or 0),
+            max_retries=int(config['MAX_RETRIES']),
+            backoff_base=float(config['BACKOFF_BASE']),
+            backoff_max=float(config['BACKOFF_MAX']),
+            output_tokens=int(config['OUTPUT_TOKENS']),
+        )
+
+    def _try_acquire(self, tokens):
+        """Занимает слот и бюджет или возвращает, сколько секунд подождать"""
+        with self._lock:
+            now = time.monotonic()
+            if self.paused_until > now:
+                return self.paused_until - now
+            if self.max_concurrency and self.in_flight >= self.max_concurrency:
+                return SLOT_POLL_INTERVAL
+            wait = max(
+                self.requests.wait_time(1, now) if self.requests else 0.0,
+                self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+            )
+            if wait > 0:
+                return wait
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            self._metrics['requests'] += 1
+            return 0.0
+
+    def _record_wait(self, started):
+        waited = time.monotonic() - started
+        with self._lock:
+            self._metrics['waiting'] -= 1
+            self._metrics['wait_seconds_total'] += waited
+            self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+
+    def _start_waiting(self):
+        with self._lock:
+            self._metrics['waiting'] += 1
+        return time.monotonic()
+
+    def acquire(self, tokens):
+        started = self._start_waiting()
+        try:
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait <= 0:
+                    return
+                time.sleep(wait)
+        finally:
+            self._record_wait(started)
+
+    async def aacquire(self, tokens):
+        started = self._start_waiting()
+        try:
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self._record_wait(started)
+
+    def release(self, reserved_tokens, used_tokens=None):
+        """Освобождает слот; used_tokens - фактический расход из ответа модели"""
+        with self._lock:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self._metrics['tokens'] += used_tokens
+                if self.tokens:
+                    self.tokens.adjust(used_tokens - reserved_tokens)
+
+    def backoff(self, attempt, error):
+        """Задержка перед повтором; заодно приостанавливает новые запросы всех потоков"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        with self._lock:
+            self._metrics['rate_limited'] += 1
+            self._metrics['retries'] += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    def record_failure(self):
+        with self._lock:
+            self._metrics['failed'] += 1
+
+    def metrics(self):
+        """Снимок счетчиков: запросы, 429, повторы, ожидание в очереди"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['in_flight'] = self.in_flight
+            metrics['paused_seconds'] = round(max(0.0, self.paused_until - time.monotonic()), 3)
+        requests = metrics['requests']
+        metrics['wait_seconds_avg'] = round(metrics['wait_seconds_total'] / requests, 4) if requests else 0.0
+        metrics['wait_seconds_total'] = round(metrics['wait_seconds_total'], 3)
+        metrics['wait_seconds_max'] = round(metrics['wait_seconds_max'], 3)
+        return metrics
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    """Ограничитель процесса по настройке QUEST_LLM_RATE_LIMIT"""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = LLMGovernor.from_settings()
+    return _governor
+
+
+def reset_governor():
+    """Пересоздает ограничитель (после изменения настроек)"""
+    global _governor
+    with _governor_lock:
+        _governor = None
+
+
+class RateLimitedModel(Runnable):
+    """Обертка модели LangChain: каждый вызов проходит через LLMGovernor
+
+    Поддерживает invoke/ainvoke и потоковые stream/astream (batch и abatch
+    Runnable реализует через них). Потоковый вызов повторяется после 429,
+    только если модель еще не успела вернуть ни одного фрагмента.
+    """
+
+    def __init__(self, model, governor=None):
+        self.model = model
+        self._governor = governor
+
+    @property
+    def governor(self):
+        return self._governor or get_governor()
+
+    def _reserve(self, input):
+        return estimate_tokens(input) + self.governor.output_tokens
+
+    def _should_retry(self, error, attempt):
+        governor = self.governor
+        if is_rate_limit_error(error) and attempt < governor.max_retries:
+            return True
+        governor.record_failure()
+        return False
+
+    def invoke(self, input, config=None, **kwargs):
+        governor = self.governor
+        reserved = self._reserve(input)
+        for attempt in range(governor.max_retries + 1):
+            governor.acquire(reserved)
+            try:
+                result = self.model.invoke(input, config, **kwargs)
+            except Exception as e:
+                governor.release(reserved)
+                if not self._should_retry(e, attempt):
+                    raise
+                delay = governor.backoff(attempt, e)
+                record_retry()
+                print(f"⏳ Лимит запросов LLM (429), повтор {attempt + 1} через {delay:.1f} с")
+                time.sleep(delay)
+                continue
+            governor.release(reserved, _used_tokens(result))
+            record_llm_call(result)
+            return result
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        governor = self.governor
+        reserved = self._reserve(input)
+        for attempt in range(governor.max_retries + 1):
+            await governor.aacquire(reserved)
+            try:
+                result = await self.model.ainvoke(input, config, **kwargs)
+            except Exception as e:
+                governor.release(reserved)
+                if not self._should_retry(e, attempt):
+                    raise
+                delay = governor.backoff(attempt, e)
+                record_retry()
+                print(f"⏳ Лимит запросов LLM (429), повтор {attempt + 1} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                continue
+            governor.release(reserved, _used_tokens(result))
+            record_llm_call(result)
+            return result
+
+    def stream(self, input, config=None, **kwargs):
+        governor = self.governor
+        reserved = self._reserve(input)
+        for attempt in range(governor.max_retries + 1):
+            governor.acquire(reserved)
+            used = None
+            usage_chunk = None
+            started = False
+            retry_delay = None
+            try:
+                for chunk in self.model.stream(input, config, **kwargs):
+                    started = True
+                    if _used_tokens(chunk):
+                        used, usage_chunk = _used_tokens(chunk), chunk
+                    yield chunk
+            except Exception as e:
+                if started or not self._should_retry(e, attempt):
+                    raise
+                retry_delay = governor.backoff(attempt, e)
+                record_retry()
+            finally:
+                # finally, а не except: потребитель может закрыть поток досрочно
+                governor.release(reserved, used)
+            if retry_delay is None:
+                record_llm_call(usage_chunk)
+                return
+            print(f"⏳ Лимит запросов LLM (429), повтор {attempt + 1} через {retry_delay:.1f} с")
+            time.sleep(retry_delay)
+
+    async def astream(self, input, config=None, **kwargs):
+        governor = self.governor
+        reserved = self._reserve(input)
+        for attempt in range(governor.max_retries + 1):
+            await governor.aacquire(reserved)
+            used = None
+            usage_chunk = None
+            started = False
+            retry_delay = None
+            try:
+                async for chunk in self.model.astream(input, config, **kwargs):
+                    started = True
+                    if _used_tokens(chunk):
+                        used, usage_chunk = _used_tokens(chunk), chunk
+                    yield chunk
+            except Exception as e:
+                if started or not self._should_retry(e, attempt):
+                    raise
+                retry_delay = governor.backoff(attempt, e)
+                record_retry()
+            finally:
+                governor.release(reserved, used)
+            if retry_delay is None:
+                record_llm_call(usage_chunk)
+                return
+            print(f"⏳ Лимит запросов LLM (429), повтор {attempt + 1} через {retry_delay:.1f} с")
+            await asyncio.sleep(retry_delay)
@@ -0,0 +1,314 @@
+"""
+Кэш результатов генерации, адресуемый по содержимому входных параметров
+
+Ключ - SHA-256 от нормализованных (genre, hero, goal, scene_count, max_depth,
+complexity, ending_type) и описания конвейера (версия генератора и режимы
+этапов): после изменения промптов старые квесты из кэша не выдаются.
+Значение - готовые данные квеста (Quest.quest_data).
+Хранилище выбирается настройкой QUEST_RESULT_CACHE: память процесса, таблица
+в БД или каталог в файловой системе. Все варианты поддерживают TTL и
+вытеснение давно не использованных записей (LRU) при превышении MAX_ENTRIES.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+DEFAULT_NAMESPACE = 'result'
+
+
+def normalize_text(value):
+    """Приводит строку к каноническому виду: регистр и лишние пробелы не важны"""
+    return " ".join(str(value or "").split()).casefold()
+
+
+def _normalize_number(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return normalize_text(value)
+
+
+def make_cache_key(genre, hero, goal, scene_count=10, max_depth=5,
+                   complexity="medium", ending_type="single", pipeline=""):
+    """Ключ кэша для набора параметров генерации
+
+    pipeline - описание конвейера (LangChainQuestGenerator.pipeline_signature()).
+    """
+    normalized = {
+        "pipeline": str(pipeline),
+        "genre": normalize_text(genre),
+        "hero": normalize_text(hero),
+        "goal": normalize_text(goal),
+        "scene_count": _normalize_number(scene_count),
+        "max_depth": _normalize_number(max_depth),
+        "complexity": normalize_text(complexity),
+        "ending_type": normalize_text(ending_type),
+    }
+    canonical = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class BaseResultCache:
+    """Общий интерфейс хранилищ кэша"""
+
+    def __init__(self, ttl=None, max_entries=1000, namespace=DEFAULT_NAMESPACE, **options):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.namespace = namespace
+
+    def get(self, key):
+        """Возвращает сохраненное значение или None"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryResultCache(BaseResultCache):
+    """LRU-кэш в памяти процесса"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DatabaseResultCache(BaseResultCache):
+    """Кэш в таблице CachedResult основной БД (общий для всех процессов)"""
+
+    def _queryset(self):
+        from .models import CachedResult
+        return CachedResult.objects.filter(namespace=self.namespace)
+
+    def get(self, key):
+        entry = self._queryset().filter(key=key).first()
+        if entry is None:
+            return None
+        now = timezone.now()
+        if self.ttl and entry.created_at < now - timedelta(seconds=self.ttl):
+            entry.delete()
+            return None
+        self._queryset().filter(pk=entry.pk).update(accessed_at=now)
+        return entry.value
+
+    def set(self, key, value):
+        from .models import CachedResult
+        now = timezone.now()
+        CachedResult.objects.update_or_create(
+            namespace=self.namespace,
+            key=key,
+            defaults={"value": value, "created_at": now, "accessed_at": now},
+        )
+        self._evict()
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        stale_ids = list(
+            self._queryset()
+            .order_by('-accessed_at')
+            .values_list('pk', flat=True)[self.max_entries:]
+        )
+        if stale_ids:
+            self._queryset().filter(pk__in=stale_ids).delete()
+
+    def delete(self, key):
+        self._queryset().filter(key=key).delete()
+
+    def clear(self):
+        self._queryset().delete()
+
+
+class FileResultCache(BaseResultCache):
+    """Кэш в виде JSON файлов: LOCATION/<namespace>/<ключ[:2]>/<ключ>.json
+
+    Время последнего обращения хранится в mtime файла.
+    """
+
+    def __init__(self, location=None, **options):
+        super().__init__(**options)
+        location = location or os.path.join(settings.BASE_DIR, 'cache')
+        self.directory = os.path.join(str(location), self.namespace)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl and entry.get('created_at', 0) < time.time() - self.ttl:
+            self.delete(key)
+            return None
+        self._touch(path)
+        return entry.get('value')
+
+    @staticmethod
+    def _touch(path):
+        # Время ставится явно: системная отметка слишком грубая для порядка LRU
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except OSError:
+            pass
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = {"created_at": time.time(), "value": value}
+
+        # Атомарная запись: временный файл в том же каталоге + переименование
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+            self._touch(path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._evict()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        files = list(self._files())
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path), reverse=True)
+        for path in files[self.max_entries:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for path in list(self._files()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+CACHE_BACKENDS = {
+    'memory': MemoryResultCache,
+    'database': DatabaseResultCache,
+    'filesystem': FileResultCache,
+}
+
+
+def build_cache(config, namespace=DEFAULT_NAMESPACE):
+    """Создает хранилище по словарю настроек (BACKEND, TTL, MAX_ENTRIES, LOCATION)"""
+    backend = (config.get('BACKEND') or 'none').lower()
+    if backend == 'none':
+        return None
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"Неизвестное хранилище кэша: {backend}")
+    return CACHE_BACKENDS[backend](
+        ttl=config.get('TTL'),
+        max_entries=config.get('MAX_ENTRIES', 1000),
+        location=config.get('LOCATION'),
+        namespace=namespace,
+    )
+
+
+_configured_caches = {}
+_configured_caches_lock = threading.Lock()
+
+
+def _get_configured_cache(setting_name, namespace):
+    """Хранилище, созданное по словарю настроек setting_name (или None)"""
+    try:
+        return _configured_caches[setting_name]
+    except KeyError:
+        pass
+    with _configured_caches_lock:
+        if setting_name not in _configured_caches:
+            _configured_caches[setting_name] = build_cache(getattr(settings, setting_name, {}), namespace)
+        return _configured_caches[setting_name]
+
+
+def get_result_cache():
+    """Кэш результатов генерации по настройке QUEST_RESULT_CACHE (или None)"""
+    return _get_configured_cache('QUEST_RESULT_CACHE', DEFAULT_NAMESPACE)
+
+
+def get_stage_checkpoints():
+    """Контрольные точки этапов генерации по настройке QUEST_STAGE_CHECKPOINTS (или None)"""
+    return _get_configured_cache('QUEST_STAGE_CHECKPOINTS', 'stage')
+
+
+def reset_caches():
+    """Сбрасывает созданные хранилища (после изменения настроек)"""
+    with _configured_caches_lock:
+        _configured_caches.clear()
+
+
+def make_checkpoint_key(scope, stage, params):
+    """Ключ контрольной точки: область генерации + этап + хэш входа этапа"""
+    canonical = json.dumps(params, ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha256(f"{scope}\n{stage}\n{canonical}".encode('utf-8'))
+    return digest.hexdigest()
@@ -0,0 +1,188 @@
+"""
+Индекс сцен квеста для выдачи отдельных сцен и их окрестностей
+
+Индекс - словарь scene_id -> сцена (в формате quest_data) и обратные ребра.
+Строится по таблицам QuestScene/QuestChoice, если они заполнены, иначе по
+quest_data, и кэшируется в памяти процесса (LRU с TTL, настройка
+QUEST_SCENE_INDEX). Индекс только читается, поэтому отдается без копирования.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+DIRECTION_OUT = 'out'
+DIRECTION_BOTH = 'both'
+DIRECTIONS = (DIRECTION_OUT, DIRECTION_BOTH)
+
+
+class SceneIndex:
+    """Сцены одного квеста с доступом по scene_id"""
+
+    def __init__(self, quest_id, scenes):
+        self.quest_id = quest_id
+        self.order = [scene['scene_id'] for scene in scenes]
+        self.scenes = {scene['scene_id']: scene for scene in scenes}
+        self.parents = {}
+        for scene in scenes:
+            for choice in scene['choices']:
+                parents = self.parents.setdefault(choice['next_scene'], [])
+                if scene['scene_id'] not in parents:
+                    parents.append(scene['scene_id'])
+
+    def __contains__(self, scene_id):
+        return scene_id in self.scenes
+
+    def get(self, scene_id):
+        return self.scenes.get(scene_id)
+
+    def neighborhood(self, scene_id, depth=1, direction=DIRECTION_OUT):
+        """Сцены на расстоянии не больше depth переходов от scene_id
+
+        Возвращает пары (сцена, расстояние) в порядке обхода в ширину; при
+        direction='both' учитываются и сцены, ведущие в scene_id.
+        """
+        if scene_id not in self.scenes:
+            return []
+        distances = {scene_id: 0}
+        queue = deque([scene_id])
+        while queue:
+            node = queue.popleft()
+            if distances[node] >= depth:
+                continue
+            neighbours = [choice['next_scene'] for choice in self.scenes[node]['choices']]
+            if direction == DIRECTION_BOTH:
+                neighbours += self.parents.get(node, [])
+            for next_node in neighbours:
+                if next_node in self.scenes and next_node not in distances:
+                    distances[next_node] = distances[node] + 1
+                    queue.append(next_node)
+        return [(self.scenes[node], distance) for node, distance in distances.items()]
+
+
+def _scenes_from_rows(quest_id):
+    """Сцены из таблиц QuestScene/QuestChoice (пустой список, если квест не разобран)"""
+    from .models import QuestChoice, QuestScene
+
+    scenes = [
+        {"scene_id": scene_id, "text": text, "choices": []}
+        for scene_id, text in QuestScene.objects.filter(quest_id=quest_id)
+        .order_by('position').values_list('scene_id', 'text')
+    ]
+    if not scenes:
+        return []
+    by_id = {scene['scene_id']: scene for scene in scenes}
+    choices = (QuestChoice.objects.filter(quest_id=quest_id)
+               .order_by('scene_id', 'position').values_list('scene_id', 'text', 'next_scene'))
+    for scene_id, text, next_scene in choices:
+        if scene_id in by_id:
+            by_id[scene_id]['choices'].append({"text": text, "next_scene": next_scene})
+    return scenes
+
+
+def _scenes_from_quest_data(quest_id):
+    from .models import Quest
+
+    quest = Quest.objects.only('id', 'quest_data').get(id=quest_id)
+    scenes = []
+    seen = set()
+    for scene in (quest.quest_data or {}).get('scenes') or []:
+        if not isinstance(scene, dict) or not scene.get('scene_id') or scene['scene_id'] in seen:
+            continue
+        seen.add(scene['scene_id'])
+        scenes.append({
+            **scene,
+            "choices": [choice for choice in scene.get('choices') or [] if isinstance(choice, dict)],
+        })
+    return scenes
+
+
+def build_scene_index(quest_id):
+    """Строит индекс квеста; Quest.DoesNotExist, если квеста нет"""
+    from .models import Quest
+
+    scenes = _scenes_from_rows(quest_id)
+    if not scenes:
+        scenes = _scenes_from_quest_data(quest_id)
+    elif not Quest.objects.filter(id=quest_id).exists():
+        raise Quest.DoesNotExist(f"Квест {quest_id} не найден")
+    return SceneIndex(quest_id, scenes)
+
+
+class SceneIndexCache:
+    """LRU-кэш индексов сцен в памяти процесса"""
+
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, quest_id):
+        with self._lock:
+            entry = self._entries.get(quest_id)
+            if entry is None:
+                return None
+            expires_at, index = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[quest_id]
+                return None
+            self._entries.move_to_end(quest_id)
+            return index
+
+    def set(self, quest_id, index):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[quest_id] = (expires_at, index)
+            self._entries.move_to_end(quest_id)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, quest_id):
+        with self._lock:
+            self._entries.pop(quest_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = getattr(settings, 'QUEST_SCENE_INDEX', {})
+                _cache = SceneIndexCache(
+                    max_entries=config.get('MAX_ENTRIES', 256),
+                    ttl=config.get('TTL', 600),
+                )
+    return _cache
+
+
+def get_scene_index(quest_id):
+    """Индекс сцен квеста из кэша (строится при первом обращении)"""
+    cache = _get_cache()
+    index = cache.get(quest_id)
+    if index is None:
+        index = build_scene_index(quest_id)
+        cache.set(quest_id, index)
+    return index
+
+
+def invalidate_scene_index(quest_id):
+    """Удаляет индекс квеста из кэша (после изменения quest_data)"""
+    _get_cache().delete(quest_id)
+
+
+def reset_scene_index_cache():
+    """Сбрасывает кэш целиком (после изменения настроек)"""
+    global _cache
+    with _cache_lock:
+        _cache = None
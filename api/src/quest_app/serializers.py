@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import QuestInput, Quest
+from .models import QuestInput, Quest, GenerationBatch, GenerationJob
 import json
 
 class QuestInputSerializer(serializers.ModelSerializer):
@@ -12,9 +12,85 @@ class QuestSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Quest
-        fields = ['id', 'quest_input', 'quest_data', 'created_at']
+        fields = ['id', 'quest_input', 'quest_data', 'scene_count', 'choice_count', 'max_depth',
+                  'ending_count', 'generator_version', 'created_at']
     
     def to_representation(self, instance):
         """Кастомное представление для правильной кодировки JSON"""
         data = super().to_representation(instance)
-        return data 
\ No newline at end of file
+        return data
+
+
+class QuestListSerializer(serializers.ModelSerializer):
+    """Квест в списке: по умолчанию краткая сводка без quest_data
+
+    Состав полей задается аргументом fields (см. parse_fields).
+    """
+    SUMMARY_FIELDS = ('id', 'title', 'quest_input', 'scene_count', 'choice_count', 'max_depth',
+                      'ending_count', 'generator_version', 'created_at')
+
+    quest_input = QuestInputSerializer(read_only=True)
+    title = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Quest
+        fields = ['id', 'title', 'quest_input', 'scene_count', 'choice_count', 'max_depth',
+                  'ending_count', 'generator_version', 'quest_data', 'created_at']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = set(fields or self.SUMMARY_FIELDS)
+        for name in set(self.fields) - keep:
+            self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, value):
+        """Значение параметра fields: пусто - сводка, full - все поля, иначе список через запятую"""
+        if not value:
+            return list(cls.SUMMARY_FIELDS)
+        if value == 'full':
+            return list(cls.Meta.fields)
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in fields if name not in cls.Meta.fields]
+        if unknown:
+            raise ValueError(f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(cls.Meta.fields)}")
+        return fields
+
+    def get_title(self, instance):
+        return f"{instance.quest_input.genre} - {instance.quest_input.hero}"
+
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    quest_id = serializers.IntegerField(read_only=True)
+    quest_data = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationJob
+        fields = ['id', 'status', 'stage', 'progress', 'params', 'attempts', 'error',
+                  'quest_id', 'quest_data', 'saved_file',
+                  'created_at', 'started_at', 'finished_at']
+
+    def get_quest_data(self, instance):
+        """Данные квеста отдаются только для завершенной задачи"""
+        if instance.status != GenerationJob.STATUS_DONE or instance.quest is None:
+            return None
+        return instance.quest.quest_data
+
+
+class GenerationBatchSerializer(serializers.ModelSerializer):
+    """Пакет генерации: счетчики по статусам и состояние каждого элемента"""
+    counts = serializers.SerializerMethodField()
+    items = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationBatch
+        fields = ['id', 'name', 'created_at', 'counts', 'items']
+
+    def get_counts(self, instance):
+        counts = instance.status_counts()
+        counts['total'] = sum(counts.values())
+        return counts
+
+    def get_items(self, instance):
+        return list(instance.jobs.order_by('id').values(
+            'id', 'item_key', 'status', 'stage', 'quest_id', 'error', 'params'))
@@ -0,0 +1,133 @@
+"""
+Сохранение сгенерированных квестов в базу данных и в файлы
+"""
+
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .file_export import get_file_exporter
+from .langchain_generator import GENERATOR_VERSION
+from .models import GenerationRun, QuestChoice, QuestInput, QuestScene, Quest
+
+
+def get_output_dir():
+    """Папка api/output для JSON файлов квестов"""
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'output')
+
+
+def save_quest_to_file(quest_data, genre, hero, goal):
+    """Сохраняет квест в JSON файл (по умолчанию в фоновом потоке, см. file_export)
+
+    Возвращает имя файла относительно папки выгрузки или None при ошибке.
+    """
+    try:
+        return get_file_exporter().submit(quest_data, genre, hero, goal)
+    except Exception as e:
+        print(f"Ошибка сохранения файла: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def store_quest(quest_data, genre, hero, goal, run=None):
+    """Создает записи QuestInput/Quest и сохраняет квест в файл
+
+    run - запись GenerationRun этой генерации, связывается с квестом.
+    Возвращает пару (quest, saved_file). В фоновом режиме выгрузки saved_file -
+    имя, под которым файл будет записан, а не подтверждение записи.
+    """
+    quest_input = QuestInput.objects.create(
+        genre=genre,
+        hero=hero,
+        goal=goal
+    )
+
+    quest = Quest.objects.create(
+        quest_input=quest_input,
+        quest_data=quest_data,
+        generator_version=GENERATOR_VERSION
+    )
+    if run is not None:
+        GenerationRun.objects.filter(id=run.id).update(quest=quest)
+
+    saved_file = save_quest_to_file(quest_data, genre, hero, goal)
+
+    print(f"Квест успешно создан с ID: {quest.id}")
+    if saved_file:
+        print(f"Сохранен в файл: {saved_file}")
+    else:
+        print("Предупреждение: Не удалось сохранить в файл")
+
+    return quest, saved_file
+
+
+def store_quests_bulk(entries, save_files=True, scene_tables=None):
+    """Сохраняет несколько квестов пакетными INSERT
+
+    entries - список словарей с ключами quest_data, genre, hero, goal и
+    необязательными run (запись GenerationRun), generator_version и
+    created_at (время создания из архива вместо текущего).
+    Сводка и строки сцен считаются здесь же, т.к. bulk_create не вызывает
+    Quest.save(). save_files=False - без выгрузки в JSON файлы (импорт архива),
+    scene_tables - заполнять ли QuestScene/QuestChoice (None - по настройке
+    QUEST_SCENE_TABLES).
+    Возвращает список пар (quest, saved_file) в порядке entries.
+    """
+    if not entries:
+        return []
+    with transaction.atomic():
+        inputs = QuestInput.objects.bulk_create([
+            QuestInput(genre=entry['genre'], hero=entry['hero'], goal=entry['goal'])
+            for entry in entries
+        ])
+        quests = []
+        for entry, quest_input in zip(entries, inputs):
+            quest = Quest(quest_input=quest_input, quest_data=entry['quest_data'],
+                          generator_version=entry.get('generator_version', GENERATOR_VERSION))
+            quest.refresh_summary()
+            quests.append(quest)
+        Quest.objects.bulk_create(quests)
+
+        # auto_now_add ставит текущее время при INSERT, исходное время - отдельным UPDATE
+        dated_inputs, dated_quests = [], []
+        for entry, quest_input, quest in zip(entries, inputs, quests):
+            if entry.get('created_at') is not None:
+                quest_input.created_at = quest.created_at = entry['created_at']
+                dated_inputs.append(quest_input)
+                dated_quests.append(quest)
+        QuestInput.objects.bulk_update(dated_inputs, ['created_at'], batch_size=1000)
+        Quest.objects.bulk_update(dated_quests, ['created_at'], batch_size=1000)
+
+        if scene_tables is None:
+            scene_tables = getattr(settings, 'QUEST_SCENE_TABLES', False)
+        if scene_tables:
+            scene_rows, choice_rows = [], []
+            for quest in quests:
+                scenes, choices = quest.build_scene_rows()
+                scene_rows.extend(scenes)
+                choice_rows.extend(choices)
+            QuestScene.objects.bulk_create(scene_rows, batch_size=1000)
+            QuestChoice.objects.bulk_create(choice_rows, batch_size=1000)
+
+        runs = []
+        for entry, quest in zip(entries, quests):
+            if entry.get('run') is not None:
+                entry['run'].quest = quest
+                runs.append(entry['run'])
+        GenerationRun.objects.bulk_update(runs, ['quest'])
+
+    results = []
+    for entry, quest in zip(entries, quests):
+        saved_file = None
+        if save_files:
+            saved_file = save_quest_to_file(entry['quest_data'], entry['genre'], entry['hero'], entry['goal'])
+        results.append((quest, saved_file))
+    print(f"💾 Сохранено квестов: {len(quests)} (ID {quests[0].id}-{quests[-1].id})")
+    return results
+
+
+# Версия для асинхронных представлений: запись в БД и файл выполняется в потоке
+astore_quest = sync_to_async(store_quest)
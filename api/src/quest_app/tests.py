@@ -1,3 +1,208 @@
+import contextlib
+import io
+import os
+import tempfile
+from datetime import datetime, timezone
+
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .benchmarks.txt_parser import check_equivalence, legacy_parse_txt_file
+from .fake_llm import FakeQuestChatModel
+from .langchain_generator import VALIDATION_LOCAL, LangChainQuestGenerator
+from .models import Quest, QuestInput
+from .quest_archive import QuestArchiveReader, QuestArchiveWriter
+from .quest_graph import END_SCENE, START_SCENE, validate_quest_graph
+from .txt_parser import parse_txt_file
+
+LONG_TEXT = "Герой стоит на перекрестке и думает, куда идти дальше. " * 3
+
+
+def make_quest(*edges, scene_ids=None):
+    """quest_data по списку ребер (scene_id, next_scene); у каждой сцены длинный текст"""
+    scene_ids = scene_ids or list(dict.fromkeys([START_SCENE] + [node for edge in edges for node in edge]))
+    scenes = []
+    for scene_id in scene_ids:
+        choices = [{"text": f"Идти в {target}", "next_scene": target} for source, target in edges if source == scene_id]
+        if scene_id == END_SCENE:
+            choices = [{"text": "Завершить квест", "next_scene": END_SCENE}]
+        scenes.append({"scene_id": scene_id, "text": LONG_TEXT, "choices": choices})
+    return {"scenes": scenes}
+
+
+def create_quest(quest_data, genre="фэнтези", hero="рыцарь"):
+    quest_input = QuestInput.objects.create(genre=genre, hero=hero, goal="найти меч")
+    return Quest.objects.create(quest_input=quest_input, quest_data=quest_data)
+
+
+class QuestGraphValidationTests(TestCase):
+    """Локальная проверка и исправление структуры квеста"""
+
+    def test_valid_quest_passes(self):
+        quest = make_quest((START_SCENE, "a"), (START_SCENE, "b"), ("a", END_SCENE), ("a", "b"),
+                           ("b", END_SCENE), ("b", END_SCENE))
+        result = validate_quest_graph(quest, max_depth=5)
+        self.assertEqual(result["validation_result"], "passed")
+        self.assertEqual(result["issues_found"], [])
+        self.assertEqual(result["text_issues"], [])
+        self.assertEqual(result["stats"]["max_depth"], 3)
+
+    def test_dangling_choice_and_cycle_are_fixed(self):
+        quest = make_quest((START_SCENE, "a"), (START_SCENE, "missing"), ("a", START_SCENE), ("a", END_SCENE),
+                           scene_ids=[START_SCENE, "a", END_SCENE])
+        result = validate_quest_graph(quest)
+        self.assertEqual(result["validation_result"], "fixed")
+        targets = {(scene["scene_id"], choice["next_scene"])
+                   for scene in result["final_quest"]["scenes"] for choice in scene["choices"]}
+        self.assertIn((START_SCENE, END_SCENE), targets)
+        self.assertNotIn((START_SCENE, "missing"), targets)
+        self.assertNotIn(("a", START_SCENE), targets)
+
+    def test_missing_end_scene_is_added(self):
+        quest = make_quest((START_SCENE, "a"), (START_SCENE, "a"), scene_ids=[START_SCENE, "a"])
+        result = validate_quest_graph(quest)
+        self.assertEqual(result["validation_result"], "fixed")
+        scene_ids = [scene["scene_id"] for scene in result["final_quest"]["scenes"]]
+        self.assertIn(END_SCENE, scene_ids)
+        self.assertIn(f"Сцене '{END_SCENE}' нужен финальный текст", result["text_issues"])
+
+    def test_non_string_next_scene_is_retargeted(self):
+        quest = make_quest((START_SCENE, END_SCENE), (START_SCENE, END_SCENE))
+        quest["scenes"][0]["choices"][0]["next_scene"] = ["a", "b"]
+        quest["scenes"][0]["choices"][1]["next_scene"] = None
+        result = validate_quest_graph(quest)
+        self.assertEqual(result["validation_result"], "fixed")
+        start = result["final_quest"]["scenes"][0]
+        self.assertEqual([choice["next_scene"] for choice in start["choices"]], [END_SCENE, END_SCENE])
+        self.assertTrue(any("некорректный next_scene" in issue for issue in result["issues_found"]))
+
+    def test_max_depth_overrun_is_left_to_the_model(self):
+        quest = make_quest((START_SCENE, "a"), (START_SCENE, "b"), ("a", "b"), ("a", END_SCENE),
+                           ("b", "c"), ("b", END_SCENE), ("c", END_SCENE), ("c", END_SCENE))
+        result = validate_quest_graph(quest, max_depth=2)
+        self.assertEqual(result["stats"]["max_depth"], 4)
+        self.assertTrue(any("превышает max_depth 2" in issue for issue in result["text_issues"]))
+        self.assertEqual(result["final_quest"], quest)
+
+    def test_quest_without_scenes_fails(self):
+        result = validate_quest_graph({"scenes": [{"text": "без id"}]})
+        self.assertEqual(result["validation_result"], "failed")
+
+
+class FakeGenerationTests(TestCase):
+    """Полный конвейер генерации на фейковой модели"""
+
+    def test_generated_quest_is_valid(self):
+        generator = LangChainQuestGenerator(llm=FakeQuestChatModel(), validation_mode=VALIDATION_LOCAL)
+        with contextlib.redirect_stdout(io.StringIO()):
+            quest = generator.generate_quest("фэнтези", "рыцарь", "найти меч", scene_count=5, max_depth=4)
+        self.assertNotIn("error", quest)
+        self.assertEqual(len(quest["scenes"]), 5)
+        self.assertEqual(validate_quest_graph(quest, max_depth=4)["validation_result"], "passed")
+
+
+class TxtParserTests(TestCase):
+    """Разбор txt совпадает с прежней реализацией"""
+
+    def test_fields_are_parsed(self):
+        content = "Жанр: Фэнтези\nГлавный герой: Рыцарь Ланс\nЦель: найти священный меч."
+        self.assertEqual(parse_txt_file(content), {"genre": "фэнтези", "hero": "рыцарь ланс",
+                                                   "goal": "найти священный меч"})
+
+    def test_fallback_to_first_lines(self):
+        content = "Киберпанк\nХакер\nВзломать корпорацию\n"
+        self.assertEqual(parse_txt_file(content), legacy_parse_txt_file(content))
+
+    def test_equivalent_to_legacy_parser(self):
+        self.assertEqual(check_equivalence(500), [])
+
+
+class QuestArchiveTests(TestCase):
+    """Запись и чтение архива квестов"""
+
+    def test_round_trip(self):
+        created_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        quests = {
+            7: make_quest((START_SCENE, END_SCENE), (START_SCENE, END_SCENE)),
+            3: {"scenes": [], "meta": {"score": 1.5, "flags": [True, False, None], "delta": -2}},
+        }
+        for compression in ('zlib', 'none'):
+            with self.subTest(compression=compression), tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'quests.qar')
+                with QuestArchiveWriter(path, compression=compression) as writer:
+                    for quest_id, quest_data in quests.items():
+                        writer.write(quest_id, quest_data, genre="фэнтези", hero="рыцарь", goal="найти меч",
+                                     generator_version="v1", created_at=created_at)
+                with QuestArchiveReader(path) as reader:
+                    self.assertEqual(len(reader), 2)
+                    self.assertEqual([record['id'] for record in reader], [7, 3])
+                    record = reader.get(7)
+                    self.assertEqual(record['quest_data'], quests[7])
+                    self.assertEqual(record['created_at'], created_at)
+                    self.assertEqual((record['genre'], record['hero'], record['goal']),
+                                     ("фэнтези", "рыцарь", "найти меч"))
+                    self.assertEqual(reader.get(3)['quest_data'], quests[3])
+                    self.assertIsNone(reader.get(5))
+
+
+class QuestListPaginationTests(TestCase):
+    """Курсорная пагинация GET /api/quests/"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.quests = [create_quest(make_quest((START_SCENE, END_SCENE))) for _ in range(5)]
+
+    def test_pages_follow_next_cursor(self):
+        seen = []
+        url = '/api/quests/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(quest['id'] for quest in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [quest.id for quest in reversed(self.quests)])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/quests/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.data)
+
+
+class PlaySessionTests(TestCase):
+    """Прохождение квеста по подписанному токену сессии"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.quest = create_quest(make_quest((START_SCENE, "a"), (START_SCENE, END_SCENE), ("a", END_SCENE)))
+
+    def start(self):
+        response = self.client.post(f'/api/quests/{self.quest.id}/play/')
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_play_to_the_end(self):
+        state = self.start()
+        self.assertEqual(state['scene_id'], START_SCENE)
+        state = self.client.post(f"/api/play/{state['session']}/choose/", {'choice': 0}, format='json').data
+        self.assertEqual((state['scene_id'], state['steps']), ("a", 1))
+        state = self.client.post(f"/api/play/{state['session']}/choose/", {'choice': 0}, format='json').data
+        self.assertEqual(state['scene_id'], END_SCENE)
+        self.assertTrue(state['finished'])
+        self.assertEqual(self.client.get(f"/api/play/{state['session']}/").data['scene_id'], END_SCENE)
+
+    def test_invalid_choice(self):
+        session = self.start()['session']
+        response = self.client.post(f"/api/play/{session}/choose/", {'choice': 5}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_tampered_token_is_rejected(self):
+        session = self.start()['session']
+        response = self.client.get(f"/api/play/{session[:-1]}x/")
+        self.assertEqual(response.status_code, 400)
 
-# Create your tests here.
+    def test_session_is_stale_after_quest_change(self):
+        session = self.start()['session']
+        self.quest.quest_data = make_quest((START_SCENE, END_SCENE), (START_SCENE, END_SCENE))
+        self.quest.save()
+        response = self.client.get(f"/api/play/{session}/")
+        self.assertEqual(response.status_code, 409)
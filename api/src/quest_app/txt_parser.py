@@ -0,0 +1,294 @@
+"""
+Разбор txt файлов с параметрами квеста (жанр, герой, цель)
+
+Шаблоны полей компилируются один раз при импорте. Файл читается одним
+проходом по кускам текста: кусок целиком приводится к нижнему регистру, в нем
+ищутся ключевые слова полей (str.find), и шаблоны проверяются только на
+строках, где они есть. Остальной текст не делится на строки.
+Куски берутся из потока байт, так что большие загрузки и файлы из zip-архивов
+не читаются в память целиком; чтение прекращается, как только найдены все три
+поля.
+
+Результат совпадает с прежним разбором: для каждого поля берется шаблон с
+наивысшим приоритетом в первой строке, где сработал хотя бы один шаблон поля,
+значение приводится к нижнему регистру. Если не найдено все, поля берутся из
+первых трех непустых строк.
+"""
+
+import codecs
+import re
+import zipfile
+import zlib
+
+from django.conf import settings
+
+FIELDS = ('genre', 'hero', 'goal')
+STRIP_CHARS = ' .,()«»"'
+UPLOAD_ENCODINGS = ('utf-8', 'cp1251')
+CHUNK_SIZE = 64 * 1024
+
+# Шаблоны в порядке приоритета
+FIELD_PATTERNS = {
+    'genre': [
+        r'жанр\s*[:\s]\s*([^:\n]+?)(?:\s*главный|\s*герой|\s*персонаж|\s*цель|\s*задача|\s*миссия|$)',
+        r'genre\s*[:\s]\s*([^:\n]+?)(?:\s*hero|\s*protagonist|\s*goal|\s*objective|$)',
+        r'стиль\s*[:\s]\s*([^:\n]+?)(?:\s*главный|\s*герой|\s*персонаж|\s*цель|\s*задача|$)',
+    ],
+    'hero': [
+        r'главный\s+герой\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
+        r'герой\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
+        r'персонаж\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
+        r'protagonist\s*[:\s]\s*([^:\n]+?)(?:\s*goal|\s*objective|$)',
+        r'hero\s*[:\s]\s*([^:\n]+?)(?:\s*goal|\s*objective|$)',
+    ],
+    'goal': [
+        r'цель\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'задача\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'миссия\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'goal\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+        r'objective\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
+    ],
+}
+
+# Без одного из этих слов ни один шаблон сработать не может
+KEYWORDS = ('жанр', 'genre', 'стиль', 'герой', 'персонаж', 'protagonist', 'hero',
+            'цель', 'задача', 'миссия', 'goal', 'objective')
+
+FIELD_MATCHERS = {
+    field: [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    for field, patterns in FIELD_PATTERNS.items()
+}
+
+
+def _scan_line(line_lower, parsed_data):
+    """Заполняет ненайденные поля значениями из строки (в нижнем регистре)"""
+    for field, matchers in FIELD_MATCHERS.items():
+        if parsed_data[field]:
+            continue
+        for matcher in matchers:
+            match = matcher.search(line_lower)
+            if match:
+                parsed_data[field] = match.group(1).strip(STRIP_CHARS)
+                break
+
+
+def _collect_first_lines(text, first_lines):
+    """Дополняет first_lines непустыми строками из начала text (до трех)"""
+    position = 0
+    while len(first_lines) < len(FIELDS) and position < len(text):
+        end = text.find('\n', position)
+        if end == -1:
+            end = len(text)
+        line = text[position:end].strip()
+        if line:
+            first_lines.append(line)
+        position = end + 1
+
+
+def _keyword_positions(text_lower):
+    """Позиции всех ключевых слов в тексте по возрастанию"""
+    positions = []
+    for keyword in KEYWORDS:
+        position = text_lower.find(keyword)
+        while position != -1:
+            positions.append(position)
+            position = text_lower.find(keyword, position + len(keyword))
+    return sorted(positions)
+
+
+def _scan_text(text, parsed_data, first_lines):
+    """Разбор куска из целых строк; True, если найдены все поля
+
+    Нижний регистр всего куска совпадает с нижним регистром его строк по
+    отдельности, поэтому строки с ключевыми словами берутся из него.
+    """
+    if len(first_lines) < len(FIELDS):
+        _collect_first_lines(text, first_lines)
+    text_lower = text.lower()
+    line_end = -1
+    for position in _keyword_positions(text_lower):
+        if position < line_end:
+            continue
+        line_start = text_lower.rfind('\n', 0, position) + 1
+        line_end = text_lower.find('\n', position)
+        if line_end == -1:
+            line_end = len(text_lower)
+        _scan_line(text_lower[line_start:line_end].strip(), parsed_data)
+        if all(parsed_data.values()):
+            return True
+    return False
+
+
+def _fallback_value(line):
+    """Значение из строки без шаблона: вся строка или часть после двоеточия"""
+    if ':' not in line:
+        return line
+    return line.split(':', 1)[1].strip()
+
+
+def parse_text_chunks(chunks):
+    """Извлекает жанр, героя и цель из последовательности кусков текста
+
+    Куски могут разрывать строки: неполная последняя строка куска
+    переносится в следующий.
+    """
+    parsed_data = {field: '' for field in FIELDS}
+    first_lines = []
+    pending = []
+    for chunk in chunks:
+        end = chunk.rfind('\n') + 1
+        if not end:
+            pending.append(chunk)
+            continue
+        text = "".join(pending) + chunk[:end] if pending else chunk[:end]
+        pending = [chunk[end:]]
+        if _scan_text(text, parsed_data, first_lines):
+            return parsed_data
+    if _scan_text("".join(pending), parsed_data, first_lines):
+        return parsed_data
+
+    # Простая эвристика: первые 3 непустые строки - жанр, герой и цель
+    if len(first_lines) == len(FIELDS):
+        for field, line in zip(FIELDS, first_lines):
+            if not parsed_data[field]:
+                parsed_data[field] = _fallback_value(line)
+    return parsed_data
+
+
+def iter_text_chunks(chunks, encoding='utf-8'):
+    """Куски текста из потока кусков байт (кодировка декодируется по частям)"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+def parse_txt_file(file_content):
+    """Парсит содержимое txt файла и извлекает жанр, героя и цель"""
+    try:
+        return parse_text_chunks([file_content])
+    except Exception as e:
+        print(f"Ошибка парсинга файла: {e}")
+        return None
+
+
+def parse_txt_stream(open_chunks):
+    """Разбор потока байт в UTF-8 или Windows-1251
+
+    open_chunks() каждый раз возвращает новый итератор кусков с начала файла:
+    если файл не в UTF-8, он читается заново в Windows-1251. Возвращает пару
+    (данные, кодировка); UnicodeDecodeError, если не подошла ни одна кодировка.
+    """
+    error = None
+    for encoding in UPLOAD_ENCODINGS:
+        try:
+            return parse_text_chunks(iter_text_chunks(open_chunks(), encoding)), encoding
+        except UnicodeDecodeError as e:
+            error = e
+    raise error
+
+
+def _read_upload(uploaded_file):
+    def open_chunks():
+        uploaded_file.seek(0)
+        return uploaded_file.chunks(CHUNK_SIZE)
+    return open_chunks
+
+
+def parse_uploaded_file(uploaded_file):
+    """Разбор загруженного файла Django по кускам"""
+    return parse_txt_stream(_read_upload(uploaded_file))
+
+
+def missing_fields(parsed_data):
+    """Названия ненайденных полей для сообщений пользователю"""
+    names = {'genre': 'жанр', 'hero': 'героя', 'goal': 'цель'}
+    return [names[field] for field in FIELDS if not parsed_data[field]]
+
+
+def get_upload_config():
+    """Ограничения пакетной загрузки с значениями по умолчанию"""
+    config = {
+        'MAX_FILES': 500,
+        'MAX_FILE_SIZE': 20 * 1024 * 1024,
+        'MAX_TOTAL_SIZE': 200 * 1024 * 1024,
+    }
+    config.update(getattr(settings, 'QUEST_TXT_UPLOAD', {}))
+    return config
+
+
+def _read_member(archive, info):
+    def open_chunks():
+        with archive.open(info) as member:
+            yield from iter(lambda: member.read(CHUNK_SIZE), b'')
+    return open_chunks
+
+
+def iter_upload_sources(uploaded_files):
+    """Пары (имя, open_chunks или текст ошибки) для txt файлов и txt внутри zip
+
+    Размеры файлов в архиве проверяются по заголовкам до распаковки, чтобы
+    архив не мог развернуться в неограниченный объем.
+    """
+    config = get_upload_config()
+    count = 0
+    total = 0
+
+    def admit(name, size):
+        nonlocal count, total
+        count += 1
+        total += size
+        if count > config['MAX_FILES']:
+            raise ValueError(f"Слишком много файлов, максимум {config['MAX_FILES']}")
+        if total > config['MAX_TOTAL_SIZE']:
+            raise ValueError(f"Суммарный объем файлов больше {config['MAX_TOTAL_SIZE']} байт")
+        if size > config['MAX_FILE_SIZE']:
+            return f"Файл больше {config['MAX_FILE_SIZE']} байт"
+        return None
+
+    for uploaded_file in uploaded_files:
+        name = uploaded_file.name
+        if name.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(uploaded_file)
+            except zipfile.BadZipFile:
+                yield name, "Поврежденный zip архив"
+                continue
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith('.txt'):
+                        continue
+                    member_name = f"{name}/{info.filename}"
+                    error = admit(member_name, info.file_size)
+                    yield member_name, error or _read_member(archive, info)
+        elif name.lower().endswith('.txt'):
+            error = admit(name, uploaded_file.size)
+            yield name, error or _read_upload(uploaded_file)
+        else:
+            yield name, "Поддерживаются только txt файлы и zip архивы"
+
+
+def parse_uploads(uploaded_files):
+    """Разбирает txt файлы и zip архивы; результат по каждому txt файлу"""
+    results = []
+    for name, source in iter_upload_sources(uploaded_files):
+        if isinstance(source, str):
+            results.append({"file": name, "status": "error", "error": source})
+            continue
+        try:
+            parsed_data, _ = parse_txt_stream(source)
+        except UnicodeDecodeError:
+            results.append({"file": name, "status": "error",
+                            "error": "Не удалось прочитать файл. Проверьте кодировку "
+                                     "(поддерживается UTF-8 и Windows-1251)"})
+            continue
+        except (zipfile.BadZipFile, RuntimeError, NotImplementedError, zlib.error, OSError) as e:
+            # Поврежденный, зашифрованный или сжатый неизвестным методом файл в zip
+            results.append({"file": name, "status": "error", "error": f"Не удалось распаковать файл: {e}"})
+            continue
+        missing = missing_fields(parsed_data)
+        entry = {"file": name, "status": "partial" if missing else "ok", "data": parsed_data}
+        if missing:
+            entry["warning"] = f"Не удалось извлечь: {', '.join(missing)}"
+        results.append(entry)
+    return results
@@ -3,7 +3,21 @@ from . import views
 
 urlpatterns = [
     path('generate/', views.generate_quest, name='generate_quest'),
+    path('generate/async/', views.generate_quest_async, name='generate_quest_async'),
+    path('generate/stream/', views.generate_quest_stream, name='generate_quest_stream'),
+    path('jobs/<int:job_id>/', views.get_job_status, name='get_job_status'),
+    path('batches/', views.create_generation_batch, name='create_generation_batch'),
+    path('batches/<int:batch_id>/', views.get_generation_batch, name='get_generation_batch'),
+    path('metrics/', views.get_metrics, name='get_metrics'),
     path('parse-txt/', views.parse_txt_quest, name='parse_txt_quest'),
+    path('parse-txt/batch/', views.parse_txt_batch, name='parse_txt_batch'),
     path('quests/', views.get_quests, name='get_quests'),
     path('quests/<int:quest_id>/', views.get_quest_detail, name='get_quest_detail'),
+    path('quests/<int:quest_id>/scenes/<str:scene_id>/', views.get_quest_scene, name='get_quest_scene'),
+    path('quests/<int:quest_id>/scenes/<str:scene_id>/neighborhood/', views.get_scene_neighborhood,
+         name='get_scene_neighborhood'),
+    path('quests/<int:quest_id>/analytics/', views.quest_analytics_view, name='quest_analytics'),
+    path('quests/<int:quest_id>/play/', views.start_play_session, name='start_play_session'),
+    path('play/<str:session>/', views.get_play_session, name='get_play_session'),
+    path('play/<str:session>/choose/', views.choose_play_session, name='choose_play_session'),
 ] 
\ No newline at end of file
@@ -1,168 +1,40 @@
+import asyncio
 import json
-import os
-import re
-from datetime import datetime
-from django.http import JsonResponse
+import weakref
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import APIException
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
-from .models import QuestInput, Quest
-from .serializers import QuestInputSerializer, QuestSerializer
-from .llm_generator import QuestGenerator
-
-
-def parse_txt_file(file_content):
-    """Парсит содержимое txt файла и извлекает жанр, героя и цель"""
-    try:
-        # Разбиваем содержимое на строки
-        lines = file_content.split('\n')
-        
-        parsed_data = {
-            'genre': '',
-            'hero': '',
-            'goal': ''
-        }
-        
-        # Паттерны для поиска данных (используем более точные регулярки)
-        genre_patterns = [
-            r'жанр\s*[:\s]\s*([^:\n]+?)(?:\s*главный|\s*герой|\s*персонаж|\s*цель|\s*задача|\s*миссия|$)',
-            r'genre\s*[:\s]\s*([^:\n]+?)(?:\s*hero|\s*protagonist|\s*goal|\s*objective|$)',
-            r'стиль\s*[:\s]\s*([^:\n]+?)(?:\s*главный|\s*герой|\s*персонаж|\s*цель|\s*задача|$)',
-        ]
-        
-        hero_patterns = [
-            r'главный\s+герой\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
-            r'герой\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
-            r'персонаж\s*[:\s]\s*([^:\n]+?)(?:\s*цель|\s*задача|\s*миссия|\s*goal|$)',
-            r'protagonist\s*[:\s]\s*([^:\n]+?)(?:\s*goal|\s*objective|$)',
-            r'hero\s*[:\s]\s*([^:\n]+?)(?:\s*goal|\s*objective|$)',
-        ]
-        
-        goal_patterns = [
-            r'цель\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
-            r'задача\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
-            r'миссия\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
-            r'goal\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
-            r'objective\s*[:\s]\s*([^:\n]+?)(?:\s*$)',
-        ]
-        
-        # Обрабатываем каждую строку отдельно
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            line_lower = line.lower()
-            
-            # Ищем жанр в этой строке
-            if not parsed_data['genre']:
-                for pattern in genre_patterns:
-                    match = re.search(pattern, line_lower, re.IGNORECASE)
-                    if match:
-                        parsed_data['genre'] = match.group(1).strip(' .,()«»"')
-                        break
-            
-            # Ищем героя в этой строке
-            if not parsed_data['hero']:
-                for pattern in hero_patterns:
-                    match = re.search(pattern, line_lower, re.IGNORECASE)
-                    if match:
-                        parsed_data['hero'] = match.group(1).strip(' .,()«»"')
-                        break
-            
-            # Ищем цель в этой строке
-            if not parsed_data['goal']:
-                for pattern in goal_patterns:
-                    match = re.search(pattern, line_lower, re.IGNORECASE)
-                    if match:
-                        parsed_data['goal'] = match.group(1).strip(' .,()«»"')
-                        break
-        
-        # Если не нашли через регулярки, пробуем простой подход
-        if not all([parsed_data['genre'], parsed_data['hero'], parsed_data['goal']]):
-            # Удаляем пустые строки и ищем по порядку
-            non_empty_lines = [line.strip() for line in lines if line.strip()]
-            
-            # Простая эвристика: первые 3 непустые строки
-            if len(non_empty_lines) >= 3:
-                if not parsed_data['genre']:
-                    # Если первая строка содержит только одно слово (жанр)
-                    first_line = non_empty_lines[0]
-                    if ':' not in first_line:
-                        parsed_data['genre'] = first_line
-                    else:
-                        # Извлекаем часть после двоеточия
-                        parts = first_line.split(':', 1)
-                        if len(parts) > 1:
-                            parsed_data['genre'] = parts[1].strip()
-                
-                if not parsed_data['hero']:
-                    second_line = non_empty_lines[1]
-                    if ':' not in second_line:
-                        parsed_data['hero'] = second_line
-                    else:
-                        parts = second_line.split(':', 1)
-                        if len(parts) > 1:
-                            parsed_data['hero'] = parts[1].strip()
-                
-                if not parsed_data['goal']:
-                    third_line = non_empty_lines[2]
-                    if ':' not in third_line:
-                        parsed_data['goal'] = third_line
-                    else:
-                        parts = third_line.split(':', 1)
-                        if len(parts) > 1:
-                            parsed_data['goal'] = parts[1].strip()
-        
-        return parsed_data
-        
-    except Exception as e:
-        print(f"Ошибка парсинга файла: {e}")
-        return None
-
-
-def save_quest_to_file(quest_data, genre, hero, goal):
-    """Сохраняет квест в JSON файл"""
-    try:
-        # Создаем папку output если её нет
-        output_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'output')
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Создаем имя файла
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"quest_{genre}_{hero}_{timestamp}.json"
-        filepath = os.path.join(output_dir, filename)
-        
-        # Подготавливаем данные для сохранения
-        quest_info = {
-            "metadata": {
-                "genre": genre,
-                "hero": hero,
-                "goal": goal,
-                "generated_at": datetime.now().isoformat(),
-                "model": "mistral-large-latest"
-            },
-            "quest_data": quest_data
-        }
-        
-        # Сохраняем в файл
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(quest_info, f, ensure_ascii=False, indent=2)
-        
-        return filename
-    except Exception as e:
-        print(f"Ошибка сохранения файла: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+from .models import Quest, GenerationBatch, GenerationJob
+from .http_cache import conditional_quest_view, page_etag, set_cache_headers
+from .instrumentation import prometheus_metrics, stage_report
+from .pagination import QuestCursorPagination
+from .file_export import get_file_exporter
+from .quest_analytics import check_constraints, generation_params, get_quest_analytics
+from .quest_runtime import SessionError, StaleSession, choose, session_state, start_session
+from .rate_limit import get_governor
+from .scene_index import DIRECTIONS, DIRECTION_OUT, get_scene_index
+from .serializers import (
+    QuestSerializer, QuestListSerializer, GenerationBatchSerializer, GenerationJobSerializer,
+)
+from .batches import create_batch
+from .jobs import enqueue_job
+from .llm_generator import get_quest_generator
+from .storage import astore_quest
+from .txt_parser import missing_fields, parse_uploaded_file, parse_uploads
 
 
 @api_view(['POST'])
 def generate_quest(request):
-    """Генерирует новый квест"""
+    """Ставит генерацию нового квеста в очередь"""
     try:
         # Получаем данные из запроса
         genre = request.data.get('genre')
@@ -174,6 +46,8 @@ def generate_quest(request):
         max_depth = request.data.get('max_depth', 5)
         complexity = request.data.get('complexity', 'medium')
         ending_type = request.data.get('ending_type', 'single')
+        # use_cache=false - сгенерировать новый вариант, не используя кэш результатов
+        use_cache = request.data.get('use_cache', True)
 
         # Проверяем обязательные поля
         if not all([genre, hero, goal]):
@@ -182,7 +56,7 @@ def generate_quest(request):
                 status=400
             )
 
-        print(f"Генерируем квест с параметрами:")
+        print(f"Ставим в очередь квест с параметрами:")
         print(f"- Жанр: {genre}")
         print(f"- Герой: {hero}")
         print(f"- Цель: {goal}")
@@ -191,59 +65,28 @@ def generate_quest(request):
         print(f"- Сложность: {complexity}")
         print(f"- Тип концовок: {ending_type}")
 
-        # Создаем генератор квестов
-        generator = QuestGenerator()
-        
-        # Генерируем квест с новыми параметрами
-        quest_data = generator.generate_quest(
-            genre=genre,
-            hero=hero,
-            goal=goal,
-            scene_count=scene_count,
-            max_depth=max_depth,
-            complexity=complexity,
-            ending_type=ending_type
-        )
-
-        # Проверяем на ошибки
-        if 'error' in quest_data:
-            print(f"Ошибка генерации: {quest_data['error']}")
-            return Response(
-                {"error": quest_data['error']},
-                status=500
-            )
+        job = enqueue_job({
+            "genre": genre,
+            "hero": hero,
+            "goal": goal,
+            "scene_count": scene_count,
+            "max_depth": max_depth,
+            "complexity": complexity,
+            "ending_type": ending_type,
+            "use_cache": use_cache,
+        })
 
-        # Создаем запись в базе данных
-        quest_input = QuestInput.objects.create(
-            genre=genre,
-            hero=hero,
-            goal=goal
-        )
+        print(f"Задача генерации создана с ID: {job.id}")
 
-        # Сохраняем квест
-        quest = Quest.objects.create(
-            quest_input=quest_input,
-            quest_data=quest_data
-        )
-
-        # Сохраняем в файл
-        saved_file = save_quest_to_file(quest_data, genre, hero, goal)
-
-        print(f"Квест успешно создан с ID: {quest.id}")
-        if saved_file:
-            print(f"Сохранен в файл: {saved_file}")
-        else:
-            print("Предупреждение: Не удалось сохранить в файл")
-
-        # Возвращаем результат
+        # Возвращаем идентификатор задачи, сам квест создаст обработчик очереди
         response_data = {
-            "id": quest.id,
-            "quest_data": quest_data,
-            "saved_file": saved_file or "Не удалось сохранить",
-            "message": "Квест успешно сгенерирован"
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": request.build_absolute_uri(reverse('get_job_status', args=[job.id])),
+            "message": "Квест поставлен в очередь на генерацию"
         }
 
-        return Response(response_data)
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
 
     except Exception as e:
         print(f"Ошибка в generate_quest: {e}")
@@ -256,12 +99,125 @@ def generate_quest(request):
 
 
 @api_view(['GET'])
-def get_quests(request):
-    """Получает список всех квестов"""
+def get_metrics(request):
+    """Счетчики процесса (ограничитель запросов к LLM, выгрузка в файлы) и сводка по этапам генерации
+
+    ?days= - за сколько последних дней считать сводку этапов (по умолчанию 7).
+    """
     try:
-        quests = Quest.objects.all().order_by('-created_at')
-        serializer = QuestSerializer(quests, many=True)
+        days = max(1, int(request.GET.get('days', 7)))
+    except ValueError:
+        return Response({"error": "days должен быть целым числом"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        "llm_rate_limit": get_governor().metrics(),
+        "file_export": get_file_exporter().metrics(),
+        "stages": stage_report(days=days),
+    })
+
+
+def prometheus_metrics_view(request):
+    """Метрики генерации в текстовом формате Prometheus (/metrics)"""
+    return HttpResponse(prometheus_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+def get_job_status(request, job_id):
+    """Возвращает статус задачи генерации и прогресс по этапам"""
+    try:
+        job = GenerationJob.objects.select_related('quest').get(id=job_id)
+        serializer = GenerationJobSerializer(job)
         return Response(serializer.data)
+    except GenerationJob.DoesNotExist:
+        return Response(
+            {"error": "Задача не найдена"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    except Exception as e:
+        return Response(
+            {"error": f"Ошибка получения задачи: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@api_view(['POST'])
+def create_generation_batch(request):
+    """Ставит в очередь пакет генераций: {"name": ..., "items": [{genre, hero, goal, ...}]}
+
+    Элементы выполняют обработчики очереди (run_quest_workers); состояние
+    пакета и каждого элемента - GET /api/batches/<id>/.
+    """
+    try:
+        batch, created = create_batch(request.data.get('items'), name=request.data.get('name') or '')
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response(
+            {"error": f"Внутренняя ошибка сервера: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    print(f"📦 Пакет {batch.id}: поставлено в очередь задач: {created}")
+    return Response({
+        "batch_id": batch.id,
+        "total": created,
+        "status_url": request.build_absolute_uri(reverse('get_generation_batch', args=[batch.id])),
+        "message": "Пакет поставлен в очередь на генерацию"
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+@gzip_page
+@api_view(['GET'])
+def get_generation_batch(request, batch_id):
+    """Состояние пакета генерации и каждого его элемента"""
+    try:
+        batch = GenerationBatch.objects.get(id=batch_id)
+        return Response(GenerationBatchSerializer(batch).data)
+    except GenerationBatch.DoesNotExist:
+        return Response({"error": "Пакет не найден"}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response(
+            {"error": f"Ошибка получения пакета: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@gzip_page
+@api_view(['GET'])
+def get_quests(request):
+    """Получает список квестов постранично (от новых к старым)
+
+    По умолчанию каждый квест - краткая сводка без quest_data. Параметр
+    fields=full возвращает все поля, fields=id,quest_data - только указанные.
+    Следующая страница - по ссылке next (курсор), размер - page_size.
+    Фильтры genre и hero (точное совпадение) используют индексы QuestInput.
+    Страница отдается с ETag; если он совпал с If-None-Match, возвращается 304
+    без сериализации.
+    """
+    try:
+        fields = QuestListSerializer.parse_fields(request.query_params.get('fields'))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        quests = Quest.objects.summaries()
+        if request.query_params.get('genre'):
+            quests = quests.filter(quest_input__genre=request.query_params['genre'])
+        if request.query_params.get('hero'):
+            quests = quests.filter(quest_input__hero=request.query_params['hero'])
+        if 'quest_data' not in fields:
+            quests = quests.defer('quest_data')
+
+        paginator = QuestCursorPagination()
+        page = paginator.paginate_queryset(quests, request)
+        etag = page_etag(request, page)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return set_cache_headers(not_modified, etag)
+        serializer = QuestListSerializer(page, many=True, fields=fields)
+        return set_cache_headers(paginator.get_paginated_response(serializer.data), etag)
+    except APIException as e:
+        # Неверный курсор (NotFound из paginate_queryset) - ошибка запроса, а не сервера
+        return Response({"error": str(e.detail)}, status=e.status_code)
     except Exception as e:
         return Response(
             {"error": f"Ошибка получения квестов: {str(e)}"}, 
@@ -269,6 +225,8 @@ def get_quests(request):
         )
 
 
+@gzip_page
+@conditional_quest_view
 @api_view(['GET'])
 def get_quest_detail(request, quest_id):
     """Получает детали конкретного квеста"""
@@ -288,6 +246,104 @@ def get_quest_detail(request, quest_id):
         )
 
 
+@gzip_page
+@conditional_quest_view
+@api_view(['GET'])
+def get_quest_scene(request, quest_id, scene_id):
+    """Одна сцена квеста с ее выборами (без остальных сцен)"""
+    try:
+        index = get_scene_index(quest_id)
+    except Quest.DoesNotExist:
+        return Response({"error": "Квест не найден"}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response(
+            {"error": f"Ошибка получения сцены: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    scene = index.get(scene_id)
+    if scene is None:
+        return Response({"error": "Сцена не найдена"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"quest_id": quest_id, "scene": scene})
+
+
+@gzip_page
+@conditional_quest_view
+@api_view(['GET'])
+def get_scene_neighborhood(request, quest_id, scene_id):
+    """Сцены в пределах depth переходов от scene_id
+
+    direction=out (по умолчанию) - только вперед по выборам, both - еще и
+    сцены, которые ведут в scene_id. У каждой сцены есть поле distance.
+    """
+    max_depth = getattr(settings, 'QUEST_SCENE_INDEX', {}).get('MAX_NEIGHBORHOOD_DEPTH', 5)
+    try:
+        depth = int(request.query_params.get('depth', 1))
+    except ValueError:
+        return Response({"error": "depth должен быть целым числом"}, status=status.HTTP_400_BAD_REQUEST)
+    if not 0 <= depth <= max_depth:
+        return Response({"error": f"depth должен быть от 0 до {max_depth}"}, status=status.HTTP_400_BAD_REQUEST)
+    direction = request.query_params.get('direction', DIRECTION_OUT)
+    if direction not in DIRECTIONS:
+        return Response({"error": f"direction должен быть одним из: {', '.join(DIRECTIONS)}"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        index = get_scene_index(quest_id)
+    except Quest.DoesNotExist:
+        return Response({"error": "Квест не найден"}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response(
+            {"error": f"Ошибка получения сцен: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    if scene_id not in index:
+        return Response({"error": "Сцена не найдена"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({
+        "quest_id": quest_id,
+        "scene_id": scene_id,
+        "depth": depth,
+        "direction": direction,
+        "scenes": [{**scene, "distance": distance}
+                   for scene, distance in index.neighborhood(scene_id, depth, direction)],
+    })
+
+
+@gzip_page
+@conditional_quest_view
+@api_view(['GET'])
+def quest_analytics_view(request, quest_id):
+    """Структурная статистика квеста и проверка на параметры генерации
+
+    max_depth и ending_type берутся из задачи генерации квеста; параметры
+    запроса с теми же именами их заменяют. Если ни того, ни другого нет,
+    проверяется только структура графа.
+    """
+    try:
+        analytics = get_quest_analytics(quest_id)
+        params = generation_params(quest_id)
+    except Quest.DoesNotExist:
+        return Response({"error": "Квест не найден"}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response(
+            {"error": f"Ошибка анализа квеста: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    max_depth = request.query_params.get('max_depth', params.get('max_depth'))
+    ending_type = request.query_params.get('ending_type', params.get('ending_type'))
+    try:
+        max_depth = int(max_depth) if max_depth not in (None, '') else None
+    except (TypeError, ValueError):
+        return Response({"error": "max_depth должен быть целым числом"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        compliance = check_constraints(analytics, max_depth, ending_type or None)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"quest_id": quest_id, **analytics, "compliance": compliance})
+
+
 @api_view(['POST'])
 @parser_classes([MultiPartParser, FormParser])
 def parse_txt_quest(request):
@@ -309,42 +365,24 @@ def parse_txt_quest(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Читаем содержимое файла
+        # Файл разбирается по кускам, без чтения в память целиком
         try:
-            file_content = uploaded_file.read().decode('utf-8')
+            parsed_data, encoding = parse_uploaded_file(uploaded_file)
         except UnicodeDecodeError:
-            # Пробуем другую кодировку
-            try:
-                uploaded_file.seek(0)
-                file_content = uploaded_file.read().decode('cp1251')
-            except UnicodeDecodeError:
-                return Response(
-                    {"error": "Не удалось прочитать файл. Проверьте кодировку (поддерживается UTF-8 и Windows-1251)"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # Парсим содержимое
-        parsed_data = parse_txt_file(file_content)
-        
-        if parsed_data is None:
             return Response(
-                {"error": "Ошибка парсинга файла"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {"error": "Не удалось прочитать файл. Проверьте кодировку (поддерживается UTF-8 и Windows-1251)"},
+                status=status.HTTP_400_BAD_REQUEST
             )
         
         # Проверяем, что удалось извлечь данные
-        missing_fields = []
-        if not parsed_data['genre']:
-            missing_fields.append('жанр')
-        if not parsed_data['hero']:
-            missing_fields.append('героя')
-        if not parsed_data['goal']:
-            missing_fields.append('цель')
+        missing = missing_fields(parsed_data)
         
-        if missing_fields:
+        if missing:
+            uploaded_file.seek(0)
+            file_content = uploaded_file.read(2048).decode(encoding, errors='ignore')
             return Response(
                 {
-                    "warning": f"Не удалось извлечь: {', '.join(missing_fields)}",
+                    "warning": f"Не удалось извлечь: {', '.join(missing)}",
                     "data": parsed_data,
                     "file_content": file_content[:500] + "..." if len(file_content) > 500 else file_content
                 },
@@ -368,3 +406,290 @@ def parse_txt_quest(request):
             {"error": f"Внутренняя ошибка сервера: {str(e)}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+@api_view(['POST'])
+@parser_classes([MultiPartParser, FormParser])
+def parse_txt_batch(request):
+    """Разбирает несколько txt файлов и zip архивов с txt файлами (поле 'files')
+
+    При generate=true полностью разобранные файлы ставятся в очередь одним
+    пакетом генерации (как POST /api/batches/).
+    """
+    uploaded_files = request.FILES.getlist('files')
+    if not uploaded_files:
+        return Response(
+            {"error": "Файлы не найдены. Загрузите txt файлы или zip архивы в поле 'files'"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        results = parse_uploads(uploaded_files)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        print(f"Ошибка в parse_txt_batch: {e}")
+        import traceback
+        traceback.print_exc()
+        return Response(
+            {"error": f"Внутренняя ошибка сервера: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    counts = {"ok": 0, "partial": 0, "error": 0}
+    for entry in results:
+        counts[entry['status']] += 1
+    response_data = {"results": results, "counts": counts}
+    
+    if str(request.data.get('generate', '')).lower() not in ('1', 'true', 'yes'):
+        return Response(response_data, status=status.HTTP_200_OK)
+    
+    items = [entry['data'] for entry in results if entry['status'] == 'ok']
+    if not items:
+        response_data["warning"] = "Нет полностью разобранных файлов для генерации"
+        return Response(response_data, status=status.HTTP_200_OK)
+    try:
+        batch, created = create_batch(items, name=request.data.get('name') or '')
+    except ValueError as e:
+        return Response({"error": str(e), **response_data}, status=status.HTTP_400_BAD_REQUEST)
+    
+    print(f"📦 Пакет {batch.id} из загруженных файлов: поставлено в очередь задач: {created}")
+    response_data.update({
+        "batch_id": batch.id,
+        "total": created,
+        "status_url": request.build_absolute_uri(reverse('get_generation_batch', args=[batch.id])),
+    })
+    return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
+
+
+def _play_error(error):
+    """Ответ на ошибку сессии: 409 - квест изменился, 400 - остальное"""
+    code = status.HTTP_409_CONFLICT if isinstance(error, StaleSession) else status.HTTP_400_BAD_REQUEST
+    return Response({"error": str(error)}, status=code)
+
+
+@api_view(['POST'])
+def start_play_session(request, quest_id):
+    """Начинает прохождение квеста: начальная сцена и токен сессии"""
+    try:
+        return Response(start_session(quest_id), status=status.HTTP_201_CREATED)
+    except Quest.DoesNotExist:
+        return Response({"error": "Квест не найден"}, status=status.HTTP_404_NOT_FOUND)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+
+@api_view(['GET'])
+def get_play_session(request, session):
+    """Текущая сцена прохождения"""
+    try:
+        return Response(session_state(session))
+    except Quest.DoesNotExist:
+        return Response({"error": "Квест не найден"}, status=status.HTTP_404_NOT_FOUND)
+    except SessionError as e:
+        return _play_error(e)
+
+
+@api_view(['POST'])
+def choose_play_session(request, session):
+    """Ход: {"choice": номер выбора}; в ответе новая сцена и новый токен сессии"""
+    choice = request.data.get('choice')
+    if isinstance(choice, str) and choice.isascii() and choice.isdigit():
+        choice = int(choice)
+    if isinstance(choice, bool) or not isinstance(choice, int) or choice < 0:
+        return Response({"error": "choice должен быть номером выбора (целым числом от 0)"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(choose(session, choice))
+    except Quest.DoesNotExist:
+        return Response({"error": "Квест не найден"}, status=status.HTTP_404_NOT_FOUND)
+    except SessionError as e:
+        return _play_error(e)
+
+
+_async_generation_slots = weakref.WeakKeyDictionary()
+
+
+def _get_async_generation_slots():
+    """Семафор текущего event loop, ограничивающий число одновременных генераций"""
+    loop = asyncio.get_running_loop()
+    slots = _async_generation_slots.get(loop)
+    if slots is None:
+        slots = asyncio.Semaphore(getattr(settings, 'QUEST_ASYNC_MAX_CONCURRENCY', 200))
+        _async_generation_slots[loop] = slots
+    return slots
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def generate_quest_async(request):
+    """Генерирует квест прямо в запросе, не занимая поток (для ASGI)"""
+    try:
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({"error": "Некорректный JSON в теле запроса"}, status=400)
+
+        genre = data.get('genre')
+        hero = data.get('hero')
+        goal = data.get('goal')
+
+        if not all([genre, hero, goal]):
+            return JsonResponse({"error": "Необходимо указать genre, hero и goal"}, status=400)
+
+        cache_hits = []
+        runs = []
+
+        def on_progress(stage, status, info=None):
+            if status == "cached":
+                cache_hits.append(stage)
+
+        async with _get_async_generation_slots():
+            generator = get_quest_generator()
+            quest_data = await generator.agenerate_quest(
+                genre=genre,
+                hero=hero,
+                goal=goal,
+                scene_count=data.get('scene_count', 10),
+                max_depth=data.get('max_depth', 5),
+                complexity=data.get('complexity', 'medium'),
+                ending_type=data.get('ending_type', 'single'),
+                use_cache=data.get('use_cache', True),
+                progress_callback=on_progress,
+                run_callback=runs.append
+            )
+
+        if 'error' in quest_data:
+            print(f"Ошибка генерации: {quest_data['error']}")
+            return JsonResponse({"error": quest_data['error']}, status=500)
+
+        quest, saved_file = await astore_quest(quest_data, genre, hero, goal, run=runs[0] if runs else None)
+
+        return JsonResponse(
+            {
+                "id": quest.id,
+                "quest_data": quest_data,
+                "saved_file": saved_file or "Не удалось сохранить",
+                "cached": bool(cache_hits),
+                "message": "Квест успешно сгенерирован"
+            },
+            json_dumps_params={"ensure_ascii": False}
+        )
+
+    except Exception as e:
+        print(f"Ошибка в generate_quest_async: {e}")
+        import traceback
+        traceback.print_exc()
+        return JsonResponse({"error": f"Внутренняя ошибка сервера: {str(e)}"}, status=500)
+
+
+SSE_KEEPALIVE_INTERVAL = 15  # сек
+
+
+def _sse_event(event, data):
+    """Одно событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _read_stream_params(request):
+    """Параметры генерации: JSON в теле POST или строка запроса GET (для EventSource)"""
+    if request.method == 'GET':
+        data = request.GET.dict()
+        data['use_cache'] = data.get('use_cache', 'true').lower() not in ('0', 'false', 'no')
+        return data
+    return json.loads(request.body or b'{}')
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def generate_quest_stream(request):
+    """Генерирует квест, передавая ход генерации потоком Server-Sent Events
+
+    События: stage (смена статуса этапа), scene (сцена этапа 3, как только
+    модель ее дописала), quest (сохраненный квест) или error.
+    """
+    try:
+        data = _read_stream_params(request)
+    except ValueError:
+        return JsonResponse({"error": "Некорректный JSON в теле запроса"}, status=400)
+
+    genre = data.get('genre')
+    hero = data.get('hero')
+    goal = data.get('goal')
+
+    if not all([genre, hero, goal]):
+        return JsonResponse({"error": "Необходимо указать genre, hero и goal"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def publish(event, payload=None):
+        # Поиск в кэше результатов сообщает о прогрессе из потока sync_to_async
+        loop.call_soon_threadsafe(events.put_nowait, (event, payload))
+
+    def on_progress(stage, status, info=None):
+        publish("stage", {"stage": stage, "status": status, "info": info or {}})
+
+    runs = []
+
+    async def generate():
+        try:
+            async with _get_async_generation_slots():
+                generator = get_quest_generator()
+                quest_data = await generator.agenerate_quest(
+                    genre=genre,
+                    hero=hero,
+                    goal=goal,
+                    scene_count=data.get('scene_count', 10),
+                    max_depth=data.get('max_depth', 5),
+                    complexity=data.get('complexity', 'medium'),
+                    ending_type=data.get('ending_type', 'single'),
+                    use_cache=data.get('use_cache', True),
+                    progress_callback=on_progress,
+                    scene_callback=lambda scene: publish("scene", scene),
+                    run_callback=runs.append
+                )
+
+            if 'error' in quest_data:
+                print(f"Ошибка генерации: {quest_data['error']}")
+                publish("error", {"error": quest_data['error']})
+                return
+
+            quest, saved_file = await astore_quest(quest_data, genre, hero, goal,
+                                                   run=runs[0] if runs else None)
+            publish("quest", {
+                "id": quest.id,
+                "quest_data": quest_data,
+                "saved_file": saved_file or "Не удалось сохранить",
+            })
+        except Exception as e:
+            print(f"Ошибка в generate_quest_stream: {e}")
+            import traceback
+            traceback.print_exc()
+            publish("error", {"error": f"Внутренняя ошибка сервера: {str(e)}"})
+        finally:
+            publish(None)
+
+    async def stream():
+        task = asyncio.create_task(generate())
+        try:
+            while True:
+                try:
+                    event, payload = await asyncio.wait_for(events.get(), SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Комментарий не дает прокси закрыть соединение во время долгих этапов
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield _sse_event(event, payload)
+        finally:
+            if not task.done():
+                # Клиент отключился - прерываем генерацию, чтобы не тратить токены
+                task.cancel()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
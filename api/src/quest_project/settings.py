@@ -86,6 +86,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Обработчики очереди и потоки пакетной генерации пишут одновременно:
+        # транзакции сразу берут блокировку записи и ждут ее, а не падают
+        # с "database is locked" при повышении блокировки
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -156,3 +163,149 @@ LLM_CONFIG = {
     'temperature': 0.7,
     'max_tokens': 100000,
 }
+
+# Ограничение обращений к LLM на процесс (см. quest_app/rate_limit.py):
+# 0 - без ограничения. Значения подбираются под тариф провайдера, чтобы
+# генерации ждали в очереди, а не получали 429
+QUEST_LLM_RATE_LIMIT = {
+    'REQUESTS_PER_SECOND': float(os.getenv('QUEST_LLM_REQUESTS_PER_SECOND', '0')),
+    'TOKENS_PER_MINUTE': int(os.getenv('QUEST_LLM_TOKENS_PER_MINUTE', '0')),
+    'MAX_CONCURRENCY': int(os.getenv('QUEST_LLM_MAX_CONCURRENCY', '0')),
+    'MAX_RETRIES': 5,          # повторов после 429
+    'BACKOFF_BASE': 1.0,       # сек, задержка удваивается с каждым повтором
+    'BACKOFF_MAX': 60.0,       # сек
+}
+
+# Метрики генерации (см. quest_app/instrumentation.py): агрегаты по таблицам
+# GenerationRun/GenerationStageRun для /metrics кэшируются в процессе на
+# PROMETHEUS_CACHE_TTL секунд, чтобы частый опрос не нагружал базу
+QUEST_METRICS = {
+    'PROMETHEUS_CACHE_TTL': 5,   # сек, 0 - считать на каждый запрос
+}
+
+# Сжатие данных между этапами генерации (см. quest_app/prompt_compaction.py):
+# этапы получают только нужные поля в построчной записи. BUDGETS - предел
+# токенов входа этапа, при превышении описания сцен сокращаются (0 - без
+# предела). TOKENIZER - путь к tokenizer.json модели для точного подсчета
+QUEST_PROMPT_COMPACTION = {
+    'ENABLED': os.getenv('QUEST_PROMPT_COMPACTION', 'True').lower() == 'true',
+    'TOKENIZER': os.getenv('QUEST_PROMPT_TOKENIZER', ''),
+    'BUDGETS': {
+        'planning': int(os.getenv('QUEST_PLANNING_PROMPT_BUDGET', '4000')),
+        'content': int(os.getenv('QUEST_CONTENT_PROMPT_BUDGET', '6000')),
+        'validation': 0,
+    },
+}
+
+# Очередь фоновой генерации (python manage.py run_quest_workers)
+QUEST_JOBS = {
+    'WORKERS': int(os.getenv('QUEST_WORKERS', '2')),
+    'POLL_INTERVAL': 1.0,     # пауза между опросами пустой очереди, сек
+    'STALE_TIMEOUT': 900,     # задача без отчета о прогрессе возвращается в очередь, сек
+    'MAX_ATTEMPTS': 3,
+}
+
+# Пакетная генерация (POST /api/batches/, python manage.py generate_quests):
+# CONCURRENCY - потоков в команде, готовые квесты сохраняются пачками по
+# FLUSH_SIZE или не реже раза в FLUSH_INTERVAL секунд
+QUEST_BATCH = {
+    'MAX_ITEMS': 1000,
+    'CONCURRENCY': int(os.getenv('QUEST_BATCH_CONCURRENCY', '4')),
+    'FLUSH_SIZE': 20,
+    'FLUSH_INTERVAL': 30.0,
+}
+
+# Выгрузка квестов в JSON файлы (см. file_export.py). MODE: background - запись
+# в фоновом потоке (ответ не ждет диска), sync - запись сразу. FORMAT: json -
+# файл на квест в каталогах <дата>/<2 hex>/, jsonl - сегменты по часам
+# (COMPRESSION: none или gzip)
+QUEST_FILE_EXPORT = {
+    'MODE': os.getenv('QUEST_FILE_EXPORT_MODE', 'background'),
+    'FORMAT': os.getenv('QUEST_FILE_EXPORT_FORMAT', 'json'),
+    'COMPRESSION': os.getenv('QUEST_FILE_EXPORT_COMPRESSION', 'none'),
+    'QUEUE_SIZE': 1000,      # квестов; при заполнении запись идет в вызывающем потоке
+    'PUT_TIMEOUT': 5.0,      # сек ожидания места в очереди
+    'BATCH_SIZE': 50,
+    'CLOSE_TIMEOUT': 30.0,   # сек на запись очереди при завершении процесса
+    'LOCATION': BASE_DIR.parent / 'output',
+}
+
+# Пакетная загрузка txt файлов и zip архивов (POST /api/parse-txt/batch/):
+# ограничения числа txt файлов (в том числе внутри архивов) и их объема
+QUEST_TXT_UPLOAD = {
+    'MAX_FILES': int(os.getenv('QUEST_TXT_UPLOAD_MAX_FILES', '500')),
+    'MAX_FILE_SIZE': 20 * 1024 * 1024,     # байт, после распаковки
+    'MAX_TOTAL_SIZE': 200 * 1024 * 1024,   # байт, после распаковки
+}
+DATA_UPLOAD_MAX_NUMBER_FILES = QUEST_TXT_UPLOAD['MAX_FILES']
+
+# Асинхронная генерация под ASGI (POST /api/generate/async/):
+# ограничение числа одновременных генераций на один процесс
+QUEST_ASYNC_MAX_CONCURRENCY = int(os.getenv('QUEST_ASYNC_MAX_CONCURRENCY', '200'))
+
+# Кодек JSON для UnicodeJSONField (Quest.quest_data): auto (orjson, если
+# установлен, иначе json), orjson или json
+QUEST_JSON_CODEC = os.getenv('QUEST_JSON_CODEC', 'auto')
+
+# Сжатое хранение Quest.quest_data. ALGORITHM: none (без сжатия), zlib или
+# zstd (нужен пакет zstandard). DICTIONARY - использовать общий словарь,
+# обученный командой compress_quest_data --train; значения короче MIN_SIZE
+# байт не сжимаются
+QUEST_DATA_COMPRESSION = {
+    'ALGORITHM': os.getenv('QUEST_DATA_COMPRESSION', 'none'),
+    'LEVEL': None,  # по умолчанию zlib - 9, zstd - 12
+    'DICTIONARY': True,
+    'MIN_SIZE': 1024,
+}
+
+# Копировать сцены и выборы квеста в таблицы QuestScene/QuestChoice при
+# сохранении (запросы по графу в SQL, выборка отдельных сцен)
+QUEST_SCENE_TABLES = os.getenv('QUEST_SCENE_TABLES', 'True').lower() == 'true'
+
+# HTTP-кэширование ответов с квестами (ETag/Last-Modified, см. http_cache.py):
+# сколько секунд клиент может не перепроверять ответ (0 - проверять всегда)
+QUEST_HTTP_CACHE = {
+    'MAX_AGE': int(os.getenv('QUEST_HTTP_CACHE_MAX_AGE', '0')),
+}
+
+# Кэш индексов сцен для /api/quests/<id>/scenes/... (в памяти процесса)
+QUEST_SCENE_INDEX = {
+    'MAX_ENTRIES': 256,          # квестов в кэше
+    'TTL': 600,                  # сек
+    'MAX_NEIGHBORHOOD_DEPTH': 5,
+}
+
+# Кэш структурной аналитики квестов для /api/quests/<id>/analytics/
+# (в памяти процесса, см. quest_analytics.py)
+QUEST_ANALYTICS = {
+    'MAX_ENTRIES': 1024,         # квестов в кэше
+    'TTL': 3600,                 # сек
+}
+
+# Прохождение квестов на сервере (/api/quests/<id>/play/, см. quest_runtime.py):
+# кэш скомпилированных квестов в памяти процесса и срок жизни токена сессии
+QUEST_RUNTIME = {
+    'MAX_ENTRIES': 1024,                 # квестов в кэше
+    'TTL': 3600,                         # сек
+    'SESSION_MAX_AGE': 7 * 24 * 3600,    # сек без ходов, после которых сессия недействительна
+}
+
+# Кэш результатов генерации по нормализованным входным параметрам.
+# BACKEND: memory (память процесса), database (таблица CachedResult),
+# filesystem (каталог LOCATION) или none (кэш отключен)
+QUEST_RESULT_CACHE = {
+    'BACKEND': os.getenv('QUEST_RESULT_CACHE_BACKEND', 'memory'),
+    'TTL': int(os.getenv('QUEST_RESULT_CACHE_TTL', str(7 * 24 * 3600))),  # сек
+    'MAX_ENTRIES': int(os.getenv('QUEST_RESULT_CACHE_MAX_ENTRIES', '1000')),
+    'LOCATION': BASE_DIR.parent / 'cache',
+}
+
+# Контрольные точки этапов генерации: повторная попытка продолжает с последнего
+# успешного этапа. Хранилища те же, что у QUEST_RESULT_CACHE; чтобы задачи
+# очереди продолжались после перезапуска обработчика, используйте database
+QUEST_STAGE_CHECKPOINTS = {
+    'BACKEND': os.getenv('QUEST_STAGE_CHECKPOINTS_BACKEND', 'memory'),
+    'TTL': 24 * 3600,  # сек
+    'MAX_ENTRIES': 500,
+    'LOCATION': BASE_DIR.parent / 'cache',
+}
@@ -17,7 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from quest_app.views import prometheus_metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('quest_app.urls')),
+    path('metrics', prometheus_metrics_view, name='prometheus-metrics'),
 ]